@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the training harness (`tc_formation.training`) against plain `model.fit`
+on synthetic patches, with the ResNet patch classifier.
+
+For instance:
+    python scripts/benchmark_training.py --patch-size 31 --channels 13 --epochs 5
+
+Steps per second are wall-clock, CPU time per step is the time spent by all threads of the process,
+which is less noisy on shared machines.
+"""
+from __future__ import annotations
+
+import argparse
+import time
+
+
+def parse_arguments(args=None):
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--patch-size',
+        type=int,
+        default=31,
+        help='Size of the patches. Default to 31.')
+    parser.add_argument(
+        '--channels',
+        type=int,
+        default=13,
+        help='Number of channels. Default to 13.')
+    parser.add_argument(
+        '--starting-channels',
+        type=int,
+        default=16,
+        help='Channels of the first ResNet stack. Default to 16.')
+    parser.add_argument(
+        '--blocks',
+        type=int,
+        nargs='*',
+        default=[1, 1],
+        help='Number of residual blocks of each stack. Default to 1 1.')
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=64,
+        help='Batch size. Default to 64.')
+    parser.add_argument(
+        '--steps',
+        type=int,
+        default=64,
+        help='Number of steps per epoch. Default to 64.')
+    parser.add_argument(
+        '--epochs',
+        type=int,
+        default=5,
+        help='Number of epochs, the first one is not measured. Default to 5.')
+    parser.add_argument(
+        '--steps-per-execution',
+        type=int,
+        default=32,
+        help='Steps per execution of the harness. Default to 32.')
+    parser.add_argument(
+        '--jit-compile',
+        choices=['auto', 'true', 'false'],
+        default='auto',
+        help='XLA compilation of the harness. Default to auto.')
+    parser.add_argument(
+        '--mixed-precision',
+        choices=['auto', 'true', 'false'],
+        default='auto',
+        help='bfloat16 mixed precision of the harness. Default to auto.')
+
+    return parser.parse_args(args)
+
+
+def _flag(value: str) -> bool | str:
+    return value if value == 'auto' else value == 'true'
+
+
+def main(args=None):
+    args = parse_arguments(args)
+
+    import numpy as np
+    import tensorflow as tf
+    import tensorflow.keras as keras
+    from tc_formation import training
+    from tc_formation.models.resnet_configurable import ConfigurableResNet
+
+    nb_samples = args.steps * args.batch_size
+    input_shape = (args.patch_size, args.patch_size, args.channels)
+    X = tf.random.normal((nb_samples,) + input_shape)
+    y = tf.cast(tf.random.uniform((nb_samples, 1)) > 0.5, tf.float32)
+
+    def dataset():
+        # Like the data loaders, the pipeline ends in `prefetch(1)`.
+        return tf.data.Dataset.from_tensor_slices((X, y)).map(lambda X, y: (X, y)).batch(args.batch_size).prefetch(1)
+
+    def model_fn():
+        return ConfigurableResNet(
+            input_shape=input_shape,
+            classes=1,
+            classifier_activation='sigmoid',
+            starting_channels=args.starting_channels,
+            blocks=args.blocks)
+
+    def compile_kwargs():
+        return dict(
+            optimizer='adam',
+            loss=keras.losses.BinaryCrossentropy(),
+            metrics=[
+                keras.metrics.BinaryAccuracy(),
+                keras.metrics.Precision(name='precision'),
+                keras.metrics.Recall(name='recall'),
+            ])
+
+    class CPUTime(keras.callbacks.Callback):
+        def __init__(self):
+            super().__init__()
+            self.ms_per_step = []
+
+        def on_epoch_begin(self, epoch, logs=None):
+            self._start = time.process_time()
+
+        def on_epoch_end(self, epoch, logs=None):
+            self.ms_per_step.append(1000 * (time.process_time() - self._start) / args.steps)
+
+    results = {}
+
+    # Baseline: plain `model.fit`.
+    tf.random.set_seed(0)
+    model = model_fn()
+    model.compile(**compile_kwargs())
+    steps_per_second, cpu_time = training.StepsPerSecond(), CPUTime()
+    model.fit(dataset(), epochs=args.epochs, callbacks=[steps_per_second, cpu_time], verbose=0)
+    results['model.fit'] = steps_per_second.mean(), np.median(cpu_time.ms_per_step[1:])
+
+    # Training harness.
+    tf.random.set_seed(0)
+    config = training.TrainingConfig(
+        steps_per_execution=args.steps_per_execution,
+        jit_compile=_flag(args.jit_compile),
+        mixed_precision=_flag(args.mixed_precision))
+    model = training.build_model(model_fn, config)
+    training.compile_model(model, config, sample_batch=X[:args.batch_size], **compile_kwargs())
+    cpu_time = CPUTime()
+    history = training.fit(model, dataset(), config, epochs=args.epochs, callbacks=[cpu_time], verbose=0)
+    results['harness'] = (float(np.mean(history.history['steps_per_second'][1:])),
+                          np.median(cpu_time.ms_per_step[1:]))
+
+    print(f'Harness: {config}, bfloat16 supported: {training.bfloat16_supported()}')
+    for name, (steps_per_second, ms_per_step) in results.items():
+        print(f'{name:>10}: {steps_per_second:.1f} steps/s, {ms_per_step:.1f} CPU ms/step')
+
+
+if __name__ == '__main__':
+    main()
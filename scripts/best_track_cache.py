@@ -0,0 +1,224 @@
+"""
+Typed, cached ingest of best track data.
+
+Each best track source (IBTrACS .csv, JTWC .dat files or TheAnh's track files)
+is parsed only once into a Parquet file with normalised columns:
+    * SID: storm id.
+    * Date: datetime64 of the observation.
+    * LAT, LON: float32, longitude is converted to 0E - 360E.
+    * BASIN, NATURE: categorical.
+    * WIND: float32 maximum sustained wind (knots), NaN when not available.
+
+The cache file is keyed by the hash of the source files' content,
+so modifying (or re-downloading) the best track invalidates the cache automatically.
+"""
+from __future__ import annotations
+
+import glob
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+
+
+COLUMNS = ['SID', 'Date', 'LAT', 'LON', 'BASIN', 'NATURE', 'WIND']
+CACHE_DIRNAME = '.best_track_cache'
+IBTRACS_DATE_FMT = '%Y-%m-%d %H:%M:%S'
+IBTRACS_COLUMNS = ['SID', 'ISO_TIME', 'LAT', 'LON', 'BASIN', 'NATURE', 'WMO_WIND', 'USA_WIND']
+JTWC_COLUMNS = [
+    "BASIN" , "CY" , "YYYYMMDDHH" , "TECHNUM" , "TECH" , "TAU" , "LatN/S" , "LonE/W" , "VMAX" , "MSLP" ,
+    "TY" , "RAD" , "WINDCODE" , "RAD1" , "RAD2" , "RAD3" , "RAD4" , "RADP" , "RRP" , "MRD" , "GUSTS" , "EYE" ,
+    "SUBREGION" , "MAXSEAS" , "INITIALS" , "DIR" , "SPEED" , "STORMNAME" , "DEPTH" , "SEAS" ,
+    "SEASCODE" , "SEAS1" , "SEAS2" , "SEAS3" , "SEAS4"
+]
+
+
+def hash_files(paths: list[str]) -> str:
+    sha = hashlib.sha1()
+    for path in sorted(paths):
+        sha.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+def normalise_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Make sure the dataframe follows the normalised schema,
+    missing columns are filled with NaN.
+    """
+    df = df.reindex(columns=COLUMNS)
+    df['SID'] = df['SID'].astype(str)
+    df['Date'] = pd.to_datetime(df['Date'])
+    for col in ['LAT', 'LON', 'WIND']:
+        df[col] = df[col].astype(np.float32)
+    for col in ['BASIN', 'NATURE']:
+        df[col] = df[col].astype('category')
+
+    return df.reset_index(drop=True)
+
+
+def to_float64(values: pd.Series, decimals: int = 4) -> np.ndarray:
+    """
+    Convert float32 coordinates back to float64 values as written in the source,
+    which have at most 4 decimals, so they are printed nicely in label files.
+    """
+    return values.to_numpy(dtype=np.float64).round(decimals)
+
+
+def convert_longitude(lon: pd.Series) -> pd.Series:
+    """
+    Convert longitude from 0E to -180W to 0E to 360E.
+    """
+    return lon.where(lon > 0, lon + 360)
+
+
+def parse_ibtracs(path: str) -> pd.DataFrame:
+    # The second row of IBTrACS contains units, so we skip it.
+    df = pd.read_csv(
+        path,
+        skiprows=(1,),
+        usecols=lambda col: col in IBTRACS_COLUMNS,
+        keep_default_na=False,
+        low_memory=False)
+
+    # Prefer WMO wind, fallback to USA agencies' wind when it is not reported.
+    wind = pd.Series(np.nan, index=df.index)
+    for col in ['WMO_WIND', 'USA_WIND']:
+        if col in df.columns:
+            wind = wind.fillna(pd.to_numeric(df[col], errors='coerce'))
+
+    return normalise_columns(pd.DataFrame({
+        'SID': df['SID'],
+        'Date': pd.to_datetime(df['ISO_TIME'], format=IBTRACS_DATE_FMT),
+        'LAT': pd.to_numeric(df['LAT'], errors='coerce'),
+        'LON': convert_longitude(pd.to_numeric(df['LON'], errors='coerce')),
+        'BASIN': df['BASIN'],
+        'NATURE': df['NATURE'],
+        'WIND': wind,
+    }))
+
+
+def parse_jtwc(paths: list[str]) -> pd.DataFrame:
+    """
+    Parse JTWC best track .dat files.
+    Documentation of all the columns' meaning is on: https://www.metoc.navy.mil/jtwc/jtwc.html?western-pacific
+    """
+    storms = []
+    for path in paths:
+        df = pd.read_csv(
+            path,
+            names=JTWC_COLUMNS,
+            usecols=['BASIN', 'YYYYMMDDHH', 'LatN/S', 'LonE/W', 'VMAX', 'TY'],
+            delimiter=',',
+            index_col=False,
+            skipinitialspace=True,
+            dtype=str)
+
+        # Each file contains one storm, the file is named like `bwp012008.dat`.
+        name, _ = os.path.splitext(os.path.basename(path))
+        df['SID'] = name[1:].upper()
+        storms.append(df)
+
+    df = pd.concat(storms, ignore_index=True)
+
+    lat = df['LatN/S'].str.strip()
+    lon = df['LonE/W'].str.strip()
+    lat_value = lat.str[:-1].astype(float) / 10
+    lon_value = lon.str[:-1].astype(float) / 10
+
+    df = pd.DataFrame({
+        'SID': df['SID'],
+        'Date': pd.to_datetime(df['YYYYMMDDHH'].str.strip(), format='%Y%m%d%H'),
+        'LAT': lat_value.where(lat.str.endswith('N'), -lat_value),
+        'LON': lon_value.where(lon.str.endswith('E'), 360 - lon_value),
+        'BASIN': df['BASIN'].str.strip(),
+        'NATURE': df['TY'].str.strip(),
+        'WIND': pd.to_numeric(df['VMAX'], errors='coerce'),
+    })
+
+    # Each time step is repeated for each wind radii (34, 50, 64kt).
+    df = df.drop_duplicates(['SID', 'Date'], keep='first')
+    return normalise_columns(df.sort_values(['Date', 'SID'], kind='stable'))
+
+
+def parse_theanh(paths: list[str]) -> pd.DataFrame:
+    def parse_year(file_path):
+        # Year is either the suffix of the parent directory, or of the file name.
+        parent_dir = os.path.dirname(file_path).split(os.path.sep)[-1]
+        try:
+            return int(parent_dir.split('_')[-1])
+        except ValueError:
+            name, _ = os.path.splitext(os.path.basename(file_path))
+            return int(name.split('_')[-1])
+
+    storms = []
+    for path in paths:
+        year = parse_year(path)
+        df = pd.read_csv(
+            path,
+            names=['Days', 'StormId', 'LON', 'LAT'],
+            delim_whitespace=True,
+            usecols=list(range(4)),
+        )
+
+        # 121 corresponds to May 1st, 153 corresponds to Jun 2nd,
+        # so we have to minus 1 from the days since new year.
+        df['Date'] = (pd.Timestamp(year, 1, 1)
+                      + pd.to_timedelta(df['Days'] - 1, unit='D').dt.round('us'))
+        df['SID'] = f'{year}-' + df['StormId'].astype(str)
+        storms.append(df[['SID', 'Date', 'LAT', 'LON']])
+
+    df = pd.concat(storms).sort_values('Date', kind='stable')
+    return normalise_columns(df)
+
+
+def load_cached(kind: str, paths: list[str], parse_fn, cache_dir: str = None) -> pd.DataFrame:
+    assert len(paths) > 0, f'No best track files found for {kind}.'
+    paths = sorted(paths)
+
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(paths[0])), CACHE_DIRNAME)
+
+    cache_path = os.path.join(cache_dir, f'{kind}_{hash_files(paths)}.parquet')
+    if os.path.isfile(cache_path):
+        return pd.read_parquet(cache_path)
+
+    df = parse_fn(paths)
+
+    # Write to a temporary file first,
+    # so concurrent readers never see a partially written cache.
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, cache_path)
+
+    return df
+
+
+def load_ibtracs(path: str, cache_dir: str = None) -> pd.DataFrame:
+    assert os.path.isfile(path), f'Invalid path to IBTrACS best track: {path}'
+    return load_cached('ibtracs', [path], lambda paths: parse_ibtracs(paths[0]), cache_dir)
+
+
+def load_jtwc(best_track_folder: str, basins: list[str], cache_dir: str = None) -> pd.DataFrame:
+    paths = sum((glob.glob(os.path.join(best_track_folder, f'b{basin.lower()}*'))
+                 for basin in basins), [])
+    return load_cached('jtwc', paths, parse_jtwc, cache_dir)
+
+
+def load_theanh(files_pattern: str, cache_dir: str = None) -> pd.DataFrame:
+    paths = glob.glob(files_pattern)
+    return load_cached('theanh', paths, parse_theanh, cache_dir)
+
+
+def load_best_track(path: str, cache_dir: str = None) -> pd.DataFrame:
+    """
+    Load best track from either IBTrACS .csv file or files pattern of TheAnh's best track.
+    """
+    if os.path.isfile(path):
+        return load_ibtracs(path, cache_dir)
+
+    return load_theanh(path, cache_dir)
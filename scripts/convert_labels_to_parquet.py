@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+"""
+This script converts .csv label files (labels v4+ or time range labels)
+into .parquet label files.
+Multi-valued columns such as "Other TC Locations" are stored as list columns,
+so the data loaders don't have to parse stringified Python lists every time.
+The output file is placed next to the input file, with .parquet extension.
+"""
+
+import argparse
+import os
+import pandas as pd
+from tc_formation.data.label import save_label_parquet
+
+
+DATE_COLUMNS = ['Date', 'First Observed', 'Last Observed', 'Developing Date']
+
+
+def parse_arguments(args=None):
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        'labels',
+        nargs='+',
+        help='Path to .csv label files.')
+
+    return parser.parse_args(args)
+
+
+def convert(label_path: str) -> str:
+    label = pd.read_csv(label_path)
+    for col in DATE_COLUMNS:
+        if col in label.columns:
+            label[col] = pd.to_datetime(label[col])
+
+    output_path = f'{os.path.splitext(label_path)[0]}.parquet'
+    save_label_parquet(label, output_path)
+    return output_path
+
+
+def main(args=None):
+    args = parse_arguments(args)
+
+    for label_path in args.labels:
+        output_path = convert(label_path)
+        print(f'DONE: {label_path} -> {output_path}')
+
+
+if __name__ == '__main__':
+    main()
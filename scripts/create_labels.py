@@ -15,11 +15,17 @@ Update:
 import argparse
 from datetime import datetime, timedelta
 import glob
+import numpy as np
 import os
 import pandas as pd
 import re
 from typing import Tuple, List
 
+try:
+    from . import best_track_cache
+except ImportError:
+    import best_track_cache
+
 
 def parse_arguments(args=None):
     parser = argparse.ArgumentParser()
@@ -127,36 +133,17 @@ def get_best_track_year_range_jtwc(best_track_folder, basins: List[str]):
     return datetime(int(years[0]), 1, 1), datetime(int(years[-1]), 12, 31)
 
 def get_best_track_year_range_ibtracs(best_track_path: str, basins: List[str]):
-    best_track = pd.read_csv(best_track_path)
+    best_track = best_track_cache.load_ibtracs(best_track_path)
     best_track = best_track[best_track['BASIN'].isin([b.upper() for b in basins])]
-    dates = pd.to_datetime(best_track['ISO_TIME'], format='%Y-%m-%d %H:%M:%S')
+    dates = best_track['Date']
     return dates.iloc[0], dates.iloc[-1]
 
-def load_best_track(best_track_path) -> pd.DataFrame:
+def load_best_track(best_track_folder: str, basins: List[str]) -> pd.DataFrame:
     """
-    Load best track .dat file as pandas Dataframe.
-    Documentation of all the columns' meaning is on: https://www.metoc.navy.mil/jtwc/jtwc.html?western-pacific
+    Load all best track .dat files of the given basins as pandas Dataframe.
+    The parsed tracks are cached, see `best_track_cache` for the normalised columns.
     """
-    def convert_latitude(latitude: str):
-        value = float(''.join(list(latitude)[:-1]))
-        return (value / 10) * (1 if latitude.endswith('N') else -1)
-
-    def convert_longitude(longitude: str):
-        value = float(''.join(list(longitude)[:-1]))
-        return value / 10 if longitude.endswith('E') else 360 - value / 10
-
-    columns = [
-        "BASIN" , "CY" , "YYYYMMDDHH" , "TECHNUM" , "TECH" , "TAU" , "LatN/S" , "LonE/W" , "VMAX" , "MSLP" ,
-        "TY" , "RAD" , "WINDCODE" , "RAD1" , "RAD2" , "RAD3" , "RAD4" , "RADP" , "RRP" , "MRD" , "GUSTS" , "EYE" ,
-        "SUBREGION" , "MAXSEAS" , "INITIALS" , "DIR" , "SPEED" , "STORMNAME" , "DEPTH" , "SEAS" ,
-        "SEASCODE" , "SEAS1" , "SEAS2" , "SEAS3" , "SEAS4"
-    ]
-        
-    df = pd.read_csv(best_track_path, names=columns, delimiter=',', index_col=False, skipinitialspace=True)
-    df['LatN/S'] = df['LatN/S'].apply(convert_latitude)
-    df['LonE/W'] = df['LonE/W'].apply(convert_longitude)
-
-    return df
+    return best_track_cache.load_jtwc(best_track_folder, basins)
 
 # def filter_tc_in_domain(best_track: pd.DataFrame, latitude: Tuple[int, int], longitude: Tuple[int, int]):
 #     in_latitude = (best_track['Latitude'] > latitude[0]) & (best_track['Latitude'] < latitude[1])
@@ -167,51 +154,45 @@ def load_best_track(best_track_path) -> pd.DataFrame:
 # TODO: right now, I will just use the first row of the best track,
 # and I will consider it as tropical cyclones,
 # even though it's just a tropical disturbances, and might not evolve into tropical cyclones later.
+def extract_tropical_cyclones(tc_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Summarise each storm in the best track into one row.
+    """
+    tc_df = tc_df.sort_values(['SID', 'Date'], kind='stable')
+    first_rows = tc_df.drop_duplicates('SID', keep='first').set_index('SID')
+    last_rows = tc_df.drop_duplicates('SID', keep='last').set_index('SID')
+
+    # The time that this disturbance is a tropical cyclone.
+    tc_period = tc_df[tc_df['NATURE'].isin(['TC', 'TS'])]
+    developing_date = tc_period.drop_duplicates('SID', keep='first').set_index('SID')['Date']
+
+    return pd.DataFrame({
+        'Id': first_rows.index,
+        'Latitude': first_rows['LAT'].values,
+        'Longitude': first_rows['LON'].values,
+        'First Observed': first_rows['Date'].values,
+        'Last Observed': last_rows['Date'].values,
+        'First Observed Type': first_rows['NATURE'].astype(object).values,
+        'Developing to TC': first_rows.index.isin(developing_date.index),
+        'Developing Date': developing_date.reindex(first_rows.index).values,
+    })
+
 def extract_tropical_cyclones_from_jtwc_best_track(best_track_folder: str, latitude: Tuple[int, int], longitude: Tuple[int, int], basins: List[str]):
-    def extract_tc_information(tc_id: str, best_track: pd.DataFrame):
-        def parse_date(date):
-            return datetime.strptime(str(date), '%Y%m%d%H')
-
-        first_row = best_track.iloc[0]
-        last_row = best_track.iloc[-1]
-
-        # The time that this disturbance is a tropical cyclone.
-        tc_period = best_track[best_track['TY'].isin(['TC', 'TS'])]
-
-        return {
-            'Id': tc_id,
-            'Latitude': first_row['LatN/S'],
-            'Longitude': first_row['LonE/W'],
-            'First Observed': parse_date(first_row['YYYYMMDDHH']),
-            'Last Observed': parse_date(last_row['YYYYMMDDHH']),
-            'First Observed Type': first_row['TY'],
-            'Developing to TC': len(tc_period) > 0,
-            'Developing Date': parse_date(tc_period.iloc[0]['YYYYMMDDHH']) if len(tc_period) > 0 else None
-        }
+    tc_df = load_best_track(best_track_folder, basins)
 
-def load_ibtracs_best_track(path, latitude_limits, longitude_limits, basins: List[str]):
-    def convert_latitude(latitude):
-        # FIXME:
-        # Right now, just leave it as is.
-        # As we are currently dealing with Pacific Ocean only.
-        return latitude
+    mask = (latitude[0] < tc_df['LAT']) & (tc_df['LAT'] < latitude[1])
+    mask &= (longitude[0] < tc_df['LON']) & (tc_df['LON'] < longitude[1])
+    tc_df = tc_df[mask]
 
-    def convert_longitude(longitude):
-        # East will be positive from 0 to 180E
-        # West will be negative from 0 to -180W
-        # All these will be converted to 0 to 360,
-        # with 0 - 180 belongs to East, and 180 to 360 belongs to West
-        return longitude if longitude > 0 else 360 + longitude
+    return extract_tropical_cyclones(tc_df)
 
-    tc_df = pd.read_csv(path)
+def load_ibtracs_best_track(path, latitude_limits, longitude_limits, basins: List[str]):
+    # Latitude and longitude are already converted by the cache:
+    # longitude from 0 - 180 belongs to East, and 180 to 360 belongs to West.
+    tc_df = best_track_cache.load_ibtracs(path)
 
     # We only need tropical cyclones within these basins.
     tc_df = tc_df[tc_df['BASIN'].isin([b.upper() for b in basins])]
-    tc_df['ISO_TIME'] = pd.to_datetime(tc_df['ISO_TIME'], format='%Y-%m-%d %H:%M:%S')
-
-    # Convert latitude and longitude.
-    tc_df['LAT'] = tc_df['LAT'].apply(convert_latitude)
-    tc_df['LON'] = tc_df['LON'].apply(convert_longitude)
 
     # Filter out TCs that are not in our domain of interest.
     mask = (latitude_limits[0] < tc_df['LAT']) & (tc_df['LAT'] < latitude_limits[1])
@@ -221,32 +202,36 @@ def load_ibtracs_best_track(path, latitude_limits, longitude_limits, basins: Lis
     return tc_df
 
 def extract_tropical_cyclones_from_ibtracs_best_track(best_track_path: str, latitude_limits, longitude_limits, basins: List[str]):
-    def extract_tc_information(df):
-        tc_period = df[df['NATURE'].isin(['TC', 'TS'])]
-
-        first_row = df.iloc[0]
-        last_row = df.iloc[-1]
-    
-        return {
-            'Id': first_row['SID'],
-            'Latitude': first_row['LAT'],
-            'Longitude': first_row['LON'],
-            'First Observed': first_row['ISO_TIME'],
-            'Last Observed': last_row['ISO_TIME'],
-            'First Observed Type': first_row['NATURE'],
-            'Developing to TC': len(tc_period) > 0,
-            'Developing Date': tc_period['ISO_TIME'].iloc[0] if len(tc_period) > 0 else None
-        }
-
     tc_df = load_ibtracs_best_track(best_track_path, latitude_limits, longitude_limits, basins)
     print('tc df', len(tc_df))
-    
-    # We will group by SID so we can process each storm one by one.
-    tc = []
-    for _, group in tc_df.groupby('SID'):
-        tc.append(extract_tc_information(group))
 
-    return pd.DataFrame(tc)
+    return extract_tropical_cyclones(tc_df)
+
+
+def list_observations(observations_dir: str, observation_ranges: Tuple[datetime, datetime]) -> pd.DataFrame:
+    paths = pd.Series(sorted(glob.glob(os.path.join(observations_dir, '*.nc'))), dtype=object)
+    filenames = paths.map(os.path.basename).str.rsplit('.', n=1).str[0]
+    dates = pd.to_datetime(filenames.str.split('_', n=1).str[1], format='%Y%m%d_%H_%M')
+
+    observations = pd.DataFrame({'Date': dates, 'Path': paths})
+    in_range = (observation_ranges[0] <= dates) & (dates <= observation_ranges[1])
+    return observations[in_range].reset_index(drop=True)
+
+
+def is_any_tc_occurring(dates: pd.Series, tc: pd.DataFrame) -> np.ndarray:
+    """
+    Check whether there is any TC between its first and last observed date
+    for each of the given dates.
+    The number of TCs occurring at a date is the number of TCs started on or before that date,
+    minus the number of TCs ended before that date.
+    """
+    first_observed = np.sort(tc['First Observed'].values)
+    last_observed = np.sort(tc['Last Observed'].values)
+    dates = dates.values
+
+    nb_started = np.searchsorted(first_observed, dates, side='right')
+    nb_ended = np.searchsorted(last_observed, dates, side='left')
+    return (nb_started - nb_ended) > 0
 
 
 def create_labels(
@@ -254,73 +239,45 @@ def create_labels(
         tc: pd.DataFrame,
         observation_ranges: Tuple[datetime, datetime],
         leadtimes: List[int]):
-    labels = []
-
-    for observation_filename in glob.iglob(os.path.join(observations_dir, '*.nc')):
-        observation_date = parse_date_from_observation_filename(observation_filename)
-        if not (observation_ranges[0] <= observation_date <= observation_ranges[1]):
-            continue
-
-        # Update version 3
-        # Add another column in the output for indicating whether the observation day has other TCs happening.
-        is_tc_occuring = (tc['First Observed'] <= observation_date) & (observation_date <= tc['Last Observed'])
-        is_tc_occuring = len(tc[is_tc_occuring]) > 0
-
-        has_tropical_cnt = 0
-
-        for leadtime in leadtimes:
-            next_leadtime = observation_date + timedelta(hours=leadtime)
-            has_tropical = tc['First Observed'] == next_leadtime
-            has_tropical_cnt += len(tc[has_tropical])
-
-            for _, tc_row in tc[has_tropical].iterrows():
-                observation_label = {
-                    'Date': observation_date,
-                    'TC': True,
-                    'TC Id': tc_row['Id'],
-                    'First Observed': tc_row['First Observed'],
-                    'Last Observed': tc_row['Last Observed'],
-                    'Latitude': tc_row['Latitude'],
-                    'Longitude': tc_row['Longitude'],
-                    'First Observed Type': tc_row['First Observed Type'],
-                    'Will Develop to TC': tc_row['Developing to TC'],
-                    'Developing Date': tc_row['Developing Date'],
-                    'Is Other TC Happening': is_tc_occuring, # v3
-                    'Path': observation_filename,
-                }
-                labels.append(observation_label)
-
-        if has_tropical_cnt == 0:
-            # Update version 2 for testing
-            # Instead of removing time where TC is happening,
-            # we will keep these days, but label it as negative,
-            # for the model to learn the pattern where TC is about to occur.
-            # if len(tc[is_tc_occuring]) == 0:
-            #     labels.append({
-            #         'Date': observation_date,
-            #         'TC': False,
-            #         'Path': observation_filename,
-            #     })
-            labels.append({
-                'Date': observation_date,
-                'TC': False,
-                'Path': observation_filename,
-                'Is Other TC Happening': is_tc_occuring, # v3
-            })
-
-    labels = pd.DataFrame(
-            labels,
+    observations = list_observations(observations_dir, observation_ranges)
+
+    # Update version 3
+    # Add another column in the output for indicating whether the observation day has other TCs happening.
+    observations['Is Other TC Happening'] = is_any_tc_occurring(observations['Date'], tc)
+
+    # Join each observation with TCs first observed exactly `leadtime` hours later.
+    tc = tc.rename(columns={
+        'Id': 'TC Id',
+        'Developing to TC': 'Will Develop to TC',
+    })
+    positives = []
+    for leadtime in leadtimes:
+        obs = observations.assign(**{
+            'First Observed': observations['Date'] + timedelta(hours=leadtime)})
+        positives.append(obs.merge(tc, how='inner', on='First Observed'))
+
+    positives = pd.concat(positives, ignore_index=True)
+    positives['TC'] = True
+
+    # Update version 2 for testing
+    # Instead of removing time where TC is happening,
+    # we will keep these days, but label it as negative,
+    # for the model to learn the pattern where TC is about to occur.
+    negatives = observations[~observations['Date'].isin(positives['Date'])].copy()
+    negatives['TC'] = False
+
+    labels = pd.concat([positives, negatives], ignore_index=True)
+    labels = labels.reindex(
             columns=[
                 'Date', 'TC', 'TC Id', 'Is Other TC Happening',
                 'First Observed', 'Last Observed',
                 'Latitude', 'Longitude',
                 'First Observed Type', 'Will Develop to TC', 'Developing Date',
                 'Path'])
-    labels.sort_values(by='Date', inplace=True, ignore_index=True)
+    labels.sort_values(by='Date', inplace=True, ignore_index=True, kind='stable')
     return labels
 
 # Update version 4:
-# Not the best approach, but it will work! 
 def add_other_tc_happening_location(labels, best_track_from, best_track_path, latitude_limits, longitude_limits, basins):
     assert best_track_from == 'ibtracs', 'Currently, not supporting adding other TC locations from JTWC best track!'
     
@@ -332,21 +289,19 @@ def add_other_tc_happening_location(labels, best_track_from, best_track_path, la
     # mask &= (longitude_limits[0] < tc_df['LON']) & (tc_df['LON'] < longitude_limits[1])
     # tc_df = tc_df[mask]
 
-    # Loop through all day in the label,
-    # add another column for other tropical cyclones on that day.
-    other_tc_locations = []
-    for _, row in labels.iterrows():
-        if not row['Is Other TC Happening']:
-            other_tc_locations.append([])
-            continue
-
-        # Other TC happening in that day.
-        tc = tc_df[tc_df['ISO_TIME'] == row['Date']]
-        locations = [(r['LAT'], r['LON']) for _, r in tc.iterrows()]
-        # FIXME: this might happen when the storm temporarily move out of our domain of interest,
-        # comment this for now!
-        # assert len(locations) > 0, f'There may be something wrong with the script!! Check date: {row["Date"]}. Full row:\n{row}'
-        other_tc_locations.append(locations)
+    # Gather locations of all tropical cyclones on each day,
+    # and add another column for other tropical cyclones on that day.
+    # FIXME: a day may have no location
+    # when the storm temporarily move out of our domain of interest.
+    locations = pd.Series(
+        list(zip(best_track_cache.to_float64(tc_df['LAT']), best_track_cache.to_float64(tc_df['LON']))),
+        index=tc_df.index)
+    locations_by_date = locations.groupby(tc_df['Date'].values).agg(list)
+
+    other_tc_locations = [
+        locations if is_happening and isinstance(locations, list) else []
+        for is_happening, locations in zip(
+            labels['Is Other TC Happening'], labels['Date'].map(locations_by_date))]
 
     labels['Other TC Locations'] = other_tc_locations
     return labels
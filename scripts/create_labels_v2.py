@@ -18,6 +18,11 @@ import pandas as pd
 from tqdm import tqdm
 import xarray as xr
 
+try:
+    from . import best_track_cache
+except ImportError:
+    import best_track_cache
+
 
 def parse_arguments(args=None):
     parser = argparse.ArgumentParser()
@@ -82,21 +87,10 @@ def load_best_track(
         lon_mask = (df['LON'] >= lonmin) & (df['LON'] <= lonmax)
         lat_mask = (df['LAT'] >= latmin) & (df['LAT'] <= latmax)
         return df[lon_mask & lat_mask]
-    print("path", path)
-    df = pd.read_csv(path, skiprows=(1,), na_filter=False)
-    print("head", df.head())
-    # Parse data column.
-    df['Date'] = pd.to_datetime(
-        df['ISO_TIME'], format='%Y-%m-%d %H:%M:%S')
-
-    # Convert Longitude.
-    # TODO: check this.
-    df['LON'] = df['LON'].apply(lambda l: l if l > 0 else 360 + l)
+    df = best_track_cache.load_ibtracs(path)
 
     # Group by SID, and only retain the first row.
-    genesis_df = df.groupby('SID', sort=False).first()
-    genesis_df = genesis_df.copy()
-    genesis_df['SID'] = genesis_df.index
+    genesis_df = df.drop_duplicates('SID', keep='first').set_index('SID', drop=False)
 
     return filter_by_domain(genesis_df), filter_by_domain(df)
 
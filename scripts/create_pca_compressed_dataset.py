@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+"""
+This script creates a PCA-compressed dataset (see `tc_formation.data.pca_compressed`)
+of the observations of the given label files.
+The PCA bases are computed from the channel statistics of the observations,
+which are loaded if they were already computed for this version of the dataset.
+
+For instance:
+    python scripts/create_pca_compressed_dataset.py data/labels_train.csv data/labels_val.csv \\
+        --outdir data/pca_compressed --explained-variance 0.99
+"""
+from __future__ import annotations
+
+import argparse
+from collections import OrderedDict
+import json
+
+
+def parse_arguments(args=None):
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        'labels',
+        nargs='+',
+        help='Path to label files, all observations of the labels are compressed.')
+    parser.add_argument(
+        '--outdir',
+        required=True,
+        help='Directory of the compressed dataset.')
+    parser.add_argument(
+        '--subset',
+        default=None,
+        help='JSON of the variables and levels to keep, e.g. \'{"tmpprs": [850, 500], "capesfc": true}\'. '
+             'Default to all variables and levels.')
+    parser.add_argument(
+        '--components',
+        type=int,
+        default=None,
+        help='Maximum number of components of each variable.')
+    parser.add_argument(
+        '--explained-variance',
+        type=float,
+        default=None,
+        help='Keep the fewest components explaining this fraction of the variance of each variable.')
+    parser.add_argument(
+        '--statistics-dir',
+        default=None,
+        help='Directory of the channel statistics. Default to the directory of the observations.')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='Number of worker processes. Default to the number of cores.')
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_arguments(args)
+    assert args.components is not None or args.explained_variance is not None, \
+        'Either --components or --explained-variance is required.'
+
+    import pandas as pd
+    from tc_formation.data.label import load_label
+    from tc_formation.data.pca_compressed import build_pca_compressed_dataset, PCACompressedDataset
+    from tc_formation.data.statistics import full_subset, load_or_compute_statistics
+
+    paths = sorted(set(pd.concat([load_label(path, group_observation_by_date=False)['Path'] for path in args.labels])))
+    subset = (json.loads(args.subset, object_pairs_hook=OrderedDict)
+              if args.subset is not None else full_subset(paths[0]))
+
+    statistics = load_or_compute_statistics(paths, args.statistics_dir, workers=args.workers)
+    errors = build_pca_compressed_dataset(
+        paths,
+        args.outdir,
+        statistics,
+        subset,
+        nb_components=args.components,
+        explained_variance=args.explained_variance,
+        workers=args.workers)
+
+    dataset = PCACompressedDataset(args.outdir)
+    with pd.option_context('display.max_rows', None):
+        print(errors)
+
+    print(f'{len(paths)} observations, {dataset.matrix.shape[1]} channels to {dataset.matrix.shape[0]} coefficients, '
+          f'compression ratio {dataset.compression_ratio:.2f}.')
+
+
+if __name__ == '__main__':
+    main()
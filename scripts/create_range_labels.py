@@ -13,6 +13,11 @@ import os
 import pandas as pd
 import re
 
+try:
+    from . import best_track_cache
+except ImportError:
+    import best_track_cache
+
 
 def parse_arguments(args=None):
     parser = argparse.ArgumentParser()
@@ -70,22 +75,12 @@ def parse_latitudes_longitudes_from_reanalysis_dir(reanalysis_dir):
         return latitude, longitude
 
 
-def convert_longitude(longitude):
-    """
-    This function converts longitude from 0E to -180W to 0E to 360E.
-    """
-    return longitude if longitude > 0 else 360 + longitude
-
-
 def load_ibtracs(path: str,
         latitudes: tuple[float, float],
         longitudes: tuple[float, float]) -> pd.DataFrame:
-    assert os.path.isfile(path), f'Invalid path to IBTrACS best track: {path}'
-    IBTRACS_DATE_FMT = '%Y-%m-%d %H:%M:%S'
-
-    df = pd.read_csv(path, skiprows=(1,))
-    df['Date'] = pd.to_datetime(df['ISO_TIME'], format=IBTRACS_DATE_FMT)
-    df['Longitude'] = df['LON'].apply(convert_longitude)
+    # Longitude is already converted from 0E to -180W to 0E to 360E by the cache.
+    df = best_track_cache.load_ibtracs(path)
+    df['Longitude'] = df['LON']
     df['Latitude'] = df['LAT']
 
     lat_mask = (df['Latitude'] >= latitudes[0]) & (df['Latitude'] <= latitudes[1])
@@ -120,6 +115,20 @@ def extract_tc_genesis(ibtracs: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFram
     return genesis_df, remaining_df
 
 
+def group_by_date(df: pd.DataFrame, columns: list[str]) -> pd.Series:
+    """
+    Gather the given columns of all rows in the same date as a list of tuples.
+    """
+    values = [df[col].to_numpy(dtype=object) if col == 'SID'
+              else best_track_cache.to_float64(df[col]) for col in columns]
+    records = pd.Series(list(zip(*values)), index=df.index, dtype=object)
+    return records.groupby(df['Date'].values).agg(list)
+
+
+def lookup_by_date(grouped: pd.Series, dates: pd.Series) -> list[list]:
+    return [v if isinstance(v, list) else [] for v in dates.map(grouped)]
+
+
 def create_range_output(
         reanalysis_files: pd.DataFrame,
         ibtracs: pd.DataFrame,
@@ -129,50 +138,41 @@ def create_range_output(
     assert time_range % 6 == 0, f'Invalid time range, {time_range} must dividable by 6'
     genesis_df, remaining_df = extract_tc_genesis(ibtracs)
 
-    df = []
-    for _, reanalysis in reanalysis_files.iterrows():
-        genesis_gt = []
-        genesis_loc = []
-        genesis_sid = []
-
-        reanalysis_date = reanalysis['Date']
-
-        # First, check if we have TC genesis in our time ranges.
-        for tidx in range(1 if exclude_0h else 0, time_range // 6 + 1):
-            future_date = reanalysis_date + timedelta(hours=tidx * 6)
-            matched = genesis_df['Date'] == future_date
-
-            loc = []
-            sid = []
-            genesis_gt.append(1 if matched.sum() > 0 else 0)
-            for _, row in genesis_df[matched].iterrows():
-                loc.append((row['Latitude'], row['Longitude']))
-                sid.append(row['SID'])
-
-            genesis_loc.append(loc)
-            genesis_sid.append(sid)
-
-        # Second, prepend a flag to let the model know if we don't have any TC genesis.
-        if include_no_genesis_class:
-            genesis_gt = [0 if sum(genesis_gt) > 0 else 1] + genesis_gt
-
-        # Third, check if we have other mature tropical cyclones in current observation.
-        matched = remaining_df['Date'] == reanalysis_date
-        other_tcs = []
-        for _, row in remaining_df[matched].iterrows():
-            other_tcs.append((row['SID'], row['Latitude'], row['Longitude']))
-
-        # Finally, store our observations info.
-        df.append(dict(
-            Date=reanalysis_date,
-            Genesis=genesis_gt,
-            Genesis_Location=genesis_loc,
-            Genesis_SID=genesis_sid,
-            Other_TC=other_tcs,
-            Path=reanalysis['Path']
-        ))
-
-    return pd.DataFrame(df)
+    genesis_loc_by_date = group_by_date(genesis_df, ['Latitude', 'Longitude'])
+    genesis_sid_by_date = group_by_date(genesis_df, ['SID'])
+    reanalysis_dates = reanalysis_files['Date']
+
+    # First, check if we have TC genesis in our time ranges.
+    # Each column contains the value of one time step in the range.
+    genesis_loc_steps = []
+    genesis_sid_steps = []
+    for tidx in range(1 if exclude_0h else 0, time_range // 6 + 1):
+        future_dates = reanalysis_dates + timedelta(hours=tidx * 6)
+        genesis_loc_steps.append(lookup_by_date(genesis_loc_by_date, future_dates))
+        genesis_sid_steps.append(
+            [[sid for sid, in sids] for sids in lookup_by_date(genesis_sid_by_date, future_dates)])
+
+    genesis_loc = [list(steps) for steps in zip(*genesis_loc_steps)]
+    genesis_sid = [list(steps) for steps in zip(*genesis_sid_steps)]
+    genesis_gt = [[1 if len(loc) > 0 else 0 for loc in steps] for steps in genesis_loc]
+
+    # Second, prepend a flag to let the model know if we don't have any TC genesis.
+    if include_no_genesis_class:
+        genesis_gt = [[0 if sum(gt) > 0 else 1] + gt for gt in genesis_gt]
+
+    # Third, check if we have other mature tropical cyclones in current observation.
+    other_tcs = lookup_by_date(
+        group_by_date(remaining_df, ['SID', 'Latitude', 'Longitude']), reanalysis_dates)
+
+    # Finally, store our observations info.
+    return pd.DataFrame(dict(
+        Date=reanalysis_dates.values,
+        Genesis=genesis_gt,
+        Genesis_Location=genesis_loc,
+        Genesis_SID=genesis_sid,
+        Other_TC=other_tcs,
+        Path=reanalysis_files['Path'].values,
+    ))
 
 
 def save_groundtruth(gt: pd.DataFrame, *, output_dir: str, time_range: int, exclude_0h: bool, include_no_genesis_class: bool) -> None:
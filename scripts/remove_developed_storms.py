@@ -18,6 +18,11 @@ import tc_formation.vortex_removal.vortex_removal as vr
 from tqdm import tqdm
 import xarray as xr
 
+try:
+    from . import best_track_cache
+except ImportError:
+    import best_track_cache
+
 
 def parse_arguments(args=None):
     parser = argparse.ArgumentParser()
@@ -105,17 +110,13 @@ def list_reanalysis_files(path: str) -> pd.DataFrame:
 
 
 def load_developed_storms_from_ibtracs(path: str) -> pd.DataFrame:
-    df = pd.read_csv(path, skiprows=(1,), na_filter=False)
-    # Parse data column.
-    df['Date'] = pd.to_datetime(df['ISO_TIME'], format='%Y-%m-%d %H:%M:%S')
+    # Longitude is already converted to 0E - 360E by the cache.
+    df = best_track_cache.load_ibtracs(path)
 
     # We only care about some columns.
     df = df[['SID', 'Date', 'LAT', 'LON']]
     df = df.rename(columns=dict(LAT='Lat', LON='Lon'))
 
-    # Convert LON.
-    df['Lon'] = df['Lon'].apply(lambda l: l if l > 0 else 360 + l)
-
     # Group by SID, and only retain the first row.
     genesis_df = df.groupby('SID', sort=False).first()
 
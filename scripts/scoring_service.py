@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+
+"""
+Long-running scorer for newly arriving analyses.
+
+Trained models are loaded only once at startup,
+then the input directory is polled for new analyses:
+    * .grib2 files (NCEP/FNL, GFS) are extracted into the domain of interest with `extract_domain`,
+    * .nc files are assumed to be already extracted.
+New analyses are pushed through `extract_variables_from_dataset` and scored in batch by every model,
+the predictions are then appended to a Parquet prediction store.
+Analyses that are already in the store are skipped, so the service can be restarted at any time.
+
+Models are described in a .json file containing a list of:
+{
+    "name": "resnet_18",
+    "path": "saved_models/resnet_18",
+    "subset": {"absvprs": [900, 750], "rhprs": [750], "capesfc": true},
+    "kind": "domain",
+    "from_logits": true,
+    "normalization": "saved_models/resnet_18_normalization.npz"
+}
+where:
+    * `kind` is how the model's output is interpreted:
+        - "domain": a single prediction for the whole domain (default),
+        - "grid": a prediction for each grid point (e.g. Unet),
+        - "patches": a patch classifier evaluated on every patch of the domain,
+          which requires `patch_size` and `stride` (in grid points).
+    * `from_logits` (optional): whether sigmoid should be applied to the model's output.
+    * `exported` (optional): whether the model is exported by `tc_formation.models.export`.
+    * `normalization` (optional): .npz file with `mean` and `variance` of each channel.
+
+Each row of the prediction store contains:
+    * Path: path to the analysis.
+    * Date: date of the analysis.
+    * Model: name of the model.
+    * Lat, Lon: lower-left corner of the domain ("domain"), grid point ("grid"), or patch ("patches").
+    * Pred: predicted probability.
+"""
+
+from __future__ import annotations
+
+import argparse
+from dataclasses import dataclass, field
+from datetime import datetime
+import glob
+import json
+from multiprocessing.pool import ThreadPool
+import numpy as np
+import os
+import pandas as pd
+import tensorflow as tf
+import threading
+from tc_formation.data.data import extract_variables_from_dataset
+from tc_formation.models import export
+from tc_formation.models.sliding_window import SlidingWindowClassifier
+import time
+import xarray as xr
+
+
+INPUT_EXTENSIONS = ('.grib2', '.nc')
+MODEL_KINDS = ('domain', 'grid', 'patches')
+STORE_COLUMNS = ['Path', 'Date', 'Model', 'Lat', 'Lon', 'Pred']
+# The netCDF4/HDF5 library is not thread-safe, so .nc files are read and written one at a time by the loading threads.
+NETCDF_LOCK = threading.Lock()
+
+
+def parse_arguments(args=None):
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        'inputdir',
+        help='Path to directory where new analyses arrive.')
+    parser.add_argument(
+        'store',
+        help='Path to directory of the prediction store.')
+    parser.add_argument(
+        '--models',
+        required=True,
+        help='Path to .json file describing the models.')
+    parser.add_argument(
+        '--lat',
+        metavar=('latmin', 'latmax'),
+        type=float,
+        nargs=2,
+        help='Range of latitudes of the domain, required to extract .grib2 files.')
+    parser.add_argument(
+        '--lon',
+        metavar=('lonmin', 'lonmax'),
+        type=float,
+        nargs=2,
+        help='Range of longitudes of the domain, required to extract .grib2 files.')
+    parser.add_argument(
+        '--extracted-dir',
+        help='Path to directory to store extracted domains. Default to `<inputdir>/extracted`.')
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=16,
+        help='Maximum number of analyses scored at once. Default to 16.')
+    parser.add_argument(
+        '--poll-interval',
+        type=float,
+        default=10,
+        help='Seconds between polls of the input directory. Default to 10.')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=4,
+        help='Number of threads loading analyses. Default to 4.')
+    parser.add_argument(
+        '--once',
+        action='store_true',
+        help='Score all analyses currently in the input directory, then exit.')
+
+    return parser.parse_args(args)
+
+
+@dataclass
+class ModelSpec:
+    name: str
+    path: str
+    subset: dict
+    kind: str = 'domain'
+    from_logits: bool = False
+    exported: bool = False
+    normalization: str | None = None
+    patch_size: int | None = None
+    stride: int | None = None
+
+    def __post_init__(self):
+        assert self.kind in MODEL_KINDS, f'Invalid kind of model {self.name}: {self.kind}'
+        if self.kind == 'patches':
+            assert self.patch_size is not None and self.stride is not None, \
+                f'Model {self.name} requires `patch_size` and `stride`.'
+
+    @property
+    def subset_key(self) -> str:
+        # Subset's order matters, as it is the order of the channels.
+        return json.dumps(list(self.subset.items()))
+
+
+def load_model_specs(path: str) -> list[ModelSpec]:
+    with open(path) as f:
+        specs = [ModelSpec(**spec) for spec in json.load(f)]
+
+    names = [spec.name for spec in specs]
+    assert len(set(names)) == len(names), 'Models must have unique names.'
+    return specs
+
+
+class ScoringModel:
+    def __init__(self, spec: ModelSpec, model: tf.keras.Model = None) -> None:
+        self.spec = spec
+        if model is not None:
+            self._model = model
+        elif spec.exported:
+            self._model = export.load_exported(spec.path)
+        else:
+            self._model = tf.keras.models.load_model(spec.path, compile=False)
+
+        self._mean, self._std = None, None
+        if spec.normalization is not None:
+            stats = np.load(spec.normalization)
+            self._mean = stats['mean'].astype(np.float32)
+            self._std = np.sqrt(stats['variance']).astype(np.float32)
+
+        if spec.kind == 'patches':
+            self._sliding_window = SlidingWindowClassifier(self._model, spec.patch_size, spec.stride)
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """
+        Predict a batch of domains of shape (batch, lat, lon, channels).
+        Return an array of shape (batch, nb_lat, nb_lon) of probabilities,
+        where nb_lat and nb_lon are 1 for "domain" models.
+        """
+        if self._mean is not None:
+            X = (X - self._mean) / np.maximum(self._std, 1e-7)
+
+        if self.spec.kind == 'patches':
+            pred = self._sliding_window.predict(X)
+        else:
+            pred = self._model.predict_on_batch(X)
+            if self.spec.kind == 'domain':
+                pred = np.reshape(pred, (len(X), 1, 1, -1))
+
+        # Only the positive class is kept.
+        pred = np.asarray(pred)[..., -1]
+        return tf.sigmoid(pred).numpy() if self.spec.from_logits else pred
+
+    def coordinates(self, latitudes: np.ndarray, longitudes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Coordinates of each prediction.
+        """
+        if self.spec.kind == 'domain':
+            latitudes, longitudes = latitudes[:1], longitudes[:1]
+        elif self.spec.kind == 'patches':
+            domain_shape = (len(latitudes), len(longitudes))
+            nb_lat, nb_lon = self._sliding_window.nb_patches(domain_shape)
+            latitudes = latitudes[::self.spec.stride][:nb_lat]
+            longitudes = longitudes[::self.spec.stride][:nb_lon]
+
+        return np.meshgrid(latitudes, longitudes, indexing='ij')
+
+
+class PredictionStore:
+    """
+    Append-only prediction store,
+    each append is written to a new Parquet file inside the store directory.
+    """
+    def __init__(self, path: str) -> None:
+        self._path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _parts(self) -> list[str]:
+        return sorted(glob.glob(os.path.join(self._path, '*.parquet')))
+
+    def append(self, df: pd.DataFrame) -> None:
+        if len(df) == 0:
+            return
+
+        name = f'{datetime.now():%Y%m%d_%H%M%S_%f}_{os.getpid()}.parquet'
+        path = os.path.join(self._path, name)
+
+        # Write to a temporary file first,
+        # so readers never see a partially written file.
+        tmp_path = f'{path}.tmp'
+        df[STORE_COLUMNS].to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+    def load(self, columns: list[str] = None) -> pd.DataFrame:
+        parts = self._parts()
+        if len(parts) == 0:
+            return pd.DataFrame(columns=columns or STORE_COLUMNS)
+
+        return pd.concat([pd.read_parquet(p, columns=columns) for p in parts], ignore_index=True)
+
+    def scored_paths(self) -> set[str]:
+        return set(self.load(columns=['Path'])['Path'])
+
+
+@dataclass
+class Domain:
+    lat_min: float
+    lat_max: float
+    lon_min: float
+    lon_max: float
+
+
+@dataclass
+class Analysis:
+    path: str
+    date: datetime
+    latitudes: np.ndarray
+    longitudes: np.ndarray
+    inputs: dict = field(default_factory=dict)
+
+
+def parse_date(path: str) -> datetime:
+    # Analyses are named like `fnl_20080501_00_00.grib2`.
+    FMT = '%Y%m%d_%H_%M'
+    filename, _ = os.path.splitext(os.path.basename(path))
+    datepart = '_'.join(filename.split('_')[1:])
+    return datetime.strptime(datepart, FMT)
+
+
+class ScoringService:
+    def __init__(self,
+                 models: list[ScoringModel],
+                 store: PredictionStore,
+                 inputdir: str,
+                 extracted_dir: str = None,
+                 domain: Domain = None,
+                 batch_size: int = 16,
+                 workers: int = 4) -> None:
+        self._models = models
+        self._store = store
+        self._inputdir = inputdir
+        self._extracted_dir = extracted_dir or os.path.join(inputdir, 'extracted')
+        self._domain = domain
+        self._batch_size = batch_size
+        self._pool = ThreadPool(workers)
+
+        self._scored = store.scored_paths()
+        self._failed = set()
+        # Size of files seen in the previous poll,
+        # files are only scored once their size doesn't change between two polls.
+        self._sizes = {}
+
+    def list_new_files(self, wait_for_stable_size: bool = True) -> list[str]:
+        sizes = {}
+        with os.scandir(self._inputdir) as entries:
+            for entry in entries:
+                if (entry.is_file()
+                        and entry.name.endswith(INPUT_EXTENSIONS)
+                        and entry.path not in self._scored
+                        and entry.path not in self._failed):
+                    sizes[entry.path] = entry.stat().st_size
+
+        ready = [path for path, size in sizes.items()
+                 if not wait_for_stable_size or self._sizes.get(path) == size]
+        self._sizes = sizes
+        return sorted(ready)
+
+    def _load_dataset(self, path: str) -> xr.Dataset:
+        if path.endswith('.nc'):
+            with NETCDF_LOCK:
+                return xr.load_dataset(path, engine='netcdf4')
+
+        assert self._domain is not None, 'Domain is required to extract .grib2 files.'
+
+        # Extraction requires cfgrib, so we only import it when it's needed.
+        try:
+            from . import extract_env_14vars_new as extractor
+        except ImportError:
+            import extract_env_14vars_new as extractor
+
+        os.makedirs(self._extracted_dir, exist_ok=True)
+        date = parse_date(path)
+        extracted_path = os.path.join(self._extracted_dir, f'fnl_{date:%Y%m%d_%H_%M}.nc')
+
+        # Extraction writes the domain with netCDF4, so it also holds the lock.
+        with NETCDF_LOCK:
+            extractor.extract_domain(extractor.ExtractDomainArgs(
+                file=dict(Path=path, Date=date),
+                outputdir=self._extracted_dir,
+                latmin=self._domain.lat_min,
+                latmax=self._domain.lat_max,
+                lonmin=self._domain.lon_min,
+                lonmax=self._domain.lon_max))
+
+            return xr.load_dataset(extracted_path, engine='netcdf4')
+
+    def _load_analysis(self, path: str) -> Analysis | None:
+        try:
+            ds = self._load_dataset(path)
+            analysis = Analysis(
+                path=path,
+                date=parse_date(path),
+                latitudes=ds['lat'].values,
+                longitudes=ds['lon'].values)
+
+            # Models with the same subset share the same input.
+            for model in self._models:
+                key = model.spec.subset_key
+                if key not in analysis.inputs:
+                    analysis.inputs[key] = np.nan_to_num(
+                        extract_variables_from_dataset(ds, model.spec.subset)).astype(np.float32)
+
+            return analysis
+        except Exception as e:
+            print(f'Cannot load analysis {path}:', e)
+            return None
+
+    def score(self, paths: list[str]) -> pd.DataFrame:
+        analyses = self._pool.map(self._load_analysis, paths)
+        self._failed.update(p for p, a in zip(paths, analyses) if a is None)
+        analyses = [a for a in analyses if a is not None]
+        if len(analyses) == 0:
+            return pd.DataFrame(columns=STORE_COLUMNS)
+
+        results = {analysis.path: [] for analysis in analyses}
+        for model in self._models:
+            key = model.spec.subset_key
+
+            # Analyses are batched by shape, so grids of different shapes don't prevent scoring the others.
+            batches = {}
+            for analysis in analyses:
+                batches.setdefault(analysis.inputs[key].shape, []).append(analysis)
+
+            for batch in batches.values():
+                try:
+                    pred = model.predict(np.stack([a.inputs[key] for a in batch]))
+                except Exception as e:
+                    for analysis in batch:
+                        print(f'Cannot score analysis {analysis.path} with model {model.spec.name}:', e)
+
+                    self._failed.update(a.path for a in batch)
+                    continue
+
+                for analysis, p in zip(batch, pred):
+                    lat, lon = model.coordinates(analysis.latitudes, analysis.longitudes)
+                    results[analysis.path].append(pd.DataFrame(dict(
+                        Path=analysis.path,
+                        Date=analysis.date,
+                        Model=model.spec.name,
+                        Lat=lat.flatten(),
+                        Lon=lon.flatten(),
+                        Pred=p.flatten())))
+
+        # Analyses that failed with any model are not stored, so they are scored again after a restart.
+        results = [df for path, dfs in results.items() if path not in self._failed for df in dfs]
+        if len(results) == 0:
+            return pd.DataFrame(columns=STORE_COLUMNS)
+
+        return pd.concat(results, ignore_index=True)
+
+    def poll_once(self, wait_for_stable_size: bool = True) -> pd.DataFrame:
+        """
+        Score all new analyses in the input directory,
+        and append the predictions to the store.
+        """
+        new_files = self.list_new_files(wait_for_stable_size)
+
+        results = []
+        for i in range(0, len(new_files), self._batch_size):
+            batch = new_files[i:i + self._batch_size]
+
+            start = time.perf_counter()
+            result = self.score(batch)
+            self._store.append(result)
+            self._scored.update(result['Path'])
+            results.append(result)
+
+            print(f'Scored {result["Path"].nunique()} analyses in {time.perf_counter() - start:.2f}s.')
+
+        return (pd.concat(results, ignore_index=True)
+                if len(results) > 0
+                else pd.DataFrame(columns=STORE_COLUMNS))
+
+    def run(self, poll_interval: float = 10) -> None:
+        while True:
+            self.poll_once()
+            time.sleep(poll_interval)
+
+
+def main(args=None):
+    args = parse_arguments(args)
+    assert os.path.isdir(args.inputdir), f'Invalid input directory: {args.inputdir}'
+
+    domain = (Domain(args.lat[0], args.lat[1], args.lon[0], args.lon[1])
+              if args.lat is not None and args.lon is not None
+              else None)
+
+    models = [ScoringModel(spec) for spec in load_model_specs(args.models)]
+    print(f'Loaded {len(models)} models.')
+
+    service = ScoringService(
+        models,
+        PredictionStore(args.store),
+        args.inputdir,
+        extracted_dir=args.extracted_dir,
+        domain=domain,
+        batch_size=args.batch_size,
+        workers=args.workers)
+
+    if args.once:
+        service.poll_once(wait_for_stable_size=False)
+    else:
+        service.run(args.poll_interval)
+
+
+if __name__ == '__main__':
+    main()
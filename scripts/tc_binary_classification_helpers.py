@@ -19,6 +19,11 @@ from shapely.prepared import prep
 import time
 import xarray as xr
 
+try:
+    from . import best_track_cache
+except ImportError:
+    import best_track_cache
+
 
 Position = namedtuple('Center', ['lat', 'lon'])
 PatchPosition = namedtuple(
@@ -49,71 +54,20 @@ def parse_date_from_nc_filename(filename: str):
 
 
 def load_best_track(path: str) -> tuple[pd.DataFrame, pd.DataFrame]:
-    df = pd.read_csv(path, skiprows=(1,), na_filter=False)
-    # Parse data column.
-    df['Date'] = pd.to_datetime(df['ISO_TIME'], format='%Y-%m-%d %H:%M:%S')
+    df = best_track_cache.load_ibtracs(path)
 
     # We only care about some columns.
     df = df[['SID', 'Date', 'LAT', 'LON', 'BASIN']]
 
-    # Convert LON.
-    df['LON'] = df['LON'].apply(lambda l: l if l > 0 else 360 + l)
-
-    # Group by SID, and only retain the first row.
-    genesis_df = df.groupby('SID', sort=False).first()
-    genesis_df = genesis_df.copy()
-    genesis_df['SID'] = genesis_df.index
+    # Only retain the first row of each storm.
+    genesis_df = df.drop_duplicates('SID', keep='first').set_index('SID', drop=False)
 
     return genesis_df, df
 
 
 def load_best_track_files_theanh(files_pattern: str) -> tuple[pd.DataFrame, pd.DataFrame]:
-    def convert_to_date(days_since_new_year, year):
-        # Base on what I found,
-        # 121 corresponds to May 1st
-        # 153 corresponds to Jun 2nd
-        # So, in order to get that, we have to minus 1 from the days_since_new_year.
-        delta = timedelta(days_since_new_year - 1)
-        new_year = datetime(year, 1, 1, 0, 0)
-        return new_year + delta
-
-    def parse_year_from_dir(file_path):
-        parent_dir = os.path.dirname(file_path).split(os.path.sep)[-1]
-        year_part = parent_dir.split('_')[-1]
-        return int(year_part)
-
-    def parse_year_from_file(file_path):
-        filename = os.path.basename(file_path)
-        name, _ = os.path.splitext(filename)
-        year_part = name.split('_')[-1]
-        return int(year_part)
-
-    files = glob.iglob(files_pattern)
-
-    storms = []
-    for file in files:
-        try:
-            year = parse_year_from_dir(file)
-        except ValueError:
-            year = parse_year_from_file(file)
-
-        storms_in_year = pd.read_csv(
-            file,
-            names=['Days', 'StormId', 'LON', 'LAT'],
-            delim_whitespace=True,
-            usecols=list(range(4)),
-        )
-        storms_in_year['SID'] = storms_in_year['StormId'].apply(
-            lambda id: f'{year}-{id}')
-
-        # Convert 'Days' in year to date.
-        storms_in_year['Date'] = storms_in_year['Days'].apply(
-            lambda days: convert_to_date(days, year))
-
-        storms.append(
-            storms_in_year[['SID', 'Date', 'LAT', 'LON']])
-
-    storms_df = pd.concat(storms).sort_values('Date')
+    storms_df = best_track_cache.load_theanh(files_pattern)
+    storms_df = storms_df[['SID', 'Date', 'LAT', 'LON']]
 
     genesis_df = storms_df.groupby('SID').first().copy()
     genesis_df['SID'] = genesis_df.index
@@ -0,0 +1,81 @@
+"""
+Check `ScoringService.poll_once` on a temporary input directory
+with analyses of different grid shapes and an unreadable analysis:
+analyses that can be scored are stored, the others are skipped.
+
+Run from the root of the repository:
+    python scripts/test/scoring_service_poll_once.py
+"""
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))  # noqa
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))  # noqa
+
+import numpy as np
+import tempfile
+import tensorflow as tf
+import tensorflow.keras.layers as layers
+import xarray as xr
+
+from scoring_service import ModelSpec, PredictionStore, ScoringModel, ScoringService
+
+
+def write_analysis(path: str, nb_lat: int, nb_lon: int):
+    lat = np.arange(nb_lat, dtype=np.float32)
+    lon = np.arange(nb_lon, dtype=np.float32) + 100
+    ds = xr.Dataset(
+        dict(absvprs=(('lev', 'lat', 'lon'), np.random.rand(2, nb_lat, nb_lon)),
+             tmpsfc=(('lat', 'lon'), np.random.rand(nb_lat, nb_lon))),
+        coords=dict(lev=[900., 750.], lat=lat, lon=lon))
+    ds.to_netcdf(path, engine='netcdf4')
+
+
+def grid_model(nb_channels: int) -> tf.keras.Model:
+    inputs = layers.Input((None, None, nb_channels))
+    return tf.keras.Model(inputs, layers.Conv2D(1, 3, padding='same', activation='sigmoid')(inputs))
+
+
+def domain_model(nb_lat: int, nb_lon: int, nb_channels: int) -> tf.keras.Model:
+    inputs = layers.Input((nb_lat, nb_lon, nb_channels))
+    x = layers.Flatten()(inputs)
+    return tf.keras.Model(inputs, layers.Dense(1, activation='sigmoid')(x))
+
+
+if __name__ == '__main__':
+    subset = dict(absvprs=[900, 750], tmpsfc=True)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        inputdir = os.path.join(tmpdir, 'input')
+        os.makedirs(inputdir)
+
+        small = [os.path.join(inputdir, f'fnl_20080501_{h:02d}_00.nc') for h in (0, 6)]
+        large = os.path.join(inputdir, 'fnl_20080501_12_00.nc')
+        corrupted = os.path.join(inputdir, 'fnl_20080501_18_00.nc')
+        for path in small:
+            write_analysis(path, 4, 5)
+        write_analysis(large, 6, 7)
+        with open(corrupted, 'w') as f:
+            f.write('not a netcdf file')
+
+        models = [
+            ScoringModel(ModelSpec('unet', '', subset, kind='grid'), model=grid_model(3)),
+            ScoringModel(ModelSpec('resnet', '', subset), model=domain_model(4, 5, 3)),
+        ]
+        store = PredictionStore(os.path.join(tmpdir, 'store'))
+        service = ScoringService(models, store, inputdir, batch_size=16, workers=2)
+
+        result = service.poll_once(wait_for_stable_size=False)
+
+        # Analyses of both shapes are scored by the grid model in the same poll,
+        # but the domain model only accepts the small grids,
+        # so the large analysis is skipped, as well as the corrupted one.
+        assert set(result['Path']) == set(small), set(result['Path'])
+        assert (result.groupby(['Path', 'Model']).size().to_dict()
+                == {**{(p, 'unet'): 4 * 5 for p in small}, **{(p, 'resnet'): 1 for p in small}})
+        assert set(store.load()['Path']) == set(small)
+
+        # Skipped analyses are not retried in the next polls.
+        assert len(service.poll_once(wait_for_stable_size=False)) == 0
+        assert len(store.load()) == len(result)
+
+    print('OK')
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+"""
+Data-parallel training on a single machine with several worker processes.
+
+A single TensorFlow process doesn't scale to many cores,
+because the data loaders spend most of their time in Python (reading .nc files).
+This script launches N worker processes on localhost,
+which train the same model with `MultiWorkerMirroredStrategy`:
+    * each worker reads a disjoint shard of the label file through the existing data loaders,
+    * gradients are all-reduced between workers after each step,
+    * the chief worker (index 0) saves the model and the training history.
+
+For instance, to train a Unet with 4 workers:
+    python scripts/train_multi_worker.py data/labels_train.csv outputs/unet \\
+        --model unet --data-shape 41 161 13 --subset subset.json --workers 4
+
+Subset is a .json file of variables and levels to extract,
+e.g. {"absvprs": [900, 750], "rhprs": [750], "capesfc": true}.
+"""
+from __future__ import annotations
+
+import argparse
+from collections import OrderedDict
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+
+MODELS = ('resnet', 'unet', 'unet_time_distributed')
+
+
+def parse_arguments(args=None):
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        'train',
+        help='Path to training label file.')
+    parser.add_argument(
+        'outputdir',
+        help='Path to directory to save the trained model and training history.')
+    parser.add_argument(
+        '--model',
+        choices=MODELS,
+        required=True,
+        help='Model to train.')
+    parser.add_argument(
+        '--data-shape',
+        type=int,
+        nargs=3,
+        required=True,
+        help='Shape (lat, lon, channels) of each observation.')
+    parser.add_argument(
+        '--subset',
+        required=True,
+        help='Path to .json file of variables and levels to extract.')
+    parser.add_argument(
+        '--previous-hours',
+        type=int,
+        nargs='*',
+        default=[6, 12, 18],
+        help='Previous hours of observations for time series models. Default to 6 12 18.')
+    parser.add_argument(
+        '--leadtimes',
+        type=int,
+        nargs='*',
+        help='Leadtimes to train on. Default to all leadtimes.')
+    parser.add_argument(
+        '--negative-ratio',
+        type=float,
+        help='Ratio of negative samples to positive samples. Default to all negative samples.')
+    parser.add_argument(
+        '--filters',
+        type=int,
+        nargs='*',
+        default=[32, 64, 128, 256],
+        help='Filters of each Unet block. Default to 32 64 128 256.')
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=64,
+        help='Global batch size, split evenly between workers. Default to 64.')
+    parser.add_argument(
+        '--epochs',
+        type=int,
+        default=10,
+        help='Number of epochs. Default to 10.')
+    parser.add_argument(
+        '--learning-rate',
+        type=float,
+        default=1e-3,
+        help='Learning rate. Default to 1e-3.')
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='Random seed, shared by all workers so they sample the same negative samples. Default to 0.')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=2,
+        help='Number of worker processes. Default to 2.')
+    parser.add_argument(
+        '--threads-per-worker',
+        type=int,
+        help='Number of threads of each worker. Default to number of cores divided by number of workers.')
+    parser.add_argument(
+        '--worker-index',
+        type=int,
+        help=argparse.SUPPRESS)
+
+    return parser.parse_args(args)
+
+
+def _free_ports(nb_ports: int) -> list[int]:
+    sockets = [socket.socket() for _ in range(nb_ports)]
+    for s in sockets:
+        s.bind(('localhost', 0))
+
+    ports = [s.getsockname()[1] for s in sockets]
+    for s in sockets:
+        s.close()
+
+    return ports
+
+
+def launch_workers(args, argv: list[str]) -> int:
+    """
+    Launch the worker processes with their `TF_CONFIG`, and wait for all of them.
+    """
+    threads = args.threads_per_worker or max((os.cpu_count() or 1) // args.workers, 1)
+    cluster = dict(worker=[f'localhost:{port}' for port in _free_ports(args.workers)])
+
+    processes = []
+    for index in range(args.workers):
+        env = dict(
+            os.environ,
+            TF_CONFIG=json.dumps(dict(cluster=cluster, task=dict(type='worker', index=index))),
+            OMP_NUM_THREADS=str(threads))
+        processes.append(subprocess.Popen(
+            [sys.executable, __file__, *argv, '--worker-index', str(index), '--threads-per-worker', str(threads)],
+            env=env))
+
+    return_codes = [p.wait() for p in processes]
+    return max(return_codes, key=abs)
+
+
+def _load_subset(path: str) -> OrderedDict:
+    with open(path) as f:
+        return OrderedDict(json.load(f))
+
+
+def _create_loader(args, num_shards: int, shard_index: int):
+    from tc_formation.data import time_series as ts_data
+    from tc_formation.data.loaders.tc_occurence import TropicalCycloneOccurenceDataLoader
+    from tc_formation.data.time_series_addons import sharded
+
+    data_shape = tuple(args.data_shape)
+    subset = _load_subset(args.subset)
+    shard = dict(num_shards=num_shards, shard_index=shard_index)
+
+    if args.model == 'resnet':
+        return sharded(TropicalCycloneOccurenceDataLoader)(data_shape=data_shape, subset=subset, **shard)
+    elif args.model == 'unet':
+        return sharded(ts_data.TropicalCycloneWithGridProbabilityDataLoader)(
+            data_shape=data_shape, subset=subset, softmax_output=False, **shard)
+
+    return sharded(ts_data.TimeSeriesTropicalCycloneWithGridProbabilityDataLoader)(
+        data_shape=data_shape,
+        previous_hours=args.previous_hours,
+        subset=subset,
+        softmax_output=False,
+        **shard)
+
+
+def _create_model(args):
+    from tc_formation.models import resnet, unet, unet_time_distributed
+
+    data_shape = tuple(args.data_shape)
+    if args.model == 'resnet':
+        return resnet.ResNet18(input_shape=data_shape, classes=1, classifier_activation='sigmoid')
+    elif args.model == 'unet':
+        return unet.Unet(
+            input_shape=data_shape,
+            filters_block=args.filters,
+            output_classes=1,
+            classifier_activation='sigmoid')
+
+    return unet_time_distributed.UnetTimeDistributed(
+        input_shape=(len(args.previous_hours) + 1,) + data_shape,
+        filters_block=args.filters,
+        output_classes=1,
+        classifier_activation='sigmoid')
+
+
+def train_worker(args) -> None:
+    import numpy as np
+    import tensorflow as tf
+    import tensorflow.keras as keras
+
+    # Must be set before TensorFlow is initialized.
+    tf.config.threading.set_intra_op_parallelism_threads(args.threads_per_worker)
+    tf.config.threading.set_inter_op_parallelism_threads(args.threads_per_worker)
+
+    # All workers share the same seed, so they sample the same rows before sharding.
+    np.random.seed(args.seed)
+    tf.random.set_seed(args.seed)
+
+    strategy = tf.distribute.MultiWorkerMirroredStrategy()
+    is_chief = strategy.cluster_resolver.task_id == 0
+    num_workers = strategy.num_replicas_in_sync
+
+    loaders = []
+
+    def dataset_fn(input_context: tf.distribute.InputContext):
+        loader = _create_loader(args, input_context.num_input_pipelines, input_context.input_pipeline_id)
+        loaders.append(loader)
+        dataset = loader.load_dataset(
+            args.train,
+            shuffle=True,
+            batch_size=input_context.get_per_replica_batch_size(args.batch_size),
+            leadtimes=args.leadtimes,
+            nonTCRatio=args.negative_ratio)
+        return dataset.repeat()
+
+    dataset = strategy.distribute_datasets_from_function(dataset_fn)
+
+    # Shards differ by at most one row,
+    # every worker must run the same number of steps, otherwise the all-reduce hangs.
+    steps_per_epoch = (loaders[0].nb_rows // num_workers) // (args.batch_size // num_workers)
+    assert steps_per_epoch > 0, 'Not enough samples for one step with the given batch size.'
+
+    with strategy.scope():
+        model = _create_model(args)
+        model.compile(
+            optimizer=keras.optimizers.Adam(args.learning_rate),
+            loss=keras.losses.BinaryCrossentropy(),
+            metrics=[
+                keras.metrics.BinaryAccuracy(),
+                keras.metrics.Precision(name='precision'),
+                keras.metrics.Recall(name='recall'),
+            ])
+
+    epoch_times = []
+    timer = keras.callbacks.LambdaCallback(
+        on_epoch_begin=lambda epoch, logs: epoch_times.append(time.perf_counter()),
+        on_epoch_end=lambda epoch, logs: epoch_times.__setitem__(-1, time.perf_counter() - epoch_times[-1]))
+
+    history = model.fit(
+        dataset,
+        epochs=args.epochs,
+        steps_per_epoch=steps_per_epoch,
+        callbacks=[timer],
+        verbose=2 if is_chief else 0)
+
+    # Every worker must take part in saving, but only the chief's model is kept.
+    model_path = (os.path.join(args.outputdir, 'model')
+                  if is_chief
+                  else os.path.join(args.outputdir, f'.worker_{strategy.cluster_resolver.task_id}'))
+    model.save(model_path)
+
+    if is_chief:
+        with open(os.path.join(args.outputdir, 'history.json'), 'w') as f:
+            json.dump(dict(
+                workers=num_workers,
+                steps_per_epoch=steps_per_epoch,
+                epoch_times=epoch_times,
+                **{k: [float(v) for v in values] for k, values in history.history.items()},
+            ), f, indent=2)
+    else:
+        tf.io.gfile.rmtree(model_path)
+
+
+def main(args=None):
+    argv = sys.argv[1:] if args is None else args
+    args = parse_arguments(args)
+    os.makedirs(args.outputdir, exist_ok=True)
+
+    if args.worker_index is not None:
+        train_worker(args)
+        return
+
+    return_code = launch_workers(args, argv)
+    if return_code != 0:
+        sys.exit(return_code)
+
+    with open(os.path.join(args.outputdir, 'history.json')) as f:
+        history = json.load(f)
+
+    # The first epoch includes tracing and loading data into the cache.
+    epoch_times = history['epoch_times'][1:] or history['epoch_times']
+    print(f'Trained with {history["workers"]} workers, '
+          f'{history["steps_per_epoch"]} steps per epoch, '
+          f'{sum(epoch_times) / len(epoch_times):.2f}s per epoch.')
+
+
+if __name__ == '__main__':
+    main()
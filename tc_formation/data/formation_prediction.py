@@ -1,8 +1,8 @@
-from ast import literal_eval
 import numpy as np
 import pandas as pd
 from tc_formation.data.time_series import TimeSeriesTropicalCycloneDataLoader
 from tc_formation.data.time_series_addons import SingleTimeStepMixin
+import tc_formation.data.label as label
 import tc_formation.data.utils as data_utils
 import tc_formation.data.tfd_utils as tfd_utils
 import tensorflow as tf
@@ -22,8 +22,8 @@ class TimeSeriesTCFormationDataLoader(TimeSeriesTropicalCycloneDataLoader):
         if self._produce_other_tc_locations_mask:
             assert 'Other TC Locations' in tc_df.columns, 'Producing other TCs locations requires labels v4+'
 
-            # Convert from string to list.
-            tc_df['Other TC Locations'] = tc_df['Other TC Locations'].apply(literal_eval).apply(lambda x: np.asarray(x, dtype=np.float64))
+            # Convert to arrays of locations.
+            tc_df['Other TC Locations'] = label.parse_locations(tc_df['Other TC Locations'])
 
         cls = TimeSeriesTCFormationDataLoader
 
@@ -32,7 +32,7 @@ class TimeSeriesTCFormationDataLoader(TimeSeriesTropicalCycloneDataLoader):
             'TC': tc_df['TC'],
             'Latitude': tc_df['Latitude'],
             'Longitude': tc_df['Longitude'],
-            'Other TC Locations': tf.ragged.constant(tc_df['Other TC Locations']) if self._produce_other_tc_locations_mask else None,
+            'Other TC Locations': tfd_utils.ragged_from_rows(tc_df['Other TC Locations'], inner_shape=(2,)) if self._produce_other_tc_locations_mask else None,
         })
         print('Dataset created ...')
 
@@ -185,8 +185,8 @@ class TimeSeriesFocusedTCFormationDataLoader(TimeSeriesTropicalCycloneDataLoader
         if self._easy:
             assert 'Other TC Locations' in tc_df.columns, 'Easy construction requires labels v4+'
 
-            # Convert from string to list.
-            tc_df['Other TC Locations'] = tc_df['Other TC Locations'].apply(literal_eval).apply(lambda x: np.asarray(x, dtype=np.float64))
+            # Convert to arrays of locations.
+            tc_df['Other TC Locations'] = label.parse_locations(tc_df['Other TC Locations'])
 
         cls = TimeSeriesFocusedTCFormationDataLoader
 
@@ -195,7 +195,7 @@ class TimeSeriesFocusedTCFormationDataLoader(TimeSeriesTropicalCycloneDataLoader
             'TC': tc_df['TC'],
             'Latitude': tc_df['Latitude'],
             'Longitude': tc_df['Longitude'],
-            'Other TC Locations': tf.ragged.constant(tc_df['Other TC Locations']) # if self._easy else None
+            'Other TC Locations': tfd_utils.ragged_from_rows(label.parse_locations(tc_df['Other TC Locations']), inner_shape=(2,)) # if self._easy else None
         })
         print('Dataset created ...')
 
@@ -0,0 +1,220 @@
+"""
+Hard negative sampling at the data level.
+
+`losses.hard_negative_mining` selects hard negatives inside the loss,
+so every negative sample is still decoded and forwarded at every epoch.
+Here, the pool of negative samples is periodically scored with the current model (batched inference),
+the scores are kept in a compact array (one float16 per negative sample),
+and each epoch draws a fixed number of negatives with probabilities proportional to their difficulty,
+mixed with uniform probabilities so that easy negatives are still seen from time to time.
+Only the positives and the drawn negatives are decoded during training,
+and scoring can be restricted to a random fraction of the pool each time.
+Scoring decodes the inputs of the scored negatives in a single pipeline over (index, paths),
+so each score is written back to the negative it was computed from.
+
+The difficulty of a negative sample is the highest predicted probability of the positive class,
+i.e. the probability of the sample for classifiers, or the highest probability over the grid for Unet.
+Negatives which have not been scored yet have the highest difficulty.
+
+The sampler is both the dataset and a callback rescoring the pool at the end of epochs:
+    >>> labels = load_labels(loader, 'data/labels_train.csv')
+    >>> sampler = HardNegativeSampler(labels, loader._process_to_dataset, loader.load_observations, negative_ratio=3)
+    >>> model.fit(sampler.dataset(batch_size=64), epochs=10, callbacks=[sampler])
+"""
+from __future__ import annotations
+
+from functools import partial
+import time
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+import tensorflow.keras as keras
+
+
+def load_labels(loader, data_path: str, leadtimes: list[int] | None = None) -> pd.DataFrame:
+    """
+    Load the label file as `loader.load_dataset` does (with the paths of previous observations),
+    but without filtering negative samples.
+
+    Parameters
+    ==========
+    loader: TimeSeriesTropicalCycloneDataLoader
+        Data loader whose `_process_to_dataset` decodes the returned rows.
+    data_path: str
+        Path to the label file.
+    leadtimes: list[int] | None
+        Leadtimes to keep, default to all leadtimes.
+    """
+    tc_df = loader._load_tc_csv(data_path, leadtimes)
+    tc_df['Path'] = tc_df['Path'].apply(
+        partial(loader._add_previous_observation_data_paths, previous_times=loader._previous_hours))
+    return tc_df[tc_df['Path'].apply(loader._are_valid_paths)]
+
+
+def _negative_mask(labels: pd.DataFrame) -> np.ndarray:
+    # Same negative samples as `filter_negative_samples`.
+    negatives = ~labels['TC']
+    if 'Is Other TC Happening' in labels.columns:
+        negatives &= ~labels['Is Other TC Happening']
+
+    return negatives.to_numpy(dtype=bool)
+
+
+class HardNegativeSampler(keras.callbacks.Callback):
+    def __init__(self,
+                 labels: pd.DataFrame,
+                 process_fn: Callable[[pd.DataFrame], tf.data.Dataset],
+                 decode_fn: Callable[[list[str]], np.ndarray],
+                 negative_ratio: float = 3.0,
+                 uniform_ratio: float = 0.2,
+                 hardness_power: float = 1.0,
+                 rescore_every: int = 1,
+                 rescore_fraction: float = 1.0,
+                 batch_size: int = 64,
+                 from_logits: bool = False,
+                 seed: int = 0) -> None:
+        """
+        Parameters
+        ==========
+        labels: pd.DataFrame
+            Label dataframe with a `TC` column, e.g. given by `load_labels`.
+            Negative samples are the same as in `filter_negative_samples`.
+        process_fn: Callable[[pd.DataFrame], tf.data.Dataset]
+            Function decoding rows of `labels` to an (unbatched) dataset of (X, y),
+            e.g. `loader._process_to_dataset`.
+        decode_fn: Callable[[list[str]], np.ndarray]
+            Function decoding the input X of a single row from its `Path` column,
+            e.g. `loader.load_observations`, used to score negatives.
+        negative_ratio: float
+            Number of negatives drawn at each epoch, relative to the number of positives.
+        uniform_ratio: float
+            Weight of uniform probabilities in the sampling distribution,
+            so that every negative sample can be drawn.
+        hardness_power: float
+            Exponent applied to difficulty scores, higher values focus on the hardest negatives.
+        rescore_every: int
+            Number of epochs between two scorings of the negative pool.
+        rescore_fraction: float
+            Fraction of the negative pool scored each time, chosen at random.
+        batch_size: int
+            Batch size of scoring.
+        from_logits: bool
+            Whether the model outputs logits instead of probabilities.
+        """
+        super().__init__()
+        assert 0 <= uniform_ratio <= 1, 'Uniform ratio must be in [0, 1].'
+        assert 0 < rescore_fraction <= 1, 'Rescore fraction must be in (0, 1].'
+        assert rescore_every > 0, 'Rescore period must be positive.'
+
+        negatives = _negative_mask(labels)
+        self._positives = labels[labels['TC'].to_numpy(dtype=bool)]
+        self._negatives = labels[negatives]
+        assert len(self._negatives) > 0, 'There are no negative samples.'
+
+        self._process_fn = process_fn
+        self._decode_fn = decode_fn
+        # Paths of each negative, of shape (nb_negatives, nb_observations).
+        self._negative_paths = np.asarray(self._negatives['Path'].tolist(), dtype=str).reshape((len(self._negatives), -1))
+        self._X_shape = None
+        self.nb_negatives = min(int(round(len(self._positives) * negative_ratio)), len(self._negatives))
+        self._uniform_ratio = uniform_ratio
+        self._hardness_power = hardness_power
+        self._rescore_every = rescore_every
+        self._rescore_fraction = rescore_fraction
+        self._batch_size = batch_size
+        self._from_logits = from_logits
+        self._rng = np.random.default_rng(seed)
+
+        # Unscored negatives are the hardest ones, so the first epoch is drawn uniformly.
+        self.scores = np.ones(len(self._negatives), dtype=np.float16)
+        self.history = []
+
+    def probabilities(self) -> np.ndarray:
+        """
+        Probability of each negative sample to be drawn at the next epoch.
+        """
+        hardness = np.power(self.scores.astype(np.float64), self._hardness_power)
+        total = hardness.sum()
+        hardness = hardness / total if total > 0 else np.full(len(hardness), 1 / len(hardness))
+        return (1 - self._uniform_ratio) * hardness + self._uniform_ratio / len(hardness)
+
+    def draw(self) -> pd.DataFrame:
+        """
+        Draw the rows of an epoch: all positives and `nb_negatives` negatives (without replacement),
+        in random order.
+        """
+        p = self.probabilities()
+        # Negatives with zero probability can't be drawn without replacement.
+        nb_negatives = min(self.nb_negatives, int(np.count_nonzero(p)))
+        drawn = self._rng.choice(len(self._negatives), size=nb_negatives, replace=False, p=p)
+        rows = pd.concat([self._positives, self._negatives.iloc[drawn]])
+        return rows.iloc[self._rng.permutation(len(rows))]
+
+    def dataset(self, batch_size: int = 64) -> tf.data.Dataset:
+        """
+        Batched dataset of (X, y) whose rows are drawn again each time it is iterated,
+        i.e. at each epoch of `model.fit`.
+        """
+        element_spec = self._process_fn(self._positives.iloc[:1]).batch(batch_size).element_spec
+
+        def generate():
+            dataset = self._process_fn(self.draw())
+            yield from dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+        dataset = tf.data.Dataset.from_generator(generate, output_signature=element_spec)
+        return dataset.prefetch(1)
+
+    @tf.function(reduce_retracing=True)
+    def _hardness(self, X):
+        pred = self.model(X, training=False)
+        pred = tf.reshape(pred[..., -1], (tf.shape(pred)[0], -1))
+        pred = tf.sigmoid(pred) if self._from_logits else pred
+        return tf.reduce_max(pred, axis=-1)
+
+    def _decode(self, paths: np.ndarray) -> np.ndarray:
+        return np.asarray(self._decode_fn([path.decode('utf-8') for path in paths]), dtype=np.float32)
+
+    def _scoring_dataset(self, indices: np.ndarray) -> tf.data.Dataset:
+        # Loaders decode rows with `deterministic=False` maps, which `tf.data.Options` can't override,
+        # so the index of each negative is carried along its paths through the decoding map.
+        if self._X_shape is None:
+            self._X_shape = self._decode(self._negative_paths[0].astype(bytes)).shape
+
+        def decode(index, paths):
+            X = tf.numpy_function(self._decode, [paths], tf.float32, name='load_observations')
+            X.set_shape(self._X_shape)
+            return index, X
+
+        return (tf.data.Dataset.from_tensor_slices((indices.astype(np.int64), self._negative_paths[indices]))
+                .map(decode, num_parallel_calls=tf.data.AUTOTUNE, deterministic=False)
+                .batch(self._batch_size)
+                .prefetch(tf.data.AUTOTUNE))
+
+    def score(self, indices: np.ndarray | None = None) -> None:
+        """
+        Score the given negatives (all of them by default) with the current model.
+        """
+        indices = np.arange(len(self._negatives)) if indices is None else np.asarray(indices)
+
+        for batch_indices, X in self._scoring_dataset(indices):
+            self.scores[batch_indices.numpy()] = self._hardness(X).numpy()
+
+    def on_epoch_end(self, epoch, logs=None):
+        if (epoch + 1) % self._rescore_every != 0:
+            return
+
+        start = time.perf_counter()
+        nb_scored = max(int(round(len(self._negatives) * self._rescore_fraction)), 1)
+        indices = self._rng.choice(len(self._negatives), size=nb_scored, replace=False)
+        self.score(indices)
+
+        self.history.append(dict(
+            epoch=epoch,
+            nb_scored=nb_scored,
+            mean_score=float(self.scores.astype(np.float32).mean()),
+            seconds=time.perf_counter() - start))
+
+        if logs is not None:
+            logs['negative_hardness'] = self.history[-1]['mean_score']
@@ -1,9 +1,30 @@
+from ast import literal_eval
 from datetime import timedelta
 from functools import reduce
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from typing import Union, List
 
 
+# Multi-valued columns of label files, and how they are stored in .parquet label files.
+_LOCATION_TYPE = pa.list_(pa.float64(), 2)
+RAGGED_COLUMN_TYPES = {
+    # Labels v4+.
+    'Other TC Locations': pa.list_(_LOCATION_TYPE),
+    # Time range labels.
+    'Genesis': pa.list_(pa.int8()),
+    'Genesis_Location': pa.list_(pa.list_(_LOCATION_TYPE)),
+    'Genesis_SID': pa.list_(pa.list_(pa.string())),
+    'Other_TC': pa.list_(pa.struct([
+        ('SID', pa.string()),
+        ('Latitude', pa.float64()),
+        ('Longitude', pa.float64()),
+    ])),
+}
+
+
 def _parse_tc_datetime(column: pd.Series):
     return pd.to_datetime(column, format='%Y-%m-%d %H:%M:%S')
 
@@ -53,15 +74,87 @@ def filter_in_leadtime(tc: pd.DataFrame, leadtimes: Union[List[int], int] = None
     return tc[mask]
 
 
+def _split_list_array(array: pa.Array) -> list:
+    """
+    Split values of a list array into rows using its offsets.
+    Rows of primitive, location and struct values are numpy views of the flattened values,
+    so no Python object is created per value.
+    """
+    offsets = array.offsets.to_numpy()
+    offsets = offsets - offsets[0]
+    values = array.flatten()
+
+    if pa.types.is_fixed_size_list(values.type):
+        values = values.flatten().to_numpy().reshape((len(values), values.type.list_size))
+    elif pa.types.is_list(values.type):
+        values = _split_list_array(values)
+    elif pa.types.is_struct(values.type):
+        values = np.rec.fromarrays(
+            [values.field(i).to_numpy(zero_copy_only=False) for i in range(values.type.num_fields)],
+            names=[field.name for field in values.type])
+    else:
+        values = values.to_numpy(zero_copy_only=False)
+
+    return [values[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def load_label_parquet(label_path: str) -> pd.DataFrame:
+    """
+    Load .parquet label file,
+    multi-valued columns are loaded as numpy arrays per row instead of Python lists.
+    """
+    table = pq.read_table(label_path)
+    ragged_columns = [name for name in table.column_names if pa.types.is_list(table.schema.field(name).type)]
+
+    label = table.drop(ragged_columns).to_pandas()
+    for name in ragged_columns:
+        label[name] = pd.Series(_split_list_array(table.column(name).combine_chunks()), dtype=object)
+
+    return label[table.column_names]
+
+
+def save_label_parquet(label: pd.DataFrame, label_path: str):
+    """
+    Save label to .parquet file, multi-valued columns are stored as list columns,
+    i.e. offsets and values, instead of stringified Python lists.
+    """
+    columns = label.columns.tolist()
+    label = label.copy()
+    ragged_columns = {}
+    for name, list_type in RAGGED_COLUMN_TYPES.items():
+        if name in label.columns:
+            values = label.pop(name).apply(lambda v: literal_eval(v) if isinstance(v, str) else v)
+            ragged_columns[name] = pa.array(values.tolist(), type=list_type)
+
+    table = pa.Table.from_pandas(label, preserve_index=False)
+    for name, values in ragged_columns.items():
+        table = table.append_column(name, values)
+
+    pq.write_table(table.select(columns), label_path)
+
+
+def parse_locations(locations: pd.Series) -> pd.Series:
+    """
+    Convert locations column to arrays of shape (nb_locations, 2).
+    Locations of .csv label files are stringified Python lists,
+    while locations of .parquet label files are already arrays.
+    """
+    return locations.apply(
+        lambda loc: np.asarray(literal_eval(loc) if isinstance(loc, str) else loc, dtype=np.float64).reshape((-1, 2)))
+
+
 def load_label(label_path, group_observation_by_date=True, leadtime=None) -> pd.DataFrame:
-    label = pd.read_csv(label_path, dtype={
-        'TC Id': str,
-        'First Observed': str,
-        'Last Observed': str,
-        'First Observed Type': str,
-        'Will Develop to TC': str,
-        'Developing Date': str,
-    })
+    if label_path.endswith('.parquet'):
+        label = load_label_parquet(label_path)
+    else:
+        label = pd.read_csv(label_path, dtype={
+            'TC Id': str,
+            'First Observed': str,
+            'Last Observed': str,
+            'First Observed Type': str,
+            'Will Develop to TC': str,
+            'Developing Date': str,
+        })
 
   #  print('in load_label', label['Genesis'].sum())
     label = filter_in_leadtime(label, leadtime)
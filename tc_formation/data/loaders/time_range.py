@@ -6,11 +6,16 @@ import os
 import pandas as pd
 import tensorflow as tf
 
+from .. import label as label_utils
+
 
 _TIME_STR_FMT = '%Y%m%d_%H_%M'
 
 def load_time_range_label(path: str) -> pd.DataFrame:
     assert os.path.isfile(path), f'Invalid time range label path: {path}'
+    if path.endswith('.parquet'):
+        return label_utils.load_label_parquet(path)
+
     df = pd.read_csv(
         path,
         converters=dict(
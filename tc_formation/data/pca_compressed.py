@@ -0,0 +1,268 @@
+"""
+PCA-compressed datasets of observations.
+
+Vertical levels of a variable are highly redundant
+(see `other_experiments/input_data_analyses/data_redundancy.py`),
+so each variable is stored as the coefficients of its top-k principal components across levels,
+computed on standardized channels from the statistics of `data.statistics` (no extra pass over the data).
+Variables without levels are stored as their standardized values.
+The coefficients of all observation files are stored in a single memory-mapped file,
+so storage and read bandwidth shrink by the compression ratio (number of channels / number of coefficients).
+
+The model either takes the coefficients directly,
+or the channels are reconstructed in graph, after batching, as a single matrix product:
+    >>> dataset = PCACompressedDataset('data/pca_compressed')
+    >>> training = dataset.load_dataset('data/labels_train.csv', batch_size=64, shuffle=True, reconstruct=True)
+
+Reconstructed channels are standardized, i.e. they replace the normalization layer.
+The per-channel reconstruction error is computed at build time (see `build_pca_compressed_dataset`).
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+import concurrent.futures as futures
+import json
+import multiprocessing
+import os
+
+import numpy as np
+import pandas as pd
+
+from tc_formation.data.statistics import ChannelStatistics
+from tc_formation.models.fan_out import subset_channels
+
+
+def pca_bases(statistics: ChannelStatistics,
+              subset: OrderedDict,
+              nb_components: int | None = None,
+              explained_variance: float | None = None) -> OrderedDict:
+    """
+    PCA basis of each variable of the subset, across its levels.
+
+    Parameters
+    ==========
+    nb_components: int | None
+        Maximum number of components of each variable.
+    explained_variance: float | None
+        If given, keep the fewest components explaining at least this fraction of the variance of each variable.
+
+    Returns
+    =======
+    Basis of shape (k, nb_levels) of each variable.
+    """
+    bases = OrderedDict()
+    for variable, levels in subset.items():
+        if isinstance(levels, bool):
+            if levels:
+                bases[variable] = np.ones((1, 1))
+            continue
+
+        components, variances = statistics.pca(OrderedDict([(variable, levels)]))
+        nb_kept = len(components) if nb_components is None else min(nb_components, len(components))
+        if explained_variance is not None:
+            ratios = np.cumsum(variances) / np.sum(variances)
+            nb_kept = min(nb_kept, int(np.searchsorted(ratios, explained_variance - 1e-12)) + 1)
+
+        bases[variable] = components[:nb_kept]
+
+    return bases
+
+
+def _basis_matrix(bases: OrderedDict) -> np.ndarray:
+    # Block diagonal matrix of shape (coefficients, channels).
+    nb_coefficients = sum(len(b) for b in bases.values())
+    nb_channels = sum(b.shape[1] for b in bases.values())
+    matrix = np.zeros((nb_coefficients, nb_channels), dtype=np.float32)
+
+    i = j = 0
+    for basis in bases.values():
+        matrix[i:i + len(basis), j:j + basis.shape[1]] = basis
+        i, j = i + len(basis), j + basis.shape[1]
+
+    return matrix
+
+
+def _encode_files(paths: list[str], subset: OrderedDict, mean: np.ndarray, std: np.ndarray, matrix: np.ndarray):
+    import xarray as xr
+    import tc_formation.data.data as data_utils
+
+    coefficients = []
+    squared_errors = np.zeros(matrix.shape[1])
+    for path in paths:
+        with xr.open_dataset(path, engine='netcdf4') as ds:
+            values = data_utils.extract_variables_from_dataset(ds, subset)
+
+        standardized = (values - mean) / std
+        coefficient = standardized @ matrix.T
+        reconstructed = coefficient @ matrix * std + mean
+        squared_errors += np.sum((reconstructed - values) ** 2, axis=(0, 1))
+        coefficients.append(coefficient.astype(np.float32))
+
+    return np.stack(coefficients), squared_errors
+
+
+def build_pca_compressed_dataset(paths: list[str],
+                                 directory: str,
+                                 statistics: ChannelStatistics,
+                                 subset: OrderedDict,
+                                 nb_components: int | None = None,
+                                 explained_variance: float | None = None,
+                                 workers: int | None = None,
+                                 chunk_size: int = 16) -> pd.DataFrame:
+    """
+    Encode the given .nc files to `directory`.
+
+    Returns
+    =======
+    Reconstruction error of each channel (also saved as `reconstruction_error.csv`):
+    RMSE in units of the channel, RMSE relative to the channel's standard deviation,
+    and the fraction of variance explained by the reconstruction.
+    """
+    paths = sorted(set(paths))
+    subset = OrderedDict(subset)
+    statistics = statistics.subset(subset)
+    mean = statistics.mean.astype(np.float32)
+    std = np.sqrt(np.maximum(statistics.variance, 1e-12)).astype(np.float32)
+
+    bases = pca_bases(statistics, subset, nb_components, explained_variance)
+    matrix = _basis_matrix(bases)
+
+    os.makedirs(directory, exist_ok=True)
+    coefficients = None
+    squared_errors = np.zeros(matrix.shape[1])
+    chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+    with futures.ProcessPoolExecutor(
+            max_workers=workers or os.cpu_count(),
+            mp_context=multiprocessing.get_context('spawn')) as executor:
+        nb_chunks = len(chunks)
+        tasks = executor.map(_encode_files, chunks, [subset] * nb_chunks, [mean] * nb_chunks, [std] * nb_chunks, [matrix] * nb_chunks)
+        for i, (chunk_coefficients, chunk_squared_errors) in enumerate(tasks):
+            if coefficients is None:
+                shape = (len(paths),) + chunk_coefficients.shape[1:]
+                coefficients = np.lib.format.open_memmap(
+                    os.path.join(directory, 'coefficients.npy.tmp'), mode='w+', dtype=np.float32, shape=shape)
+
+            coefficients[i * chunk_size:i * chunk_size + len(chunk_coefficients)] = chunk_coefficients
+            squared_errors += chunk_squared_errors
+
+    coefficients.flush()
+    grid_shape = coefficients.shape[1:3]
+    del coefficients
+    os.replace(os.path.join(directory, 'coefficients.npy.tmp'), os.path.join(directory, 'coefficients.npy'))
+
+    nb_values = len(paths) * np.prod(grid_shape)
+    rmse = np.sqrt(squared_errors / nb_values)
+    errors = pd.DataFrame(subset_channels(subset), columns=['Variable', 'Level'])
+    errors['RMSE'] = rmse
+    errors['Relative RMSE'] = rmse / std
+    errors['Explained Variance'] = 1 - (rmse / std) ** 2
+    errors.to_csv(os.path.join(directory, 'reconstruction_error.csv'), index=False)
+
+    np.savez(os.path.join(directory, 'bases.npz'), mean=mean, std=std, **bases)
+    with open(os.path.join(directory, 'dataset.json'), 'w') as f:
+        json.dump(dict(
+            paths=paths,
+            subset=subset,
+            variables=list(bases.keys()),
+            nb_channels=matrix.shape[1],
+            nb_coefficients=matrix.shape[0],
+            version=statistics.version,
+        ), f, indent=2)
+
+    return errors
+
+
+class PCACompressedDataset:
+    def __init__(self, directory: str) -> None:
+        """
+        Parameters
+        ==========
+        directory: str
+            Directory written by `build_pca_compressed_dataset`.
+        """
+        with open(os.path.join(directory, 'dataset.json')) as f:
+            metadata = json.load(f)
+
+        self.subset = OrderedDict(metadata['subset'])
+        self._rows = {path: i for i, path in enumerate(metadata['paths'])}
+        self.coefficients = np.load(os.path.join(directory, 'coefficients.npy'), mmap_mode='r')
+
+        with np.load(os.path.join(directory, 'bases.npz')) as bases:
+            self.mean, self.std = bases['mean'], bases['std']
+            self.bases = OrderedDict((variable, bases[variable]) for variable in metadata['variables'])
+
+        self.matrix = _basis_matrix(self.bases)
+
+    @property
+    def compression_ratio(self) -> float:
+        return self.matrix.shape[1] / self.matrix.shape[0]
+
+    def read(self, paths: list[str]) -> np.ndarray:
+        """
+        Coefficients of the given observation files, of shape (len(paths), lat, lon, coefficients).
+        """
+        rows = np.asarray([self._rows[path] for path in paths])
+        # Read in increasing order of rows, which is much faster for memory-mapped files.
+        order = np.argsort(rows)
+        coefficients = np.empty((len(rows),) + self.coefficients.shape[1:], dtype=np.float32)
+        coefficients[order] = self.coefficients[rows[order]]
+        return coefficients
+
+    def reconstruct(self, coefficients, standardized: bool = True):
+        """
+        Reconstruct channels (as a tensor) from coefficients of shape (..., coefficients), in graph or eagerly.
+        Channels are standardized, unless `standardized` is False.
+        """
+        import tensorflow as tf
+
+        channels = tf.einsum('...k,kc->...c', coefficients, tf.constant(self.matrix))
+        return channels if standardized else channels * self.std + self.mean
+
+    def load_dataset(self,
+                     label: str | pd.DataFrame,
+                     batch_size: int = 64,
+                     shuffle: bool = False,
+                     leadtimes: list[int] | None = None,
+                     reconstruct: bool = False,
+                     seed: int | None = None):
+        """
+        Load the batched dataset of (X, y) of the observations of a label file,
+        where y is whether a TC will form, as `TropicalCycloneOccurenceDataLoader`.
+
+        Parameters
+        ==========
+        label: str | pd.DataFrame
+            Path to label file, or label dataframe.
+        reconstruct: bool
+            Whether X are the reconstructed (standardized) channels, or the coefficients.
+        """
+        import tensorflow as tf
+        import tc_formation.data.label as label_utils
+
+        if isinstance(label, str):
+            label = label_utils.load_label(label, group_observation_by_date=True, leadtime=leadtimes)
+
+        paths = label['Path'].tolist()
+        missing = [path for path in paths if path not in self._rows]
+        assert len(missing) == 0, f'{len(missing)} observations are not in the dataset, e.g. {missing[0]}.'
+
+        rows = np.asarray([self._rows[path] for path in paths])
+        targets = label['TC'].to_numpy(dtype=np.float32)[:, None]
+        X_shape = self.coefficients.shape[1:]
+
+        def read_batch(indices):
+            indices = np.sort(indices)
+            return np.asarray(self.coefficients[rows[indices]], dtype=np.float32), targets[indices]
+
+        dataset = tf.data.Dataset.range(len(rows))
+        if shuffle:
+            dataset = dataset.shuffle(len(rows), seed=seed, reshuffle_each_iteration=True)
+
+        dataset = dataset.batch(batch_size).map(
+            lambda indices: tf.numpy_function(read_batch, [indices], [tf.float32, tf.float32]),
+            num_parallel_calls=tf.data.AUTOTUNE)
+        dataset = dataset.map(lambda X, y: (tf.ensure_shape(X, (None,) + X_shape), tf.ensure_shape(y, (None, 1))))
+        if reconstruct:
+            dataset = dataset.map(lambda X, y: (self.reconstruct(X), y))
+
+        return dataset.prefetch(tf.data.AUTOTUNE)
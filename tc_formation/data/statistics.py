@@ -0,0 +1,272 @@
+"""
+Per-channel normalization statistics and PCA bases, computed once per dataset version.
+
+Instead of `Normalization.adapt` over the decoded training set for each run and each channel configuration,
+the statistics of every channel (every variable at every level) of the .nc files are computed
+in one streaming pass, in parallel over chunks of files:
+each chunk is reduced to its count, mean and sum of squared deviations (or of cross products),
+and chunks are merged with the parallel form of Welford's algorithm (Chan et al.).
+The statistics are stored next to the data, keyed by the version of the dataset (names, sizes and dates of the files),
+and any channel subset is served from them:
+    >>> statistics = load_or_compute_statistics(paths)
+    >>> normalizer = statistics.normalization(subset)
+
+With covariances (the default), the channel covariance matrix is also kept,
+so the PCA basis of any channel subset is exact, without another pass over the data:
+    >>> components, variances = statistics.pca(subset, nb_components=16)
+    >>> pca = SklearnPCALayer(components, variances)
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+import concurrent.futures as futures
+from dataclasses import dataclass
+import hashlib
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+from tc_formation.models.fan_out import channel_indices, subset_channels
+
+
+def full_subset(path: str) -> OrderedDict:
+    """
+    Subset of all variables and levels of the given .nc file.
+    """
+    import xarray as xr
+
+    with xr.open_dataset(path, engine='netcdf4') as ds:
+        return OrderedDict(
+            (name, [float(l) for l in ds[name]['lev'].values] if 'lev' in ds[name].dims else True)
+            for name in ds.data_vars)
+
+
+def dataset_version(paths: list[str]) -> str:
+    """
+    Version of a dataset, given by the names, sizes and modification dates of its files.
+    """
+    digest = hashlib.sha1()
+    for path in sorted(set(paths)):
+        stat = os.stat(path)
+        digest.update(f'{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+
+    return digest.hexdigest()[:16]
+
+
+@dataclass
+class ChannelStatistics:
+    channels: list[tuple[str, float | None]]
+    count: int
+    mean: np.ndarray
+    # Sums of squared deviations from the mean of shape (C,),
+    # or sums of cross products of deviations of shape (C, C) with covariances.
+    m2: np.ndarray
+    version: str = ''
+
+    @property
+    def has_covariance(self) -> bool:
+        return self.m2.ndim == 2
+
+    @property
+    def variance(self) -> np.ndarray:
+        m2 = np.diagonal(self.m2) if self.has_covariance else self.m2
+        return m2 / max(self.count, 1)
+
+    @property
+    def covariance(self) -> np.ndarray:
+        assert self.has_covariance, 'Statistics were computed without covariances.'
+        return self.m2 / max(self.count - 1, 1)
+
+    @classmethod
+    def empty(cls, channels: list, covariance: bool = True) -> ChannelStatistics:
+        nb_channels = len(channels)
+        return cls(list(channels), 0, np.zeros(nb_channels), np.zeros((nb_channels, nb_channels) if covariance else nb_channels))
+
+    @classmethod
+    def from_values(cls, channels: list, values: np.ndarray, covariance: bool = True) -> ChannelStatistics:
+        """
+        Statistics of values of shape (..., C), rows with non-finite values are ignored.
+        """
+        values = values.reshape((-1, len(channels))).astype(np.float64)
+        values = values[np.isfinite(values).all(axis=-1)]
+        mean = values.mean(axis=0) if len(values) else np.zeros(len(channels))
+        deviations = values - mean
+        m2 = deviations.T @ deviations if covariance else np.sum(deviations ** 2, axis=0)
+        return cls(list(channels), len(values), mean, m2)
+
+    def merge(self, other: ChannelStatistics) -> ChannelStatistics:
+        assert self.channels == other.channels, 'Statistics of different channels.'
+        count = self.count + other.count
+        if count == 0:
+            return self
+
+        delta = other.mean - self.mean
+        mean = self.mean + delta * other.count / count
+        correction = (np.outer(delta, delta) if self.has_covariance else delta ** 2) * self.count * other.count / count
+        return ChannelStatistics(self.channels, count, mean, self.m2 + other.m2 + correction, self.version)
+
+    def subset(self, subset: dict) -> ChannelStatistics:
+        """
+        Statistics of the channels of the given subset, in the order of `extract_variables_from_dataset`.
+        """
+        indices = channel_indices(self._as_subset(), subset)
+        m2 = self.m2[np.ix_(indices, indices)] if self.has_covariance else self.m2[indices]
+        return ChannelStatistics(subset_channels(subset), self.count, self.mean[indices], m2, self.version)
+
+    def _as_subset(self) -> OrderedDict:
+        subset = OrderedDict()
+        for variable, level in self.channels:
+            if level is None:
+                subset[variable] = True
+            else:
+                subset.setdefault(variable, []).append(level)
+
+        return subset
+
+    def normalization(self, subset: dict | None = None):
+        """
+        Normalization layer of the given subset (all channels by default), initialized without `adapt`.
+        """
+        import tensorflow.keras.layers as layers
+
+        statistics = self if subset is None else self.subset(subset)
+        return layers.Normalization(mean=statistics.mean, variance=statistics.variance)
+
+    def pca(self, subset: dict | None = None, nb_components: int | None = None, standardize: bool = True):
+        """
+        PCA basis of the given subset (all channels by default).
+
+        Parameters
+        ==========
+        standardize: bool
+            Whether the PCA is of standardized channels (i.e. after `normalization`),
+            otherwise of centered channels.
+
+        Returns
+        =======
+        Components of shape (nb_components, C) and their explained variances,
+        as `components_` and `explained_variance_` of sklearn's PCA.
+        """
+        statistics = self if subset is None else self.subset(subset)
+        covariance = statistics.covariance
+        if standardize:
+            # Same standard deviations as the normalization layer.
+            std = np.sqrt(np.maximum(statistics.variance, 1e-12))
+            covariance = covariance / np.outer(std, std)
+
+        variances, components = np.linalg.eigh(covariance)
+        order = np.argsort(variances)[::-1][:nb_components]
+        components = components[:, order].T
+
+        # Same sign convention as sklearn: the largest loading of each component is positive.
+        signs = np.sign(components[np.arange(len(components)), np.argmax(np.abs(components), axis=1)])
+        return components * signs[:, None], variances[order]
+
+    def save(self, path: str) -> None:
+        tmp_path = f'{path}.tmp.npz'
+        np.savez(
+            tmp_path,
+            channels=json.dumps(self.channels),
+            count=self.count,
+            mean=self.mean,
+            m2=self.m2,
+            version=self.version)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> ChannelStatistics:
+        with np.load(path) as data:
+            channels = [tuple(channel) for channel in json.loads(str(data['channels']))]
+            return cls(channels, int(data['count']), data['mean'], data['m2'], str(data['version']))
+
+
+def _chunk_statistics(paths: list[str], subset: OrderedDict, covariance: bool) -> ChannelStatistics:
+    import xarray as xr
+    import tc_formation.data.data as data_utils
+
+    channels = subset_channels(subset)
+    statistics = ChannelStatistics.empty(channels, covariance)
+    for path in paths:
+        with xr.open_dataset(path, engine='netcdf4') as ds:
+            values = data_utils.extract_variables_from_dataset(ds, subset)
+
+        statistics = statistics.merge(ChannelStatistics.from_values(channels, values, covariance))
+
+    return statistics
+
+
+def compute_statistics(paths: list[str],
+                       subset: OrderedDict | None = None,
+                       covariance: bool = True,
+                       workers: int | None = None,
+                       chunk_size: int = 16) -> ChannelStatistics:
+    """
+    Compute the statistics of every grid point of the given .nc files, in parallel over chunks of files.
+
+    Parameters
+    ==========
+    paths: list[str]
+        Paths to .nc files, duplicates are counted once.
+    subset: OrderedDict | None
+        Channels to compute statistics of, default to all variables and levels of the first file.
+    covariance: bool
+        Whether to keep the channel covariance matrix, required for PCA.
+    workers: int | None
+        Number of worker processes, default to the number of cores.
+    chunk_size: int
+        Number of files reduced by each task.
+    """
+    paths = sorted(set(paths))
+    assert len(paths) > 0, 'There are no files.'
+    subset = full_subset(paths[0]) if subset is None else OrderedDict(subset)
+
+    statistics = ChannelStatistics.empty(subset_channels(subset), covariance)
+    chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+    with futures.ProcessPoolExecutor(
+            max_workers=workers or os.cpu_count(),
+            mp_context=multiprocessing.get_context('spawn')) as executor:
+        for chunk_statistics in executor.map(_chunk_statistics, chunks, [subset] * len(chunks), [covariance] * len(chunks)):
+            statistics = statistics.merge(chunk_statistics)
+
+    statistics.version = dataset_version(paths)
+    return statistics
+
+
+def _channels_digest(channels: list[tuple[str, float | None]]) -> str:
+    channels = [(variable, None if level is None else float(level)) for variable, level in channels]
+    return hashlib.sha1(json.dumps(channels).encode()).hexdigest()[:16]
+
+
+def load_or_compute_statistics(paths: list[str], directory: str | None = None, **kwargs) -> ChannelStatistics:
+    """
+    Load the statistics of the current version of the dataset,
+    stored in `directory` (default to the directory of the files), or compute and store them.
+    Statistics of all channels serve any subset,
+    statistics computed for a given subset are stored in their own file.
+    Other arguments are passed to `compute_statistics`.
+    """
+    paths = sorted(set(paths))
+    directory = directory or os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in paths])
+    version = dataset_version(paths)
+    full_path = os.path.join(directory, f'channel_statistics_{version}.npz')
+
+    subset = kwargs.get('subset')
+    channels = subset_channels(full_subset(paths[0]) if subset is None else subset)
+    path = (full_path
+            if subset is None
+            else os.path.join(directory, f'channel_statistics_{version}_{_channels_digest(channels)}.npz'))
+
+    for cached_path in dict.fromkeys([full_path, path]):
+        if not os.path.isfile(cached_path):
+            continue
+
+        statistics = ChannelStatistics.load(cached_path)
+        if (set(channels) <= set(statistics.channels)
+                and (statistics.has_covariance or not kwargs.get('covariance', True))):
+            return statistics if statistics.channels == channels else statistics.subset(subset)
+
+    statistics = compute_statistics(paths, **kwargs)
+    statistics.save(path)
+    return statistics
@@ -1,3 +1,4 @@
+import numpy as np
 import tensorflow as tf
 
 """
@@ -31,3 +32,19 @@ def _tensor_spec_to_dtype(v):
     return v.dtype if isinstance(v, tf.TensorSpec) else v
 
 
+
+
+def ragged_from_rows(rows, inner_shape=(), dtype=np.float64) -> tf.RaggedTensor:
+    """
+    Create ragged tensor from rows of numpy arrays,
+    by concatenating all rows into values and computing the row splits,
+    instead of traversing Python objects as `tf.ragged.constant` does.
+    """
+    rows = [np.asarray(row, dtype=dtype).reshape((-1,) + tuple(inner_shape)) for row in rows]
+    row_splits = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(row) for row in rows], out=row_splits[1:])
+
+    values = (np.concatenate(rows, axis=0)
+              if len(rows) > 0
+              else np.zeros((0,) + tuple(inner_shape), dtype=dtype))
+    return tf.RaggedTensor.from_row_splits(values, row_splits)
@@ -47,6 +47,18 @@ class TimeSeriesTropicalCycloneDataLoader:
     def _are_valid_paths(cls, paths: List[str]) -> bool:
         return all([os.path.isfile(p) for p in paths])
 
+    def load_observations(self, paths: List[str]) -> np.ndarray:
+        """
+        Load the observations at the given paths (as in the `Path` column, with previous observations),
+        stacked along the time axis, i.e. the input `X` decoded by `_process_to_dataset`.
+        """
+        datasets = []
+        for path in paths:
+            dataset = xr.open_dataset(path, engine='netcdf4')
+            dataset = data_utils.extract_variables_from_dataset(dataset, self._subset)
+            datasets.append(np.expand_dims(dataset, axis=0))
+        return np.concatenate(datasets, axis=0)
+
     @abc.abstractmethod
     def _process_to_dataset(self, tc_df: pd.DataFrame) -> tf.data.Dataset:
         pass
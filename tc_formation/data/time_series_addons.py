@@ -56,3 +56,31 @@ class SingleTimeStepMixin(TimeSeriesTropicalCycloneDataLoader):
     def _remove_time_axis(cls, X, *args):
         X = tf.squeeze(X, axis=0)
         return X, *args
+
+
+class ShardedMixin:
+    """
+    Only process the rows `shard_index::num_shards` of the label dataframe,
+    so that each worker of a distributed training decodes a disjoint shard of the dataset.
+    Workers must sample negative samples with the same random seed,
+    otherwise the shards are not disjoint.
+    """
+    def __init__(self, *args, num_shards: int = 1, shard_index: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        assert 0 <= shard_index < num_shards, 'Invalid shard index.'
+        self._num_shards = num_shards
+        self._shard_index = shard_index
+        self.nb_rows = None
+
+    def _process_to_dataset(self, tc_df: pd.DataFrame, **kwargs) -> tf.data.Dataset:
+        # Number of rows of the whole dataset, so workers can agree on the number of steps per epoch.
+        self.nb_rows = len(tc_df)
+        return super()._process_to_dataset(tc_df.iloc[self._shard_index::self._num_shards], **kwargs)
+
+
+def sharded(loader_cls: type) -> type:
+    """
+    Create the sharded version of the given data loader class, e.g.
+        >>> loader = sharded(TropicalCycloneOccurenceDataLoader)(data_shape, subset, num_shards=2, shard_index=0)
+    """
+    return type(f'Sharded{loader_cls.__name__}', (ShardedMixin, loader_cls), {})
@@ -1,5 +1,33 @@
+"""
+Forward features selection: starting from no (or the given) features,
+the feature which improves the validation objective the most is added at each step.
+
+`ForwardFeaturesSelection` masks the input channels, and trains every proposal sequentially with full training.
+`ParallelForwardFeaturesSelection` is much faster:
+    * the dataset is decoded only once (`search.cache_dataset`),
+      and each candidate only reads its channels from the cached tensor,
+    * candidates of a step are trained concurrently in separate processes,
+    * weak candidates are pruned early by successive halving:
+      all candidates are trained for a few epochs, and only the best 1 / eta are trained further,
+    * candidates can be warm-started from the weights of the previous step's best model,
+      the weights of the new channels are initialized to zero,
+      so the warm-started model starts from the previous step's predictions.
+"""
+from __future__ import annotations
+
+import concurrent.futures as futures
+import hashlib
+import json
+import multiprocessing
 import numpy as np
+import os
+import pandas as pd
 import tensorflow.keras as keras
+import time
+from typing import Callable
+
+from ..hyperparameters_tuning.search import CachedDataset, ResultsStore, evaluate_metrics, init_worker
+from ..models.fan_out import subset_channels
 
 
 class ForwardFeaturesSelection:
@@ -79,3 +107,270 @@ class ForwardFeaturesSelection:
                 proposals.append(proposal + feature_mask)
                 
         return proposals
+
+
+def variable_features(subset: dict) -> dict[str, list[int]]:
+    """
+    Group channels of the tensor given by `extract_variables_from_dataset` by variables,
+    so that each variable (with all its levels) is selected as a single feature.
+    """
+    features = {}
+    for i, (variable, _) in enumerate(subset_channels(subset)):
+        features.setdefault(variable, []).append(i)
+
+    return features
+
+
+def warm_start_weights(previous_model: keras.Model, model: keras.Model) -> None:
+    """
+    Copy weights of the previous model to the model with more input channels,
+    layers are matched by name.
+    Kernels taking the input channels (e.g. the first convolution) are copied for the previous channels,
+    and are zero for the new channels, which are appended after the previous channels.
+    """
+    for layer in model.layers:
+        try:
+            previous_layer = previous_model.get_layer(layer.name)
+        except ValueError:
+            continue
+
+        weights = layer.get_weights()
+        previous_weights = previous_layer.get_weights()
+        if len(weights) != len(previous_weights):
+            continue
+
+        for i, (w, previous_w) in enumerate(zip(weights, previous_weights)):
+            if w.shape == previous_w.shape:
+                weights[i] = previous_w
+            elif (w.ndim >= 2 and w.ndim == previous_w.ndim
+                    and w.shape[:-2] == previous_w.shape[:-2] and w.shape[-1] == previous_w.shape[-1]
+                    and w.shape[-2] > previous_w.shape[-2]):
+                weights[i] = np.zeros_like(w)
+                weights[i][..., :previous_w.shape[-2], :] = previous_w
+
+        layer.set_weights(weights)
+
+
+def _evaluate_candidate(model_fn: Callable,
+                        channels: list[int],
+                        train: CachedDataset,
+                        val: CachedDataset,
+                        checkpoint_path: str,
+                        warm_start_path: str | None,
+                        initial_epoch: int,
+                        epochs: int,
+                        batch_size: int,
+                        objective: str,
+                        seed: int,
+                        fit_kwargs: dict) -> dict:
+    import tensorflow as tf
+
+    start = time.perf_counter()
+    tf.random.set_seed(seed)
+    if initial_epoch > 0 and os.path.exists(checkpoint_path):
+        model = keras.models.load_model(checkpoint_path)
+    else:
+        initial_epoch = 0
+        model = model_fn(train.X_shape[:-1] + (len(channels),))
+        if warm_start_path is not None:
+            warm_start_weights(keras.models.load_model(warm_start_path), model)
+
+    model.fit(
+        train.load(batch_size, shuffle=True, seed=seed, channels=channels),
+        initial_epoch=initial_epoch,
+        epochs=epochs,
+        verbose=0,
+        **fit_kwargs)
+    metrics = evaluate_metrics(model, val.load(batch_size, channels=channels))
+
+    model.save(checkpoint_path)
+    keras.backend.clear_session()
+
+    return dict(objective=metrics[objective], metrics=metrics, seconds=time.perf_counter() - start)
+
+
+class ParallelForwardFeaturesSelection:
+    def __init__(self,
+                 model_fn: Callable,
+                 train: CachedDataset,
+                 val: CachedDataset,
+                 directory: str,
+                 nb_features_to_select: int,
+                 features: dict[str, list[int]] | None = None,
+                 min_epochs: int = 3,
+                 max_epochs: int = 27,
+                 eta: int = 3,
+                 warm_start: bool = True,
+                 objective: str = 'f1_score',
+                 batch_size: int = 64,
+                 workers: int = 2,
+                 seed: int = 0,
+                 fit_kwargs: dict | None = None) -> None:
+        """
+        Parameters
+        ==========
+        model_fn: Callable
+            Module-level function creating a compiled model from the input shape.
+        train, val: CachedDataset
+            Training and validation datasets with all channels, created by `search.cache_dataset`.
+        directory: str
+            Directory of the results store (`results.db`) and candidates' checkpoints.
+        nb_features_to_select: int
+            Maximum number of features to select.
+        features: dict[str, list[int]]
+            Channels of each feature (e.g. given by `variable_features`), default to one feature per channel.
+        min_epochs, max_epochs: int
+            Epochs of the first and the last rung of successive halving.
+        eta: int
+            Only the best 1 / eta candidates of each rung are trained further.
+        warm_start: bool
+            Whether candidates start from the weights of the previous step's best model.
+        objective: str
+            Validation metric to maximize, e.g. "f1_score" (computed from precision and recall).
+        workers: int
+            Number of candidates trained concurrently, each in its own process.
+        fit_kwargs: dict
+            Other arguments of `keras.Model.fit`, e.g. `class_weight`.
+        """
+        self._model_fn = model_fn
+        self._train = train
+        self._val = val
+        self._directory = directory
+        self._nb_features_to_select = nb_features_to_select
+        self._features = features or {f'channel_{i}': [i] for i in range(train.X_shape[-1])}
+        self._min_epochs = min_epochs
+        self._max_epochs = max_epochs
+        self._eta = eta
+        self._warm_start = warm_start
+        self._objective = objective
+        self._batch_size = batch_size
+        self._workers = workers
+        self._seed = seed
+        self._fit_kwargs = fit_kwargs or {}
+
+        self._best_proposal = None
+        self._best_proposal_score = None
+        self.history = None
+
+        os.makedirs(os.path.join(directory, 'checkpoints'), exist_ok=True)
+        self.store = ResultsStore(os.path.join(directory, 'results.db'))
+
+    def best_proposal(self) -> list[str]:
+        return self._best_proposal
+
+    def best_proposal_score(self) -> float:
+        return self._best_proposal_score
+
+    def _rungs(self, nb_candidates: int) -> list[tuple[int, int]]:
+        rungs = []
+        epochs = min(self._min_epochs, self._max_epochs)
+        while True:
+            rungs.append((nb_candidates, epochs))
+            if epochs == self._max_epochs:
+                return rungs
+
+            # The last candidate is always trained for `max_epochs`, so steps are compared fairly.
+            nb_candidates = max(nb_candidates // self._eta, 1)
+            epochs = self._max_epochs if nb_candidates == 1 else min(epochs * self._eta, self._max_epochs)
+
+    def _channels(self, features: list[str]) -> list[int]:
+        return [c for f in features for c in self._features[f]]
+
+    def _trial_id(self, step: int, selected: list[str], candidate: str) -> str:
+        # Results and checkpoints are only reused by the same selection (the selected features, in order,
+        # which include the initial features) in the same run configuration.
+        config = dict(
+            selected=selected,
+            features={f: self._features[f] for f in selected + [candidate]},
+            model_fn=f'{self._model_fn.__module__}.{self._model_fn.__qualname__}',
+            train=[self._train.path, self._train.nb_samples, list(self._train.X_shape)],
+            val=[self._val.path, self._val.nb_samples, list(self._val.X_shape)],
+            epochs=[self._min_epochs, self._max_epochs, self._eta],
+            warm_start=self._warm_start,
+            objective=self._objective,
+            batch_size=self._batch_size,
+            seed=self._seed,
+            fit_kwargs=self._fit_kwargs,
+        )
+        digest = hashlib.sha1(json.dumps(config, sort_keys=True, default=repr).encode()).hexdigest()[:16]
+        return f'step{step}_{candidate}_{digest}'
+
+    def _checkpoint_path(self, trial_id: str) -> str:
+        return os.path.join(self._directory, 'checkpoints', f'{trial_id}.keras')
+
+    def _run_step(self, executor, step: int, selected: list[str], warm_start_path: str | None) -> tuple[str, float]:
+        candidates = [f for f in self._features if f not in selected]
+        rungs = self._rungs(len(candidates))
+
+        initial_epoch = 0
+        for rung, (nb_candidates, epochs) in enumerate(rungs):
+            candidates = candidates[:nb_candidates]
+            objectives, jobs = {}, {}
+            for i, candidate in enumerate(candidates):
+                trial_id = self._trial_id(step, selected, candidate)
+                # Results already in the store were computed before the selection was interrupted.
+                result = self.store.get(trial_id, rung)
+                if result is not None:
+                    objectives[candidate] = result['objective']
+                    continue
+
+                jobs[executor.submit(
+                    _evaluate_candidate,
+                    self._model_fn, self._channels(selected + [candidate]), self._train, self._val,
+                    self._checkpoint_path(trial_id), warm_start_path, initial_epoch, epochs,
+                    self._batch_size, self._objective, self._seed + i, self._fit_kwargs)] = candidate
+
+            for job in futures.as_completed(jobs):
+                candidate = jobs[job]
+                result = job.result()
+                self.store.add(dict(trial_id=self._trial_id(step, selected, candidate), bracket=step, rung=rung,
+                                    config=dict(features=selected + [candidate]), epochs=epochs, **result))
+                objectives[candidate] = result['objective']
+                print(f'Step {step}, candidate {candidate} ({epochs} epochs): '
+                      f'{self._objective} = {result["objective"]:.4f} in {result["seconds"]:.1f}s.')
+
+            candidates = sorted(objectives, key=objectives.get, reverse=True)
+            initial_epoch = epochs
+
+        return candidates[0], objectives[candidates[0]]
+
+    def fit(self, initial_features: list[str] | None = None) -> list[str]:
+        """
+        Select features forward, until `nb_features_to_select` features are selected,
+        or the best candidate doesn't improve the objective.
+
+        Returns
+        =======
+        Names of the selected features, in the order they were selected.
+        """
+        selected = list(initial_features or [])
+        best_score = -np.inf
+        warm_start_path = None
+        history = []
+
+        nb_threads = max((os.cpu_count() or 1) // self._workers, 1)
+        with futures.ProcessPoolExecutor(
+                max_workers=self._workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_worker,
+                initargs=(nb_threads,)) as executor:
+            while len(selected) < min(self._nb_features_to_select, len(self._features)):
+                step = len(selected)
+                start = time.perf_counter()
+                candidate, score = self._run_step(executor, step, selected, warm_start_path)
+                history.append(dict(step=step, feature=candidate, score=score, seconds=time.perf_counter() - start))
+
+                if score <= best_score:
+                    print(f'Best candidate {candidate} does not improve {self._objective}. Stop!!')
+                    break
+
+                print(f'Select {candidate}, {self._objective} improves from {best_score:.4f} to {score:.4f}.')
+                if self._warm_start:
+                    warm_start_path = self._checkpoint_path(self._trial_id(step, selected, candidate))
+                selected.append(candidate)
+                best_score = score
+
+        self._best_proposal = selected
+        self._best_proposal_score = best_score
+        self.history = pd.DataFrame(history)
+        return selected
@@ -1,6 +1,34 @@
-import keras_tuner as kt
+"""
+Search space of `ConfigurableResNet` for binary classification, to be used with `search.HyperbandSearch`.
+"""
 import tensorflow.keras as keras
-import tensorflow.keras.layers as layers
 
-def _ResNetTuningModel():
-    ...
+from tc_formation.models.resnet_configurable import ConfigurableResNet
+
+
+SEARCH_SPACE = dict(
+    starting_channels=[16, 32, 64],
+    blocks=[[1, 1], [2, 2], [1, 1, 1], [2, 2, 2], [2, 2, 2, 2]],
+    kernel_size=[3, 5],
+    learning_rate=[1e-3, 3e-4, 1e-4],
+)
+
+
+def build_model(config: dict, input_shape: tuple) -> keras.Model:
+    model = ConfigurableResNet(
+        input_shape=input_shape,
+        classes=1,
+        classifier_activation='sigmoid',
+        kernel_size=config['kernel_size'],
+        starting_channels=config['starting_channels'],
+        blocks=config['blocks'],
+        model_name='resnet_search')
+    model.compile(
+        optimizer=keras.optimizers.Adam(config['learning_rate']),
+        loss=keras.losses.BinaryCrossentropy(),
+        metrics=[
+            keras.metrics.BinaryAccuracy(),
+            keras.metrics.Precision(name='precision'),
+            keras.metrics.Recall(name='recall'),
+        ])
+    return model
@@ -0,0 +1,354 @@
+"""
+Parallel hyperparameter search with Hyperband (successive halving).
+
+Compared to running keras_tuner trials sequentially with full-length training:
+    * the training and validation datasets are decoded only once (`cache_dataset`),
+      and every trial reads them from memory-mapped files, shared by the OS page cache,
+    * trials of the same rung are trained concurrently in separate processes,
+    * each bracket of Hyperband starts many configurations with few epochs,
+      and only the best 1 / eta of them are promoted to the next rung,
+      where they resume from their checkpoint instead of training from scratch,
+    * results of every (trial, rung) are recorded in a local SQLite store,
+      so an interrupted search resumes where it stopped.
+
+A search is defined by a search space, i.e. a dict of hyperparameter name to its choices,
+and a model builder, i.e. a module-level function `build_model(config, input_shape)`
+returning a compiled keras model (see `resnet.py` and `unet.py`):
+    >>> from tc_formation.hyperparameters_tuning import resnet
+    >>> train = cache_dataset(train_ds, 'search/cache', 'train')
+    >>> val = cache_dataset(val_ds, 'search/cache', 'val')
+    >>> search = HyperbandSearch(resnet.build_model, resnet.SEARCH_SPACE, train, val, 'search', max_epochs=27)
+    >>> search.run()
+"""
+from __future__ import annotations
+
+import concurrent.futures as futures
+from dataclasses import dataclass
+import json
+import math
+import multiprocessing
+import numpy as np
+import os
+import pandas as pd
+import sqlite3
+import time
+from typing import Callable
+
+
+@dataclass
+class CachedDataset:
+    """
+    Decoded dataset of (X, y) stored as raw memory-mapped files.
+    """
+    path: str
+    nb_samples: int
+    X_shape: tuple[int, ...]
+    y_shape: tuple[int, ...]
+
+    def arrays(self) -> tuple[np.memmap, np.memmap]:
+        X = np.memmap(f'{self.path}_X.bin', dtype=np.float32, mode='r', shape=(self.nb_samples,) + self.X_shape)
+        y = np.memmap(f'{self.path}_y.bin', dtype=np.float32, mode='r', shape=(self.nb_samples,) + self.y_shape)
+        return X, y
+
+    def load(self, batch_size: int, shuffle: bool = False, seed: int | None = None, channels: list[int] | None = None):
+        """
+        Load the batched tf.data dataset of (X, y), reading batches from the memory-mapped files.
+        If `channels` is given, only these channels (in the given order) of X are kept.
+        """
+        import tensorflow as tf
+
+        X, y = self.arrays()
+        X_shape = self.X_shape if channels is None else self.X_shape[:-1] + (len(channels),)
+
+        def read_batch(indices):
+            # Read in increasing order of indices, which is much faster for memory-mapped files.
+            indices = np.sort(indices)
+            X_batch = X[indices]
+            return (X_batch if channels is None else X_batch[..., channels]), y[indices]
+
+        dataset = tf.data.Dataset.range(self.nb_samples)
+        if shuffle:
+            dataset = dataset.shuffle(self.nb_samples, seed=seed, reshuffle_each_iteration=True)
+
+        dataset = dataset.batch(batch_size).map(
+            lambda indices: tf.numpy_function(read_batch, [indices], [tf.float32, tf.float32]),
+            num_parallel_calls=tf.data.AUTOTUNE)
+        dataset = dataset.map(lambda X, y: (tf.ensure_shape(X, (None,) + X_shape),
+                                            tf.ensure_shape(y, (None,) + self.y_shape)))
+        return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def cache_dataset(dataset, cache_dir: str, name: str) -> CachedDataset:
+    """
+    Decode the batched dataset of (X, y) given by data loaders once,
+    and store it in `cache_dir`. If the cache already exists, the dataset is not decoded again.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, name)
+    meta_path = f'{path}.json'
+
+    if not os.path.isfile(meta_path):
+        nb_samples, X_shape, y_shape = 0, None, None
+        with open(f'{path}_X.bin.tmp', 'wb') as X_file, open(f'{path}_y.bin.tmp', 'wb') as y_file:
+            for X, y, *_ in dataset:
+                X = np.asarray(X, dtype=np.float32)
+                y = np.asarray(y, dtype=np.float32)
+                X_file.write(X.tobytes())
+                y_file.write(y.tobytes())
+                nb_samples += len(X)
+                X_shape, y_shape = X.shape[1:], y.shape[1:]
+
+        os.replace(f'{path}_X.bin.tmp', f'{path}_X.bin')
+        os.replace(f'{path}_y.bin.tmp', f'{path}_y.bin')
+        with open(meta_path, 'w') as f:
+            json.dump(dict(nb_samples=nb_samples, X_shape=X_shape, y_shape=y_shape), f)
+
+    with open(meta_path) as f:
+        meta = json.load(f)
+
+    return CachedDataset(path, meta['nb_samples'], tuple(meta['X_shape']), tuple(meta['y_shape']))
+
+
+class ResultsStore:
+    """
+    SQLite store of the results of each trial at each rung.
+    """
+    def __init__(self, path: str) -> None:
+        self._path = path
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    trial_id TEXT,
+                    bracket INTEGER,
+                    rung INTEGER,
+                    config TEXT,
+                    epochs INTEGER,
+                    objective REAL,
+                    metrics TEXT,
+                    seconds REAL,
+                    PRIMARY KEY (trial_id, rung)
+                )""")
+
+    def _connect(self):
+        return sqlite3.connect(self._path, timeout=60)
+
+    def add(self, result: dict) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (result['trial_id'], result['bracket'], result['rung'], json.dumps(result['config']),
+                 result['epochs'], result['objective'], json.dumps(result['metrics']), result['seconds']))
+
+    def get(self, trial_id: str, rung: int) -> dict | None:
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT objective FROM results WHERE trial_id = ? AND rung = ?', (trial_id, rung)).fetchone()
+
+        return None if row is None else dict(objective=row[0])
+
+    def load(self) -> pd.DataFrame:
+        with self._connect() as conn:
+            results = pd.read_sql_query('SELECT * FROM results', conn)
+
+        results['config'] = results['config'].apply(json.loads)
+        results['metrics'] = results['metrics'].apply(json.loads)
+        return results
+
+
+def hyperband_brackets(max_epochs: int, eta: int = 3) -> list[list[tuple[int, int]]]:
+    """
+    Rungs of each Hyperband bracket, from the most exploratory bracket to plain training.
+    Each rung is (number of configurations, number of epochs).
+    """
+    s_max = int(math.floor(math.log(max_epochs, eta) + 1e-9))
+    brackets = []
+    for s in range(s_max, -1, -1):
+        nb_configs = int(math.ceil((s_max + 1) / (s + 1) * eta**s))
+        brackets.append([(max(nb_configs // eta**i, 1), max(int(round(max_epochs * eta**(i - s))), 1))
+                         for i in range(s + 1)])
+
+    return brackets
+
+
+def sample_configs(space: dict[str, list], nb_configs: int, rng: np.random.Generator) -> list[dict]:
+    return [{name: choices[rng.integers(len(choices))] for name, choices in space.items()}
+            for _ in range(nb_configs)]
+
+
+def evaluate_metrics(model, dataset) -> dict[str, float]:
+    """
+    Evaluate the compiled model, F1 score is added when the model has precision and recall metrics.
+    """
+    metrics = model.evaluate(dataset, return_dict=True, verbose=0)
+    if 'precision' in metrics and 'recall' in metrics:
+        precision, recall = metrics['precision'], metrics['recall']
+        metrics['f1_score'] = 2 * precision * recall / max(precision + recall, 1e-7)
+
+    return {name: float(value) for name, value in metrics.items()}
+
+
+def init_worker(nb_threads: int) -> None:
+    import tensorflow as tf
+
+    tf.config.threading.set_intra_op_parallelism_threads(nb_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(nb_threads)
+
+
+def _run_trial(build_fn: Callable,
+               config: dict,
+               train: CachedDataset,
+               val: CachedDataset,
+               checkpoint_path: str,
+               initial_epoch: int,
+               epochs: int,
+               batch_size: int,
+               objective: str,
+               seed: int) -> dict:
+    import tensorflow as tf
+    import tensorflow.keras as keras
+
+    start = time.perf_counter()
+    tf.random.set_seed(seed)
+    if initial_epoch > 0 and os.path.exists(checkpoint_path):
+        # Promoted trial, resume from where the previous rung stopped.
+        model = keras.models.load_model(checkpoint_path)
+    else:
+        initial_epoch = 0
+        model = build_fn(config, train.X_shape)
+
+    model.fit(
+        train.load(batch_size, shuffle=True, seed=seed),
+        initial_epoch=initial_epoch,
+        epochs=epochs,
+        verbose=0)
+    metrics = evaluate_metrics(model, val.load(batch_size))
+
+    model.save(checkpoint_path)
+    keras.backend.clear_session()
+
+    return dict(objective=metrics[objective], metrics=metrics, seconds=time.perf_counter() - start)
+
+
+class HyperbandSearch:
+    def __init__(self,
+                 build_fn: Callable,
+                 space: dict[str, list],
+                 train: CachedDataset,
+                 val: CachedDataset,
+                 directory: str,
+                 max_epochs: int = 27,
+                 eta: int = 3,
+                 objective: str = 'f1_score',
+                 direction: str = 'max',
+                 batch_size: int = 64,
+                 workers: int = 2,
+                 seed: int = 0) -> None:
+        """
+        Parameters
+        ==========
+        build_fn: Callable
+            Module-level function `build_model(config, input_shape)` returning a compiled keras model.
+        space: dict[str, list]
+            Choices of each hyperparameter.
+        train, val: CachedDataset
+            Training and validation datasets created by `cache_dataset`.
+        directory: str
+            Directory of the results store (`results.db`) and trials' checkpoints.
+        max_epochs: int
+            Maximum number of epochs of a single trial.
+        eta: int
+            Only the best 1 / eta configurations of each rung are promoted to the next rung.
+        objective: str
+            Validation metric to optimize, e.g. "f1_score" (computed from precision and recall) or "loss".
+        direction: str
+            "max" or "min".
+        workers: int
+            Number of trials trained concurrently, each in its own process.
+        """
+        assert direction in ('max', 'min'), f'Invalid direction: {direction}'
+        self._build_fn = build_fn
+        self._space = space
+        self._train = train
+        self._val = val
+        self._directory = directory
+        self._max_epochs = max_epochs
+        self._eta = eta
+        self._objective = objective
+        self._direction = direction
+        self._batch_size = batch_size
+        self._workers = workers
+        self._seed = seed
+
+        os.makedirs(os.path.join(directory, 'checkpoints'), exist_ok=True)
+        self.store = ResultsStore(os.path.join(directory, 'results.db'))
+
+    def _checkpoint_path(self, trial_id: str) -> str:
+        return os.path.join(self._directory, 'checkpoints', f'{trial_id}.keras')
+
+    def _run_rung(self, executor, bracket: int, rung: int, trials: dict[str, dict], epochs: int, initial_epoch: int):
+        jobs = {}
+        objectives = {}
+        for i, (trial_id, config) in enumerate(trials.items()):
+            # Rungs already in the store were run before the search was interrupted.
+            result = self.store.get(trial_id, rung)
+            if result is not None:
+                objectives[trial_id] = result['objective']
+                continue
+
+            jobs[executor.submit(
+                _run_trial,
+                self._build_fn, config, self._train, self._val,
+                self._checkpoint_path(trial_id), initial_epoch, epochs,
+                self._batch_size, self._objective, self._seed + i)] = trial_id
+
+        for job in futures.as_completed(jobs):
+            trial_id = jobs[job]
+            result = job.result()
+            self.store.add(dict(trial_id=trial_id, bracket=bracket, rung=rung, config=trials[trial_id],
+                                epochs=epochs, **result))
+            objectives[trial_id] = result['objective']
+            print(f'Trial {trial_id} (rung {rung}, {epochs} epochs): '
+                  f'{self._objective} = {result["objective"]:.4f} in {result["seconds"]:.1f}s.')
+
+        return objectives
+
+    def run(self, brackets: list[int] | None = None) -> pd.DataFrame:
+        """
+        Run the given Hyperband brackets (default to all of them), trials of each rung in parallel.
+
+        Returns
+        =======
+        Results of the final rung of each trial, sorted from the best trial.
+        """
+        all_brackets = hyperband_brackets(self._max_epochs, self._eta)
+        brackets = range(len(all_brackets)) if brackets is None else brackets
+
+        nb_threads = max((os.cpu_count() or 1) // self._workers, 1)
+        with futures.ProcessPoolExecutor(
+                max_workers=self._workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_worker,
+                initargs=(nb_threads,)) as executor:
+            for bracket in brackets:
+                rungs = all_brackets[bracket]
+                rng = np.random.default_rng([self._seed, bracket])
+                trials = {f'b{bracket}_t{i}': config
+                          for i, config in enumerate(sample_configs(self._space, rungs[0][0], rng))}
+
+                initial_epoch = 0
+                for rung, (nb_configs, epochs) in enumerate(rungs):
+                    objectives = self._run_rung(executor, bracket, rung, trials, epochs, initial_epoch)
+                    initial_epoch = epochs
+
+                    if rung + 1 < len(rungs):
+                        ranked = sorted(objectives, key=objectives.get, reverse=self._direction == 'max')
+                        trials = {trial_id: trials[trial_id] for trial_id in ranked[:rungs[rung + 1][0]]}
+
+        return self.best_trials()
+
+    def best_trials(self) -> pd.DataFrame:
+        results = self.store.load()
+        results = results.sort_values('rung').groupby('trial_id').tail(1)
+        return results.sort_values(
+            ['epochs', 'objective'],
+            ascending=[False, self._direction == 'min']).reset_index(drop=True)
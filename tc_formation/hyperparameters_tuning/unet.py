@@ -0,0 +1,33 @@
+"""
+Search space of `Unet` for grid probability prediction, to be used with `search.HyperbandSearch`.
+"""
+import tensorflow.keras as keras
+
+from tc_formation.models.unet import Unet
+
+
+SEARCH_SPACE = dict(
+    starting_filters=[16, 32, 64],
+    depth=[3, 4, 5],
+    decoder_shortcut_mode=['add', 'concat'],
+    learning_rate=[1e-3, 3e-4, 1e-4],
+)
+
+
+def build_model(config: dict, input_shape: tuple) -> keras.Model:
+    model = Unet(
+        input_shape=input_shape,
+        filters_block=[config['starting_filters'] * 2**i for i in range(config['depth'])],
+        output_classes=1,
+        classifier_activation='sigmoid',
+        decoder_shortcut_mode=config['decoder_shortcut_mode'],
+        model_name='unet_search')
+    model.compile(
+        optimizer=keras.optimizers.Adam(config['learning_rate']),
+        loss=keras.losses.BinaryCrossentropy(),
+        metrics=[
+            keras.metrics.BinaryAccuracy(),
+            keras.metrics.Precision(name='precision'),
+            keras.metrics.Recall(name='recall'),
+        ])
+    return model
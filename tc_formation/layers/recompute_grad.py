@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import tensorflow as tf
+import tensorflow.keras as keras
+import tensorflow.keras.layers as layers
+
+
+class RecomputeGrad(layers.Layer):
+    """
+    Wrap a block (a functional sub-model) so that its activations aren't kept for the backward pass,
+    only its inputs are, and the block is run again to compute its gradients (gradient checkpointing).
+
+    The recomputation uses the statistics of the batch like the forward pass,
+    but doesn't update the moving statistics of batch normalization layers a second time.
+    """
+    def __init__(self, block: keras.Model, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.block = block
+
+    def call(self, inputs, training=None):
+        inputs = tf.nest.flatten(inputs)
+        nb_calls = []
+
+        def forward(*x):
+            # The first call is the forward pass, the next one is the recomputation.
+            recompute = len(nb_calls) > 0
+            nb_calls.append(recompute)
+
+            momentums = {}
+            if recompute:
+                for layer in _batch_norm_layers(self.block):
+                    momentums[layer] = layer.momentum
+                    layer.momentum = 1.0
+
+            try:
+                return self.block(list(x) if len(x) > 1 else x[0], training=training)
+            finally:
+                for layer, momentum in momentums.items():
+                    layer.momentum = momentum
+
+        return tf.recompute_grad(forward)(*inputs)
+
+    def get_config(self):
+        config = super().get_config()
+        config['block'] = keras.layers.serialize(self.block)
+        return config
+
+    @classmethod
+    def from_config(cls, config):
+        config = dict(config)
+        block = keras.layers.deserialize(config.pop('block'))
+        return cls(block, **config)
+
+
+def _batch_norm_layers(model: keras.Model) -> list[layers.BatchNormalization]:
+    return [layer for layer in model.submodules if isinstance(layer, layers.BatchNormalization)]
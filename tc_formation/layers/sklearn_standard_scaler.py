@@ -8,8 +8,8 @@ class SklearnStandardScaler(tf.keras.layers.Layer):
         super().__init__()
 
         # Init non trainable weight.
-        self.means = tf.Variable(scaler.mean_, trainable=False)
-        self.stds = tf.Variable(np.sqrt(scaler.var_), trainable=False)
+        self.means = tf.Variable(scaler.mean_, trainable=False, dtype=tf.float32)
+        self.stds = tf.Variable(np.sqrt(scaler.var_), trainable=False, dtype=tf.float32)
 
     def call(self, inputs):
         return (inputs - self.means) / self.stds
@@ -20,8 +20,8 @@ class SklearnStandardScalerInverse(tf.keras.layers.Layer):
         super().__init__()
 
         # Init non trainable weight.
-        self.means = tf.Variable(scaler.mean_, trainable=False)
-        self.stds = tf.Variable(np.sqrt(scaler.var_), trainable=False)
+        self.means = tf.Variable(scaler.mean_, trainable=False, dtype=tf.float32)
+        self.stds = tf.Variable(np.sqrt(scaler.var_), trainable=False, dtype=tf.float32)
 
     def call(self, inputs):
         return inputs * self.stds + self.means
@@ -0,0 +1,262 @@
+"""
+Decision-threshold sweeps from one sorted pass over the predictions.
+
+Instead of re-thresholding the predictions (or calling `model.evaluate`) once per threshold,
+the scores are sorted once, and the numbers of true and false positives at every distinct score
+are the cumulative sums of the sorted labels.
+This gives the full PR and ROC curves, and the metrics at any threshold, of millions of scores in milliseconds:
+    >>> y_true, y_score = predict_scores(model, testing, from_logits=True)
+    >>> curve = threshold_curve(y_true, y_score)
+    >>> threshold, precision, recall, f1 = curve.best_f1()
+    >>> curve.at(0.5)
+
+As `filter_in_leadtime`, the breakdown by leadtime keeps all negatives and the positives of each leadtime,
+so false positives are shared and only true positives are summed per leadtime, over the same sorted scores:
+    >>> leadtime_breakdown(y_true, y_score, label_leadtimes(label))
+
+Predictions are positive if their score is above the threshold, as `tf.metrics.Precision` and `tf.metrics.Recall`.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+
+def _divide(numerator, denominator):
+    # Zero where the denominator is zero, as `tf.math.divide_no_nan`.
+    numerator, denominator = np.asarray(numerator, dtype=np.float64), np.asarray(denominator, dtype=np.float64)
+    return np.divide(numerator, denominator, out=np.zeros(np.broadcast(numerator, denominator).shape),
+                     where=denominator != 0)
+
+
+@dataclass
+class ThresholdCurve:
+    # Distinct scores in decreasing order, preceded by +inf (nothing predicted positive).
+    thresholds: np.ndarray
+    # Numbers of true and false positives of predictions with scores >= each threshold.
+    true_positives: np.ndarray
+    false_positives: np.ndarray
+    nb_positives: float
+    nb_negatives: float
+
+    @property
+    def precision(self) -> np.ndarray:
+        return _divide(self.true_positives, self.true_positives + self.false_positives)
+
+    @property
+    def recall(self) -> np.ndarray:
+        return _divide(self.true_positives, self.nb_positives)
+
+    @property
+    def false_positive_rate(self) -> np.ndarray:
+        return _divide(self.false_positives, self.nb_negatives)
+
+    @property
+    def f1(self) -> np.ndarray:
+        precision, recall = self.precision, self.recall
+        return _divide(2 * precision * recall, precision + recall)
+
+    def pr_auc(self) -> float:
+        """
+        Area under the PR curve, as the average precision (sklearn's `average_precision_score`).
+        """
+        return float(np.sum(np.diff(self.recall) * self.precision[1:]))
+
+    def roc_auc(self) -> float:
+        return float(np.trapz(self.recall, self.false_positive_rate))
+
+    def _index(self, threshold) -> np.ndarray:
+        # Index of the smallest threshold above the given ones,
+        # i.e. of the curve point of predictions with scores > threshold.
+        return np.searchsorted(-self.thresholds, -np.asarray(threshold), side='left') - 1
+
+    def at(self, threshold: float | np.ndarray) -> dict:
+        """
+        Precision, recall and F1 of predictions with scores above the given threshold(s).
+        """
+        index = self._index(threshold)
+        precision, recall = self.precision[index], self.recall[index]
+        return dict(
+            threshold=threshold,
+            precision=precision,
+            recall=recall,
+            f1=_divide(2 * precision * recall, precision + recall),
+            true_positives=self.true_positives[index],
+            false_positives=self.false_positives[index])
+
+    def _threshold_between(self, index: int) -> float:
+        # Threshold that predicts the scores >= `thresholds[index]` positive, halfway to the next score.
+        if index + 1 < len(self.thresholds):
+            return float((self.thresholds[index] + self.thresholds[index + 1]) / 2)
+
+        return float(np.nextafter(self.thresholds[index], -np.inf))
+
+    def best_f1(self) -> tuple[float, float, float, float]:
+        """
+        Threshold maximizing F1, and the precision, recall and F1 at this threshold.
+        """
+        index = int(np.argmax(self.f1))
+        return self._threshold_between(index), float(self.precision[index]), float(self.recall[index]), float(self.f1[index])
+
+    def threshold_for_recall(self, recall: float) -> float:
+        """
+        Highest threshold keeping at least the given recall.
+        """
+        index = min(int(np.searchsorted(self.recall, recall - 1e-12, side='left')), len(self.thresholds) - 1)
+        return self._threshold_between(index)
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            'Threshold': self.thresholds,
+            'Precision': self.precision,
+            'Recall': self.recall,
+            'F1': self.f1,
+            'False Positive Rate': self.false_positive_rate,
+        })
+
+
+def _sorted_scores(y_true, y_score, sample_weight=None):
+    y_true = np.asarray(y_true).ravel().astype(bool)
+    y_score = np.asarray(y_score, dtype=np.float64).ravel()
+    assert y_true.shape == y_score.shape, 'There must be one score per label.'
+
+    order = np.argsort(-y_score, kind='stable')
+    y_score = y_score[order]
+    weight = np.ones(len(y_score)) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64).ravel()[order]
+
+    # Last index of each distinct score.
+    distinct = np.r_[np.flatnonzero(np.diff(y_score)), len(y_score) - 1] if len(y_score) else np.zeros(0, dtype=int)
+    return order, y_true[order], y_score, weight, distinct
+
+
+def _cumulative(values: np.ndarray, distinct: np.ndarray) -> np.ndarray:
+    return np.r_[0., np.cumsum(values)[distinct]]
+
+
+def threshold_curve(y_true, y_score, sample_weight=None) -> ThresholdCurve:
+    """
+    Curve of the numbers of true and false positives at every distinct score.
+
+    Parameters
+    ==========
+    y_true:
+        Binary labels.
+    y_score:
+        Scores of the same shape, probabilities or logits.
+    sample_weight:
+        Weights of the samples, default to 1.
+    """
+    _, y_true, y_score, weight, distinct = _sorted_scores(y_true, y_score, sample_weight)
+    positives, negatives = y_true * weight, ~y_true * weight
+    return ThresholdCurve(
+        thresholds=np.r_[np.inf, y_score[distinct]],
+        true_positives=_cumulative(positives, distinct),
+        false_positives=_cumulative(negatives, distinct),
+        nb_positives=float(positives.sum()),
+        nb_negatives=float(negatives.sum()))
+
+
+def leadtime_curves(y_true, y_score, leadtimes, sample_weight=None) -> dict:
+    """
+    Curve of the positives of each leadtime and all negatives, from one sort of the scores.
+
+    Parameters
+    ==========
+    leadtimes:
+        Leadtime (in hours) of each sample, ignored for negatives.
+
+    Returns
+    =======
+    Curve of each leadtime, in increasing order of leadtimes.
+    """
+    order, y_true, y_score, weight, distinct = _sorted_scores(y_true, y_score, sample_weight)
+    leadtimes = np.asarray(leadtimes, dtype=np.float64).ravel()[order]
+
+    thresholds = np.r_[np.inf, y_score[distinct]]
+    negatives = ~y_true * weight
+    false_positives = _cumulative(negatives, distinct)
+
+    curves = {}
+    for leadtime in np.unique(leadtimes[y_true & np.isfinite(leadtimes)]):
+        positives = (y_true & (leadtimes == leadtime)) * weight
+        curves[leadtime.item()] = ThresholdCurve(
+            thresholds=thresholds,
+            true_positives=_cumulative(positives, distinct),
+            false_positives=false_positives,
+            nb_positives=float(positives.sum()),
+            nb_negatives=float(negatives.sum()))
+
+    return curves
+
+
+def label_leadtimes(label: pd.DataFrame) -> np.ndarray:
+    """
+    Leadtime (in hours) of each observation of a label dataframe, NaN for negatives.
+    For observations grouped by date, this is the leadtime of the first TC to form.
+    """
+    dates = pd.to_datetime(label['Date'])
+
+    def first_observed(value):
+        # Dates are strings in CSV labels, and timestamps in Parquet labels.
+        if isinstance(value, (list, tuple, np.ndarray)):
+            values = pd.to_datetime([v for v in value if not isinstance(v, str) or v]).dropna()
+            return values.min() if len(values) else pd.NaT
+
+        return pd.to_datetime(value if not isinstance(value, str) or value else None)
+
+    first_observed_dates = pd.to_datetime(label['First Observed'].map(first_observed))
+    leadtimes = (first_observed_dates - dates).dt.total_seconds().to_numpy() / 3600
+    return np.where(label['TC'].to_numpy(dtype=bool), leadtimes, np.nan)
+
+
+def _curve_row(name, curve: ThresholdCurve, threshold: float) -> dict:
+    metrics = curve.at(threshold)
+    best_threshold, _, _, best_f1 = curve.best_f1()
+    return {
+        'Leadtime': name,
+        'Positives': curve.nb_positives,
+        'Negatives': curve.nb_negatives,
+        'Precision': float(metrics['precision']),
+        'Recall': float(metrics['recall']),
+        'F1': float(metrics['f1']),
+        'Best F1': best_f1,
+        'Best F1 Threshold': best_threshold,
+        'PR AUC': curve.pr_auc(),
+        'ROC AUC': curve.roc_auc(),
+    }
+
+
+def leadtime_breakdown(y_true, y_score, leadtimes, threshold: float | None = None, sample_weight=None) -> pd.DataFrame:
+    """
+    Metrics of all samples and of each leadtime, at the given threshold (default to the best-F1 threshold of all samples),
+    with the best F1 and the PR and ROC AUCs of each leadtime.
+    """
+    curve = threshold_curve(y_true, y_score, sample_weight)
+    threshold = curve.best_f1()[0] if threshold is None else threshold
+
+    rows = [_curve_row('All', curve, threshold)]
+    rows.extend(_curve_row(leadtime, leadtime_curve, threshold)
+                for leadtime, leadtime_curve in leadtime_curves(y_true, y_score, leadtimes, sample_weight).items())
+    return pd.DataFrame(rows)
+
+
+def predict_scores(model, dataset, from_logits: bool = False) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Labels and scores of a batched dataset of (X, y), from one pass of the model.
+    Scores are probabilities, after a sigmoid if the model outputs logits.
+    """
+    import tensorflow as tf
+
+    @tf.function(reduce_retracing=True)
+    def predict(X):
+        y_pred = model(X, training=False)
+        return tf.nn.sigmoid(y_pred) if from_logits else y_pred
+
+    y_true, y_score = [], []
+    for X, y in dataset:
+        y_true.append(np.asarray(y))
+        y_score.append(predict(X).numpy())
+
+    return np.concatenate(y_true), np.concatenate(y_score)
@@ -0,0 +1,240 @@
+"""
+Permutation and group-ablation importance of input channels for a single trained model.
+
+Instead of retraining a model without each variable, the test set is predicted
+with the channels of each group (e.g. a variable with all its levels, or all variables at a level)
+either permuted between samples ("permute") or replaced by a baseline value ("zero"),
+and the importance of a group is how much the score drops.
+
+The test set is decoded only once, either in memory or as memory-mapped arrays
+(e.g. `CachedDataset.arrays()` of `hyperparameters_tuning.search`).
+For each batch, the perturbed inputs of all groups are built in graph
+and predicted in one forward pass, and scores are accumulated in graph as histograms of predictions,
+so memory doesn't depend on the size of the test set (even for grid outputs of Unet).
+    >>> X, y = test.arrays()
+    >>> permutation_importance(model, X, y, channel_groups(subset, by='variable'))
+"""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+import tensorflow.keras as keras
+
+from ..models.fan_out import subset_channels
+
+
+METHODS = ('permute', 'zero')
+SCORES = ('average_precision', 'roc_auc', 'log_loss')
+
+
+def channel_groups(subset: dict, by: str = 'variable') -> dict[str, list[int]]:
+    """
+    Group channels of the tensor given by `extract_variables_from_dataset` with the given subset.
+
+    Parameters
+    ==========
+    subset: dict
+        Subset of variables and levels.
+    by: str
+        "variable" (all levels of a variable), "level" (all variables at a level,
+        variables without levels are grouped as "surface"), or "channel".
+    """
+    assert by in ('variable', 'level', 'channel'), f'Invalid grouping: {by}'
+
+    groups = {}
+    for i, (variable, level) in enumerate(subset_channels(subset)):
+        if by == 'variable':
+            name = variable
+        elif by == 'level':
+            name = 'surface' if level is None else str(level)
+        else:
+            name = variable if level is None else f'{variable}_{level}'
+
+        groups.setdefault(name, []).append(i)
+
+    return groups
+
+
+def _rows(X: np.ndarray, start: int, stop: int) -> np.ndarray:
+    # Rows [start, stop) modulo the number of rows, read as at most two contiguous slices.
+    nb_rows = len(X)
+    start, stop = start % nb_rows, (stop - 1) % nb_rows + 1
+    if start < stop:
+        return np.asarray(X[start:stop], dtype=np.float32)
+
+    return np.concatenate([np.asarray(X[start:], dtype=np.float32), np.asarray(X[:stop], dtype=np.float32)])
+
+
+def _scores_from_histograms(histograms: np.ndarray, log_losses: np.ndarray, counts: np.ndarray) -> dict[str, np.ndarray]:
+    # Histograms of shape (groups, 2, bins) of predictions of negatives and positives.
+    # Thresholds go from the highest bin to the lowest one.
+    tp = np.cumsum(histograms[:, 1, ::-1], axis=-1)
+    fp = np.cumsum(histograms[:, 0, ::-1], axis=-1)
+    nb_positives = np.maximum(tp[:, -1:], 1)
+    nb_negatives = np.maximum(fp[:, -1:], 1)
+
+    recall = tp / nb_positives
+    precision = tp / np.maximum(tp + fp, 1)
+    previous_recall = np.concatenate([np.zeros_like(recall[:, :1]), recall[:, :-1]], axis=-1)
+    average_precision = np.sum((recall - previous_recall) * precision, axis=-1)
+
+    fpr = np.concatenate([np.zeros_like(fp[:, :1]), fp / nb_negatives], axis=-1)
+    tpr = np.concatenate([np.zeros_like(tp[:, :1]), recall], axis=-1)
+    roc_auc = np.trapz(tpr, fpr, axis=-1)
+
+    return dict(
+        average_precision=average_precision,
+        roc_auc=roc_auc,
+        log_loss=log_losses / np.maximum(counts, 1),
+    )
+
+
+class _GroupPerturbation:
+    def __init__(self, model, masks: np.ndarray, from_logits: bool, nb_bins: int) -> None:
+        self._model = model
+        self._masks = tf.constant(masks, dtype=tf.float32)
+        self._from_logits = from_logits
+        self._nb_bins = nb_bins
+
+    @tf.function(reduce_retracing=True)
+    def __call__(self, X, replacement, y):
+        nb_groups = tf.shape(self._masks)[0]
+        batch_size = tf.shape(X)[0]
+
+        # Inputs of shape (groups, batch, ...), channels of each group are taken from the replacement.
+        rank = len(X.shape)
+        masks = tf.reshape(self._masks, tf.concat([[nb_groups], tf.ones([rank - 1], tf.int32), [-1]], axis=0))
+        inputs = X[None] * (1 - masks) + replacement[None] * masks
+        inputs = tf.reshape(inputs, tf.concat([[nb_groups * batch_size], tf.shape(X)[1:]], axis=0))
+
+        pred = self._model(inputs, training=False)
+        pred = tf.reshape(pred[..., -1], (nb_groups, batch_size, -1))
+        pred = tf.sigmoid(pred) if self._from_logits else pred
+
+        labels = tf.reshape(tf.cast(y[..., -1] > 0.5, tf.int32), (1, batch_size, -1))
+        labels = tf.broadcast_to(labels, tf.shape(pred))
+
+        # Histograms of predictions of negatives and positives for each group.
+        bins = tf.clip_by_value(tf.cast(pred * self._nb_bins, tf.int32), 0, self._nb_bins - 1)
+        groups = tf.range(nb_groups)[:, None, None]
+        indices = (groups * 2 + labels) * self._nb_bins + bins
+        histograms = tf.math.bincount(
+            tf.reshape(indices, [-1]),
+            minlength=nb_groups * 2 * self._nb_bins,
+            maxlength=nb_groups * 2 * self._nb_bins,
+            dtype=tf.float64)
+
+        eps = 1e-7
+        pred = tf.clip_by_value(pred, eps, 1 - eps)
+        labels = tf.cast(labels, pred.dtype)
+        log_losses = -tf.reduce_sum(labels * tf.math.log(pred) + (1 - labels) * tf.math.log(1 - pred), axis=[1, 2])
+
+        return tf.reshape(histograms, (nb_groups, 2, self._nb_bins)), tf.cast(log_losses, tf.float64)
+
+
+def permutation_importance(model: keras.Model,
+                           X: np.ndarray,
+                           y: np.ndarray,
+                           groups: dict[str, list[int]],
+                           methods: tuple[str, ...] = ('permute', 'zero'),
+                           score: str = 'average_precision',
+                           nb_repeats: int = 3,
+                           baseline: np.ndarray | float = 0.0,
+                           from_logits: bool = False,
+                           batch_size: int = 64,
+                           groups_per_call: int | None = None,
+                           nb_bins: int = 1000,
+                           seed: int = 0) -> pd.DataFrame:
+    """
+    Compute importance of each group of channels with forward passes only.
+
+    Parameters
+    ==========
+    model: keras.Model
+        Trained model which outputs the probability (or logits) of the positive class in the last axis,
+        e.g. classifiers (batch, 1) or Unet (batch, lat, lon, 1).
+    X, y: np.ndarray
+        Test inputs and labels, in memory or memory-mapped.
+    groups: dict[str, list[int]]
+        Channels of each group, e.g. given by `channel_groups`.
+    methods: tuple[str, ...]
+        "permute": channels of the group are taken from other samples,
+        "zero": channels of the group are replaced by `baseline`.
+    score: str
+        Score used to rank importances, one of `SCORES`, all of them are reported.
+    nb_repeats: int
+        Number of permutations, each of them is a different cyclic shift of the samples.
+    baseline: np.ndarray | float
+        Replacement value (for each channel) of "zero" ablation,
+        0 is the mean of normalized inputs.
+    groups_per_call: int | None
+        Number of groups predicted in one forward pass, default to all groups.
+
+    Returns
+    =======
+    A dataframe with one row per (method, group) and columns:
+        * `importance`: mean drop of the score (increase for log loss) over repeats,
+        * `std`: standard deviation over repeats,
+        * `<score>`: perturbed scores, and `rank` of the group for each method.
+    """
+    assert score in SCORES, f'Invalid score: {score}'
+    assert all(m in METHODS for m in methods), f'Methods must be in {METHODS}'
+
+    nb_samples, nb_channels = len(X), X.shape[-1]
+    names = list(groups.keys())
+    # The first "group" has no channels, which gives the unperturbed scores.
+    masks = np.zeros((len(names) + 1, nb_channels), dtype=np.float32)
+    for i, name in enumerate(names):
+        masks[i + 1, groups[name]] = 1
+
+    groups_per_call = groups_per_call or len(masks)
+    perturbations = [_GroupPerturbation(model, masks[i:i + groups_per_call], from_logits, nb_bins)
+                     for i in range(0, len(masks), groups_per_call)]
+
+    rng = np.random.default_rng(seed)
+    runs = []
+    for method in methods:
+        if method == 'permute':
+            # Cyclic shifts are permutations without fixed points, and read contiguous rows.
+            shifts = rng.integers(1, nb_samples, size=nb_repeats) if nb_samples > 1 else [0]
+            runs.extend(('permute', int(shift)) for shift in shifts)
+        else:
+            runs.append(('zero', None))
+
+    results = []
+    for method, shift in runs:
+        histograms = np.zeros((len(masks), 2, nb_bins))
+        log_losses = np.zeros(len(masks))
+        for start in range(0, nb_samples, batch_size):
+            stop = min(start + batch_size, nb_samples)
+            X_batch = np.asarray(X[start:stop], dtype=np.float32)
+            y_batch = np.asarray(y[start:stop], dtype=np.float32)
+            replacement = (_rows(X, start + shift, stop + shift)
+                           if method == 'permute'
+                           else np.broadcast_to(np.asarray(baseline, dtype=np.float32), X_batch.shape))
+
+            for i, perturbation in enumerate(perturbations):
+                h, l = perturbation(X_batch, replacement, y_batch)
+                histograms[i * groups_per_call:(i + 1) * groups_per_call] += h.numpy()
+                log_losses[i * groups_per_call:(i + 1) * groups_per_call] += l.numpy()
+
+        counts = histograms.sum(axis=(1, 2))
+        scores = _scores_from_histograms(histograms, log_losses, counts)
+        for name, value in scores.items():
+            sign = -1 if name == 'log_loss' else 1
+            for i, group in enumerate(names):
+                results.append(dict(
+                    method=method, group=group, score=name,
+                    value=value[i + 1], importance=sign * (value[0] - value[i + 1])))
+
+    results = pd.DataFrame(results)
+    importance = (results[results['score'] == score]
+                  .groupby(['method', 'group'])['importance']
+                  .agg(['mean', 'std'])
+                  .rename(columns={'mean': 'importance'}))
+    perturbed_scores = results.pivot_table(index=['method', 'group'], columns='score', values='value', aggfunc='mean')
+    importance = importance.join(perturbed_scores).reset_index()
+
+    importance['rank'] = importance.groupby('method')['importance'].rank(ascending=False, method='min').astype(int)
+    return importance.sort_values(['method', 'rank']).reset_index(drop=True)
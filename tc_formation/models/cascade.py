@@ -0,0 +1,196 @@
+"""
+Cascade inference: a cheap first stage rejects clear negative patches,
+and only the remaining patches are predicted by the expensive model.
+
+The first stage is either:
+    * `ChannelThresholdFilter`: thresholds on statistics of a few channels of the patch
+      (e.g. maximum absolute vorticity and SST),
+    * `ModelFilter`: a tiny model (e.g. a distilled student, see `distillation.py`).
+Its thresholds are calibrated on validation data to keep a target recall of positive patches.
+
+Since `CascadePredictor` has the same `predict` as keras models,
+it can be used with `SlidingWindowClassifier` to scan whole domains:
+    >>> first_stage = ChannelThresholdFilter(channels=[absv_idx, sst_idx])
+    >>> first_stage.calibrate(val_ds, target_recall=0.98)
+    >>> cascade = CascadePredictor(first_stage, resnet)
+    >>> SlidingWindowClassifier(cascade, patch_size=31, stride=5).predict(domain)
+"""
+from __future__ import annotations
+
+import abc
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+import tensorflow.keras as keras
+import time
+
+
+STATISTICS = dict(
+    max=tf.reduce_max,
+    min=tf.reduce_min,
+    mean=tf.reduce_mean,
+)
+
+
+def threshold_for_recall(positive_scores: np.ndarray, recall: float) -> float:
+    """
+    Largest threshold such that at least `recall` of positive scores are >= threshold.
+    """
+    positive_scores = np.sort(positive_scores)
+    idx = int(np.floor((1 - recall) * len(positive_scores)))
+    return float(positive_scores[min(idx, len(positive_scores) - 1)])
+
+
+class CascadeFilter(abc.ABC):
+    def __init__(self) -> None:
+        self.thresholds = None
+
+    @abc.abstractmethod
+    def scores(self, X: tf.Tensor) -> tf.Tensor:
+        """
+        Scores of shape (batch, k), higher score means more likely to be positive.
+        """
+
+    def calibrate(self, dataset: tf.data.Dataset, target_recall: float) -> float:
+        """
+        Calibrate the thresholds on a batched dataset of (X, y),
+        so that the recall of positive patches passing the filter is at least `target_recall`.
+        When there are k scores, each threshold keeps a recall of 1 - (1 - target_recall) / k,
+        so the joint recall is at least `target_recall`.
+
+        Returns
+        =======
+        The recall of the filter on the given dataset.
+        """
+        scores, labels = [], []
+        for X, y, *_ in dataset:
+            scores.append(self.scores(tf.cast(X, tf.float32)).numpy())
+            labels.append(np.reshape(y.numpy(), (len(y), -1))[:, 0] > 0.5)
+
+        scores = np.concatenate(scores)
+        labels = np.concatenate(labels)
+        assert labels.any(), 'Calibration requires positive samples.'
+
+        positive_scores = scores[labels]
+        per_score_recall = 1 - (1 - target_recall) / scores.shape[-1]
+        self.thresholds = np.array(
+            [threshold_for_recall(positive_scores[:, i], per_score_recall)
+             for i in range(scores.shape[-1])],
+            dtype=np.float32)
+
+        return float(np.all(positive_scores >= self.thresholds, axis=-1).mean())
+
+    def passes(self, X: tf.Tensor) -> tf.Tensor:
+        assert self.thresholds is not None, 'The filter must be calibrated first.'
+        return tf.reduce_all(self.scores(X) >= self.thresholds, axis=-1)
+
+
+class ChannelThresholdFilter(CascadeFilter):
+    def __init__(self, channels: list[int], statistics: list[str] = None, directions: list[int] = None) -> None:
+        """
+        Parameters
+        ==========
+        channels: list[int]
+            Indices of the channels to threshold.
+        statistics: list[str]
+            Statistic over the patch of each channel, one of `STATISTICS`. Default to max.
+        directions: list[int]
+            1 if high values of the statistic indicate positive patches, -1 otherwise. Default to 1.
+        """
+        super().__init__()
+        self._channels = channels
+        self._statistics = statistics or ['max'] * len(channels)
+        self._directions = np.asarray(directions or [1] * len(channels), dtype=np.float32)
+        assert len(self._statistics) == len(channels) == len(self._directions)
+
+    def scores(self, X: tf.Tensor) -> tf.Tensor:
+        scores = [STATISTICS[stat](X[..., c], axis=(1, 2))
+                  for c, stat in zip(self._channels, self._statistics)]
+        return tf.stack(scores, axis=-1) * self._directions
+
+
+class ModelFilter(CascadeFilter):
+    def __init__(self, model: keras.Model) -> None:
+        """
+        `model` outputs either probability or logits of the positive class,
+        since sigmoid is monotonic, logits can be thresholded directly.
+        """
+        super().__init__()
+        self._model = model
+
+    def scores(self, X: tf.Tensor) -> tf.Tensor:
+        return tf.reshape(self._model(X, training=False), (-1, 1))
+
+
+class CascadePredictor:
+    def __init__(self, first_stage: CascadeFilter, model: keras.Model, rejected_value: float = 0.0) -> None:
+        """
+        Parameters
+        ==========
+        first_stage: CascadeFilter
+            Calibrated first stage.
+        model: keras.Model
+            Expensive model.
+        rejected_value: float
+            Prediction of the rejected patches,
+            default to 0.0 which is suitable for models which output probabilities.
+        """
+        self._first_stage = first_stage
+        self._model = model
+        self._rejected_value = rejected_value
+
+        self.input_shape = model.input_shape
+        self.pass_rate = None
+
+    def predict(self, X: np.ndarray, batch_size: int = 256, **kwargs) -> np.ndarray:
+        X = tf.convert_to_tensor(X, dtype=tf.float32)
+        passes = tf.concat([self._first_stage.passes(X[i:i + batch_size])
+                            for i in range(0, len(X), batch_size)], axis=0)
+        self.pass_rate = float(tf.reduce_mean(tf.cast(passes, tf.float32)))
+
+        pred = np.full((len(X),) + tuple(self._model.output_shape[1:]), self._rejected_value, dtype=np.float32)
+        survivors = tf.boolean_mask(X, passes)
+        if len(survivors) > 0:
+            pred[passes.numpy()] = np.concatenate([self._model.predict_on_batch(survivors[i:i + batch_size])
+                                                   for i in range(0, len(survivors), batch_size)])
+
+        return pred
+
+    def predict_on_batch(self, X: np.ndarray) -> np.ndarray:
+        return self.predict(X, batch_size=len(X))
+
+    def evaluate(self, dataset: tf.data.Dataset, threshold: float = 0.5) -> pd.DataFrame:
+        """
+        Compare the cascade with the expensive model alone on a batched dataset of (X, y),
+        in terms of recall, precision, F1 score, and throughput.
+        """
+        labels, preds, times, pass_rates = [], dict(model=[], cascade=[]), dict(model=0.0, cascade=0.0), []
+        for X, y, *_ in dataset:
+            X = tf.cast(X, tf.float32)
+            labels.append(np.reshape(y.numpy(), (len(y), -1))[:, 0] > 0.5)
+
+            for name, predict in [('model', self._model.predict_on_batch), ('cascade', self.predict_on_batch)]:
+                start = time.perf_counter()
+                pred = predict(X)
+                times[name] += time.perf_counter() - start
+                preds[name].append(np.reshape(pred, (len(pred), -1))[:, -1] >= threshold)
+
+            pass_rates.append(self.pass_rate * len(X))
+
+        labels = np.concatenate(labels)
+        rows = []
+        for name, pred in preds.items():
+            pred = np.concatenate(pred)
+            tp = np.sum(pred & labels)
+            precision = tp / max(pred.sum(), 1)
+            recall = tp / max(labels.sum(), 1)
+            rows.append(dict(
+                predictor=name,
+                recall=recall,
+                precision=precision,
+                f1_score=2 * precision * recall / max(precision + recall, 1e-7),
+                pass_rate=1.0 if name == 'model' else np.sum(pass_rates) / len(labels),
+                samples_per_second=len(labels) / times[name],
+            ))
+
+        return pd.DataFrame(rows).set_index('predictor')
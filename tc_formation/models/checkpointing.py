@@ -0,0 +1,106 @@
+"""
+Gradient checkpointing of Unet blocks, to train with larger batches or longer time windows.
+
+By default, every activation of the encoder and decoder is kept for the backward pass.
+With checkpointing, only the outputs of the checkpointed blocks are kept,
+and the activations inside a block are recomputed (one block at a time) during the backward pass,
+trading about one more forward pass for memory.
+
+Blocks are given by name (e.g. "encoder_blk_0", "decoder_blk_2"), or all of them with `True`:
+    >>> model = Unet3D(input_shape=(4, 41, 161, 130), checkpoint_blocks=['encoder_blk_0', 'encoder_blk_1'])
+    >>> peak_activation_bytes(model, batch_size=4)
+
+`peak_activation_bytes` estimates the peak memory of activations from the layers' output shapes,
+and `measure_peak_bytes` measures the peak memory of a training step.
+"""
+from __future__ import annotations
+
+from typing import Callable, Sequence
+
+import numpy as np
+import tensorflow as tf
+import tensorflow.keras as keras
+import tensorflow.keras.layers as layers
+
+from tc_formation.layers.recompute_grad import RecomputeGrad
+
+
+def apply_block(block_fn: Callable,
+                inputs: list,
+                name: str,
+                checkpoint_blocks: Sequence[str] | bool | None = None,
+                **kwargs):
+    """
+    Apply `block_fn(*inputs, name=name, **kwargs)`,
+    as a checkpointed sub-model if `name` is in `checkpoint_blocks` (or `checkpoint_blocks` is True).
+    """
+    if not (checkpoint_blocks is True or (checkpoint_blocks and name in checkpoint_blocks)):
+        return block_fn(*inputs, name=name, **kwargs)
+
+    block_inputs = [layers.Input(x.shape[1:], name=f'{name}_input_{i}') for i, x in enumerate(inputs)]
+    block = keras.Model(block_inputs, block_fn(*block_inputs, name=name, **kwargs), name=name)
+    return RecomputeGrad(block, name=f'{name}_recompute')(inputs)
+
+
+def check_checkpoint_blocks(checkpoint_blocks: Sequence[str] | bool | None, block_names: list[str]) -> None:
+    if checkpoint_blocks is None or isinstance(checkpoint_blocks, bool):
+        return
+
+    unknown = set(checkpoint_blocks) - set(block_names)
+    assert not unknown, f'Unknown blocks to checkpoint: {sorted(unknown)}, blocks are {block_names}.'
+
+
+def _values(tensors) -> int:
+    return int(sum(np.prod(t.shape[1:]) for t in tf.nest.flatten(tensors)))
+
+
+def _activation_values(model: keras.Model) -> tuple[int, int]:
+    # Values kept for the backward pass, and the largest number of values recomputed at once.
+    kept, recomputed = 0, 0
+    for layer in model.layers:
+        if isinstance(layer, layers.InputLayer):
+            continue
+
+        if isinstance(layer, RecomputeGrad):
+            kept += _values(layer.output)
+            recomputed = max(recomputed, sum(_activation_values(layer.block)))
+            continue
+
+        inner, factor = layer, 1
+        if isinstance(layer, layers.TimeDistributed):
+            # The wrapped layer runs on all timesteps at once.
+            inner, factor = layer.layer, layer.input_shape[1]
+
+        if isinstance(inner, keras.Model):
+            inner_kept, inner_recomputed = _activation_values(inner)
+            kept += factor * inner_kept
+            recomputed = max(recomputed, factor * inner_recomputed)
+        else:
+            kept += _values(layer.output)
+
+    return kept, recomputed
+
+
+def peak_activation_bytes(model: keras.Model, batch_size: int = 1, bytes_per_value: int = 4) -> int:
+    """
+    Estimate the peak memory (in bytes) of the activations of a training step,
+    i.e. the activations kept for the backward pass
+    plus the activations of the largest checkpointed block while it is recomputed.
+    Weights, gradients and optimizer states are not included.
+    """
+    input_shapes = model.input_shape if isinstance(model.input_shape, list) else [model.input_shape]
+    assert all(None not in shape[1:] for shape in input_shapes), 'Model input shape must be fixed.'
+    kept, recomputed = _activation_values(model)
+    return (kept + recomputed) * batch_size * bytes_per_value
+
+
+def measure_peak_bytes(model: keras.Model, X, y, device: str = 'CPU:0') -> int:
+    """
+    Measure the peak memory (in bytes) of one training step of a compiled model on the given batch.
+    On CPU, TensorFlow only tracks memory with `TF_CPU_ALLOCATOR_USE_BFC=true` set before it is initialized.
+    """
+    # The first step traces the train function and creates the optimizer states.
+    model.train_on_batch(X, y)
+    tf.config.experimental.reset_memory_stats(device)
+    model.train_on_batch(X, y)
+    return tf.config.experimental.get_memory_info(device)['peak']
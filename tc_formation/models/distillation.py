@@ -0,0 +1,242 @@
+"""
+Knowledge distillation of a trained (slow) teacher into small student networks.
+
+The teacher's predictions over the training set are computed only once and cached as logits,
+then students are trained on both the hard labels and the teacher's soft probabilities:
+    loss = (1 - alpha) * BCE(y, student) + alpha * T^2 * BCE(sigmoid(teacher / T), sigmoid(student / T))
+where T is the temperature.
+
+The training samples are cached together with the teacher's predictions, from the same pass over the dataset,
+so the training dataset given to `DistillationTrainer` can be decoded in any order,
+and is decoded only once.
+"""
+from __future__ import annotations
+
+import matplotlib.pyplot as plt
+import numpy as np
+import os
+import pandas as pd
+import tensorflow as tf
+import tensorflow.keras as keras
+
+from . import quantization
+from .resnet_configurable import ConfigurableResNet
+
+
+def cache_teacher_logits(teacher: keras.Model,
+                         dataset: tf.data.Dataset,
+                         cache_path: str | None = None,
+                         from_logits: bool = True,
+                         nb_samples: int | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Predict the given batched dataset of (X, y) with the teacher,
+    and return the samples X, their labels y, and the teacher's logits of shape (N, 1),
+    all from the same pass over the dataset, so each sample stays with its teacher's logits
+    even if the dataset's order is not deterministic.
+    If `cache_path` (.npz) is given, they are loaded from it if it exists,
+    otherwise they are saved to it.
+    If `nb_samples` is given, the number of cached samples is checked against it.
+    """
+    if cache_path is not None and os.path.isfile(cache_path):
+        with np.load(cache_path) as cache:
+            X, y, logits = cache['X'], cache['y'], cache['logits']
+    else:
+        X, y, logits = [], [], []
+        for X_batch, y_batch, *_ in dataset:
+            X.append(np.asarray(X_batch))
+            y.append(np.asarray(y_batch))
+            logits.append(np.asarray(teacher.predict_on_batch(X_batch)))
+
+        X, y, logits = np.concatenate(X), np.concatenate(y), np.concatenate(logits)
+        logits = np.reshape(logits, (len(logits), -1)).astype(np.float32)
+
+        if not from_logits:
+            eps = 1e-7
+            probs = np.clip(logits, eps, 1 - eps)
+            logits = np.log(probs / (1 - probs))
+
+        if cache_path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+            tmp_path = f'{cache_path}.{os.getpid()}.tmp.npz'
+            np.savez(tmp_path, X=X, y=y, logits=logits)
+            os.replace(tmp_path, cache_path)
+
+    assert len(X) == len(y) == len(logits), \
+        f'Cached {len(X)} samples, {len(y)} labels and {len(logits)} teacher logits.'
+    assert nb_samples is None or len(X) == nb_samples, \
+        f'Cached {len(X)} samples, but the training dataset has {nb_samples} samples.'
+    return X, y, logits
+
+
+class DistillationLoss(keras.losses.Loss):
+    """
+    Distillation loss for binary classification students which output logits.
+    `y_true` is the concatenation of the hard labels and the teacher's logits in the last axis.
+    """
+    def __init__(self, alpha: float = 0.5, temperature: float = 2.0, name='distillation_loss', **kwargs):
+        super().__init__(name=name, **kwargs)
+        self.alpha = alpha
+        self.temperature = temperature
+
+    def call(self, y_true, y_pred):
+        y_true = tf.cast(y_true, y_pred.dtype)
+        hard_labels, teacher_logits = tf.split(y_true, 2, axis=-1)
+
+        hard_loss = tf.nn.sigmoid_cross_entropy_with_logits(labels=hard_labels, logits=y_pred)
+        soft_loss = tf.nn.sigmoid_cross_entropy_with_logits(
+            labels=tf.sigmoid(teacher_logits / self.temperature),
+            logits=y_pred / self.temperature)
+
+        # Soft loss's gradients are scaled by 1 / T^2, so we scale it back.
+        loss = ((1 - self.alpha) * hard_loss
+                + self.alpha * self.temperature**2 * soft_loss)
+        return tf.reduce_mean(loss, axis=-1)
+
+    def get_config(self):
+        config = super().get_config()
+        config.update(alpha=self.alpha, temperature=self.temperature)
+        return config
+
+
+class HardLabelMetricWrapper(keras.metrics.Metric):
+    """
+    Evaluate a metric only on the hard labels of distillation targets.
+    """
+    def __init__(self, metric: keras.metrics.Metric, **kwargs):
+        super().__init__(name=metric.name, **kwargs)
+        self._metric = metric
+
+    def update_state(self, y_true, y_pred, sample_weight=None):
+        hard_labels, _ = tf.split(y_true, 2, axis=-1)
+        return self._metric.update_state(hard_labels, y_pred, sample_weight)
+
+    def result(self):
+        return self._metric.result()
+
+    def reset_state(self):
+        self._metric.reset_state()
+
+
+class DistillationTrainer:
+    def __init__(self,
+                 teacher: keras.Model,
+                 train_dataset: tf.data.Dataset,
+                 cache_path: str | None = None,
+                 teacher_from_logits: bool = True,
+                 alpha: float = 0.5,
+                 temperature: float = 2.0,
+                 nb_samples: int | None = None) -> None:
+        """
+        Parameters
+        ==========
+        teacher: keras.Model
+            Trained teacher, used only once to predict the training dataset.
+        train_dataset: tf.data.Dataset
+            Batched training dataset of (X, y).
+        cache_path: str
+            Path to .npz file caching the training samples and the teacher's logits.
+        teacher_from_logits: bool
+            Whether the teacher outputs logits or probabilities.
+        alpha: float
+            Weight of the soft loss.
+        temperature: float
+            Temperature to soften teacher's and students' probabilities.
+        nb_samples: int
+            Number of training samples, checked against the cache if given.
+        """
+        self._X, self._y, self._teacher_logits = cache_teacher_logits(
+            teacher, train_dataset, cache_path, teacher_from_logits, nb_samples)
+        self.loss = DistillationLoss(alpha, temperature)
+
+    def distillation_dataset(self, batch_size: int = 64, shuffle: bool = True) -> tf.data.Dataset:
+        """
+        Training dataset of (X, [y, teacher_logits]).
+        """
+        y = np.reshape(self._y, (len(self._y), -1)).astype(np.float32)
+        dataset = tf.data.Dataset.from_tensor_slices(
+            (self._X, np.concatenate([y, self._teacher_logits], axis=-1)))
+        if shuffle:
+            dataset = dataset.shuffle(len(self._teacher_logits))
+
+        return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+    def fit(self,
+            student: keras.Model,
+            optimizer='adam',
+            metrics: list[keras.metrics.Metric] = None,
+            batch_size: int = 64,
+            **kwargs):
+        """
+        Train the student, which must output logits.
+        `kwargs` are passed to `keras.Model.fit`.
+        """
+        metrics = metrics or [keras.metrics.BinaryAccuracy(threshold=0.0)]
+        student.compile(
+            optimizer=optimizer,
+            loss=self.loss,
+            metrics=[HardLabelMetricWrapper(m) for m in metrics])
+
+        return student.fit(self.distillation_dataset(batch_size), **kwargs)
+
+    def fit_students(self,
+                     input_shape: tuple[int, int, int],
+                     configs: dict[str, dict],
+                     **kwargs) -> dict[str, keras.Model]:
+        """
+        Train a `ConfigurableResNet` student for each of the given configurations,
+        e.g. `dict(tiny=dict(starting_channels=8, blocks=(1, 1)))`.
+        `kwargs` are passed to `fit`.
+        """
+        students = {}
+        for name, config in configs.items():
+            student = ConfigurableResNet(
+                input_shape=input_shape,
+                classes=1,
+                classifier_activation=None,
+                model_name=name,
+                **config)
+            self.fit(student, **kwargs)
+            students[name] = student
+
+        return students
+
+
+def trade_off_curve(models: dict[str, keras.Model],
+                    test_dataset: tf.data.Dataset,
+                    from_logits: bool = True,
+                    threshold: float = 0.5) -> pd.DataFrame:
+    """
+    Compare quality (F1 score, accuracy) and speed (latency on one batch) of the given models,
+    (e.g. the teacher and the students) on the test dataset.
+    The result is sorted by latency, and `pareto` marks models
+    which are not dominated by any faster model.
+    """
+    X, *_ = next(iter(test_dataset))
+    X = X.numpy()
+
+    rows = []
+    for name, model in models.items():
+        rows.append(dict(
+            model=name,
+            params=model.count_params(),
+            **quantization.evaluate(model, test_dataset, threshold, from_logits),
+            latency=quantization.measure_latency(model, X)))
+
+    curve = pd.DataFrame(rows).sort_values('latency').set_index('model')
+    curve['samples_per_second'] = len(X) / curve['latency']
+    curve['pareto'] = curve['f1_score'] > curve['f1_score'].cummax().shift(fill_value=-np.inf)
+    return curve
+
+
+def plot_trade_off_curve(curve: pd.DataFrame, ax=None):
+    if ax is None:
+        _, ax = plt.subplots()
+
+    ax.plot(curve['samples_per_second'], curve['f1_score'], marker='o')
+    for name, row in curve.iterrows():
+        ax.annotate(name, (row['samples_per_second'], row['f1_score']))
+
+    ax.set_xscale('log')
+    ax.set_xlabel('Samples per second')
+    ax.set_ylabel('F1 score')
+    return ax
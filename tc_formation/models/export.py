@@ -0,0 +1,145 @@
+"""
+Export trained models as SavedModels for inference, optionally XLA-compiled.
+
+The exported SavedModel contains a single function with a fixed input signature,
+which applies the preprocessing layers (e.g. `Normalization`, `SklearnPCALayer`, `SklearnStandardScaler`)
+and then the model as a whole graph, optionally compiled with XLA.
+Exported models are loaded with `load_exported`,
+without the python code of the models (and their custom layers),
+and can be used in place of a keras model for inference.
+"""
+from __future__ import annotations
+
+from typing import Callable
+import numpy as np
+import tensorflow as tf
+import tensorflow.keras as keras
+
+
+SERVING_KEY = 'serving_default'
+INPUT_NAME = 'inputs'
+OUTPUT_NAME = 'outputs'
+
+
+class _ExportModule(tf.Module):
+    def __init__(self,
+                 model: keras.Model,
+                 preprocessing: list[keras.layers.Layer],
+                 postprocessing: Callable | None) -> None:
+        super().__init__()
+        self.model = model
+        self.preprocessing = preprocessing
+        self._postprocessing = postprocessing
+
+    def __call__(self, inputs):
+        x = inputs
+        for layer in self.preprocessing:
+            x = layer(x, training=False)
+
+        outputs = self.model(x, training=False)
+        if self._postprocessing is not None:
+            outputs = self._postprocessing(outputs)
+
+        # Signatures always output a dictionary.
+        return outputs if isinstance(outputs, dict) else {OUTPUT_NAME: outputs}
+
+
+def export_saved_model(
+        model: keras.Model,
+        path: str,
+        preprocessing: list[keras.layers.Layer] = None,
+        postprocessing: Callable = None,
+        input_shape: tuple[int, ...] = None,
+        batch_size: int | None = None,
+        jit_compile: bool = False) -> None:
+    """
+    Export the given model as a SavedModel.
+
+    Parameters
+    ==========
+    model: keras.Model
+        Trained model.
+    path: str
+        Path to output SavedModel directory.
+    preprocessing: list[keras.layers.Layer]
+        Preprocessing layers applied (in order) to the input before the model.
+    postprocessing: Callable
+        Function applied to the model's output, it must be traceable by `tf.function`.
+    input_shape: tuple[int, ...]
+        Shape of the input (without the batch dimension),
+        required when there are preprocessing layers, otherwise default to the model's input shape.
+    batch_size: int | None
+        If given, the batch dimension is also fixed,
+        so the function is compiled only once, and `ExportedModel` pads the last batch.
+    jit_compile: bool
+        Whether to compile the function with XLA. Default to False.
+        XLA is worth enabling for inference on GPU,
+        on CPU, convolutions compiled by XLA are much slower than the default (oneDNN) kernels.
+    """
+    preprocessing = preprocessing or []
+    assert not isinstance(model.input, (list, dict)), 'Only model with a single input can be exported.'
+    if input_shape is None:
+        assert len(preprocessing) == 0, '`input_shape` is required when there are preprocessing layers.'
+        input_shape = model.input_shape[1:]
+
+    module = _ExportModule(model, preprocessing, postprocessing)
+    serve = tf.function(
+        module.__call__,
+        input_signature=[tf.TensorSpec((batch_size,) + tuple(input_shape), tf.float32, name=INPUT_NAME)],
+        jit_compile=jit_compile)
+
+    tf.saved_model.save(module, path, signatures={SERVING_KEY: serve.get_concrete_function()})
+
+
+class ExportedModel:
+    """
+    Model exported by `export_saved_model`.
+    It implements `predict` and `predict_on_batch` like keras models,
+    so it can be used in place of a keras model for inference.
+    """
+    def __init__(self, path: str) -> None:
+        self._saved_model = tf.saved_model.load(path)
+        self._serve = self._saved_model.signatures[SERVING_KEY]
+
+        spec = self._serve.structured_input_signature[1][INPUT_NAME]
+        self.input_shape = tuple(spec.shape.as_list())
+        self.batch_size = self.input_shape[0]
+
+    def __call__(self, inputs, training=False):
+        outputs = self._serve(**{INPUT_NAME: tf.convert_to_tensor(inputs, dtype=tf.float32)})
+        return outputs[OUTPUT_NAME] if list(outputs.keys()) == [OUTPUT_NAME] else outputs
+
+    def predict_on_batch(self, X: np.ndarray):
+        return self.predict(X)
+
+    def predict(self, X: np.ndarray, batch_size: int = 32, **kwargs):
+        """
+        Predict the given inputs, batch by batch.
+
+        Parameters
+        ==========
+        X: np.ndarray
+            Inputs of shape (N, ...).
+        batch_size: int
+            Number of inputs per batch, ignored when the batch size is fixed by the export.
+        """
+        X = np.asarray(X, dtype=np.float32)
+        batch_size = self.batch_size or batch_size
+
+        outputs = []
+        for i in range(0, len(X), batch_size):
+            batch = X[i:i + batch_size]
+            nb_samples = len(batch)
+
+            # Pad the last batch, so it matches the fixed batch size.
+            if self.batch_size is not None and nb_samples < self.batch_size:
+                padding = np.zeros((self.batch_size - nb_samples,) + batch.shape[1:], dtype=batch.dtype)
+                batch = np.concatenate([batch, padding])
+
+            outputs.append(tf.nest.map_structure(lambda o: o[:nb_samples].numpy(), self(batch)))
+
+        return tf.nest.map_structure(lambda *o: np.concatenate(o), *outputs)
+
+
+def load_exported(path: str) -> ExportedModel:
+    return ExportedModel(path)
@@ -0,0 +1,136 @@
+"""
+Run several trained models over the same data, decoding each batch only once.
+
+Each batch of the dataset is decoded once and fed to all the models in a single `tf.function`,
+models trained on a subset of channels get their channels sliced (in graph) from the full tensor.
+Thus, evaluating N models costs one data pass plus N forward passes.
+
+    >>> full_subset = OrderedDict(absvprs=(900, 750), rhprs=(750,), tmpsfc=True)
+    >>> runner = FanOutInference([
+    ...     FanOutModel('resnet_all', resnet_all),
+    ...     FanOutModel('resnet_absv', resnet_absv, channels=channel_indices(full_subset, dict(absvprs=(900, 750)))),
+    ... ])
+    >>> predictions = runner.run(test_ds, 'predictions.parquet')
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+from typing import Callable
+
+
+def subset_channels(subset: dict) -> list[tuple[str, float | None]]:
+    """
+    List channels of the tensor given by `extract_variables_from_dataset` with the given subset,
+    each channel is (variable, level), level is None for variables without levels.
+    """
+    channels = []
+    for key, lev in subset.items():
+        if isinstance(lev, bool):
+            if lev:
+                channels.append((key, None))
+        else:
+            channels.extend((key, l) for l in lev)
+
+    return channels
+
+
+def channel_indices(full_subset: dict, subset: dict) -> list[int]:
+    """
+    Indices of the channels of `subset` in the tensor extracted with `full_subset`.
+    """
+    full_channels = {channel: i for i, channel in enumerate(subset_channels(full_subset))}
+    channels = subset_channels(subset)
+
+    missing = [c for c in channels if c not in full_channels]
+    assert len(missing) == 0, f'Channels {missing} are not in the full subset.'
+    return [full_channels[c] for c in channels]
+
+
+@dataclass
+class FanOutModel:
+    """
+    Parameters
+    ==========
+    name: str
+        Name of the model, used as column name of its predictions.
+    model: Callable
+        Keras model, or any model that can be called on tensors in graph (e.g. `export.ExportedModel`).
+    channels: list[int] | None
+        Indices of the channels the model takes from the full tensor, None means all channels.
+    from_logits: bool
+        Whether sigmoid should be applied to the model's output.
+    """
+    name: str
+    model: Callable
+    channels: list[int] | None = None
+    from_logits: bool = False
+
+
+class FanOutInference:
+    def __init__(self, models: list[FanOutModel]) -> None:
+        names = [m.name for m in models]
+        assert len(set(names)) == len(names), 'Models must have unique names.'
+        self._models = models
+
+    @tf.function(reduce_retracing=True)
+    def _predict_batch(self, X):
+        outputs = {}
+        for m in self._models:
+            inputs = X if m.channels is None else tf.gather(X, m.channels, axis=-1)
+            pred = m.model(inputs, training=False)
+            pred = tf.reshape(pred, (tf.shape(X)[0], -1))
+            outputs[m.name] = tf.sigmoid(pred) if m.from_logits else pred
+
+        return outputs
+
+    def run(self, dataset: tf.data.Dataset, output_path: str | None = None) -> pd.DataFrame:
+        """
+        Predict the batched dataset of either X or (X, y) with all the models.
+
+        Returns
+        =======
+        A dataframe with one row for each sample, containing:
+            * `y`: label of the sample (if available).
+            * `<model name>`: predictions of each model,
+              or `<model name>_<i>` for models with several outputs.
+        If `output_path` is given, the result is also saved as .parquet or .csv file.
+        """
+        labels = []
+        predictions = {m.name: [] for m in self._models}
+        for batch in dataset.prefetch(tf.data.AUTOTUNE):
+            if isinstance(batch, (tuple, list)):
+                X, y, *_ = batch
+                labels.append(np.reshape(y.numpy(), (len(y), -1)))
+            else:
+                X = batch
+
+            outputs = self._predict_batch(tf.cast(X, tf.float32))
+            for name, pred in outputs.items():
+                predictions[name].append(pred.numpy())
+
+        columns = {}
+        if len(labels) > 0:
+            labels = np.concatenate(labels)
+            if labels.shape[-1] == 1:
+                columns['y'] = labels[:, 0]
+            else:
+                columns.update({f'y_{i}': labels[:, i] for i in range(labels.shape[-1])})
+
+        for name, pred in predictions.items():
+            pred = np.concatenate(pred)
+            if pred.shape[-1] == 1:
+                columns[name] = pred[:, 0]
+            else:
+                columns.update({f'{name}_{i}': pred[:, i] for i in range(pred.shape[-1])})
+
+        result = pd.DataFrame(columns)
+        if output_path is not None:
+            if output_path.endswith('.parquet'):
+                result.to_parquet(output_path, index=False)
+            else:
+                result.to_csv(output_path, index=False)
+
+        return result
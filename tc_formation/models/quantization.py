@@ -0,0 +1,259 @@
+"""
+Post-training quantization of trained models to TFLite for CPU inference.
+
+Supported modes:
+    * "float": no quantization, used as baseline for TFLite latency.
+    * "dynamic": weights are quantized to int8, activations are quantized on the fly.
+    * "int8": weights and activations are quantized to int8, including inputs and outputs,
+      requires a representative dataset to calibrate activations' ranges.
+    * "int8_fallback": same as "int8", but operations without int8 kernels
+      (e.g. MaxPool3D in Unet3D) are kept in float, and inputs/outputs are float.
+
+The representative dataset and test split should be taken from the same loaders used in training,
+for instance:
+    >>> val_ds = dataloader.load_dataset(val_path, batch_size=256)
+    >>> test_ds = dataloader.load_dataset(test_path, batch_size=256)
+    >>> compare_quantization(model, test_ds, representative_dataset(val_ds), from_logits=True)
+"""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+from sklearn import metrics
+import tensorflow as tf
+import tensorflow.keras as keras
+import time
+from typing import Callable
+
+
+QUANTIZATION_MODES = ('float', 'dynamic', 'int8', 'int8_fallback')
+
+
+def representative_dataset(dataset: tf.data.Dataset, nb_samples: int = 256) -> Callable:
+    """
+    Create the representative dataset from a batched dataset of (X, y) given by data loaders.
+    """
+    def gen():
+        samples = dataset.unbatch().map(lambda X, *_: X).take(nb_samples)
+        for X in samples:
+            yield [tf.cast(X[None, ...], tf.float32)]
+
+    return gen
+
+
+def quantize(model: keras.Model,
+             mode: str = 'dynamic',
+             representative_data: Callable = None,
+             preprocessing: list[keras.layers.Layer] = None,
+             input_shape: tuple[int, ...] = None) -> bytes:
+    """
+    Convert the given model to a quantized TFLite model.
+
+    Parameters
+    ==========
+    model: keras.Model
+        Trained model.
+    mode: str
+        One of `QUANTIZATION_MODES`.
+    representative_data: Callable
+        Representative dataset created by `representative_dataset`,
+        required for "int8" and "int8_fallback" modes.
+    preprocessing: list[keras.layers.Layer]
+        Preprocessing layers applied (in order) to the input before the model,
+        they are converted together with the model.
+    input_shape: tuple[int, ...]
+        Shape of the input (without the batch dimension), required when there are preprocessing layers.
+
+    Returns
+    =======
+    Content of the TFLite model.
+    """
+    assert mode in QUANTIZATION_MODES, f'Invalid quantization mode: {mode}'
+
+    model = _with_preprocessing(model, preprocessing, input_shape)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if mode != 'float':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if mode in ('int8', 'int8_fallback'):
+        assert representative_data is not None, f'Representative dataset is required for {mode} quantization.'
+        converter.representative_dataset = representative_data
+
+    if mode == 'int8':
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+    elif mode == 'int8_fallback':
+        converter.target_spec.supported_ops = [
+            tf.lite.OpsSet.TFLITE_BUILTINS_INT8,
+            tf.lite.OpsSet.TFLITE_BUILTINS,
+            tf.lite.OpsSet.SELECT_TF_OPS,
+        ]
+
+    return converter.convert()
+
+
+def _with_preprocessing(model: keras.Model,
+                        preprocessing: list[keras.layers.Layer] | None,
+                        input_shape: tuple[int, ...] | None) -> keras.Model:
+    if not preprocessing:
+        return model
+
+    assert input_shape is not None, '`input_shape` is required when there are preprocessing layers.'
+    inputs = keras.Input(input_shape)
+    x = inputs
+    for layer in preprocessing:
+        x = layer(x)
+
+    return keras.Model(inputs, model(x), name=model.name)
+
+
+class TFLiteModel:
+    """
+    Run a TFLite model like a keras model for inference,
+    inputs and outputs are (de)quantized if necessary.
+    """
+    def __init__(self, content: bytes, num_threads: int | None = None) -> None:
+        self._content = content
+        self.size = len(content)
+        self._interpreter = tf.lite.Interpreter(model_content=content, num_threads=num_threads)
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size = None
+
+        self.input_shape = (None,) + tuple(self._input['shape'][1:])
+
+    @classmethod
+    def load(cls, path: str, num_threads: int | None = None) -> TFLiteModel:
+        with open(path, 'rb') as f:
+            return cls(f.read(), num_threads)
+
+    def save(self, path: str) -> None:
+        with open(path, 'wb') as f:
+            f.write(self._content)
+
+    def _resize(self, batch_size: int) -> None:
+        if batch_size != self._batch_size:
+            self._interpreter.resize_tensor_input(self._input['index'], (batch_size,) + self.input_shape[1:])
+            self._interpreter.allocate_tensors()
+            self._batch_size = batch_size
+
+    def predict_on_batch(self, X: np.ndarray) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float32)
+        self._resize(len(X))
+
+        dtype = self._input['dtype']
+        if dtype != np.float32:
+            scale, zero_point = self._input['quantization']
+            info = np.iinfo(dtype)
+            X = np.clip(np.round(X / scale + zero_point), info.min, info.max).astype(dtype)
+
+        self._interpreter.set_tensor(self._input['index'], X)
+        self._interpreter.invoke()
+        pred = self._interpreter.get_tensor(self._output['index'])
+
+        if self._output['dtype'] != np.float32:
+            scale, zero_point = self._output['quantization']
+            pred = (pred.astype(np.float32) - zero_point) * scale
+
+        return pred
+
+    def predict(self, X: np.ndarray, batch_size: int = 32, **kwargs) -> np.ndarray:
+        return np.concatenate([self.predict_on_batch(X[i:i + batch_size])
+                               for i in range(0, len(X), batch_size)])
+
+
+def evaluate(model, dataset: tf.data.Dataset, threshold: float = 0.5, from_logits: bool = False) -> dict:
+    """
+    Evaluate accuracy and F1 score of the given model (keras model or `TFLiteModel`)
+    on a batched dataset of (X, y).
+    For grid outputs (e.g. Unet), every grid point is considered as a sample.
+    """
+    y_true, y_pred = [], []
+    for X, y in dataset:
+        pred = model.predict_on_batch(X.numpy())
+        y_pred.append(np.reshape(pred, (-1, np.shape(pred)[-1])))
+        y_true.append(np.reshape(y.numpy(), (len(y_pred[-1]), -1)))
+
+    y_true = np.concatenate(y_true)
+    y_pred = np.concatenate(y_pred)
+
+    # Binary output with probability (or logits) of the positive class,
+    # otherwise, softmax output.
+    if y_pred.shape[-1] == 1:
+        threshold = np.log(threshold / (1 - threshold)) if from_logits else threshold
+        y_true = y_true[:, 0] > 0.5
+        y_pred = y_pred[:, 0] >= threshold
+    else:
+        y_true = np.argmax(y_true, axis=-1)
+        y_pred = np.argmax(y_pred, axis=-1)
+
+    return dict(
+        accuracy=metrics.accuracy_score(y_true, y_pred),
+        f1_score=metrics.f1_score(y_true, y_pred, average='binary' if y_true.max() <= 1 else 'macro'),
+    )
+
+
+def measure_latency(model, X: np.ndarray, repeats: int = 10) -> float:
+    """
+    Measure the median latency (in seconds) to predict the given batch.
+    """
+    model.predict_on_batch(X)
+
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model.predict_on_batch(X)
+        latencies.append(time.perf_counter() - start)
+
+    return float(np.median(latencies))
+
+
+def compare_quantization(model: keras.Model,
+                         test_dataset: tf.data.Dataset,
+                         representative_data: Callable,
+                         modes: tuple[str, ...] = ('float', 'dynamic', 'int8'),
+                         preprocessing: list[keras.layers.Layer] = None,
+                         input_shape: tuple[int, ...] = None,
+                         threshold: float = 0.5,
+                         from_logits: bool = False,
+                         num_threads: int | None = None) -> tuple[pd.DataFrame, dict[str, TFLiteModel]]:
+    """
+    Quantize the model with each of the given modes,
+    and compare F1 score, accuracy, latency (on one batch of the test dataset) and size
+    against the keras model on the test dataset.
+
+    Returns
+    =======
+    A dataframe with one row for each mode, and the quantized models.
+    """
+    model = _with_preprocessing(model, preprocessing, input_shape)
+
+    X, *_ = next(iter(test_dataset))
+    X = X.numpy()
+
+    reference = evaluate(model, test_dataset, threshold, from_logits)
+    rows = [dict(
+        mode='keras',
+        **reference,
+        latency=measure_latency(model, X),
+        size=sum(w.nbytes for w in model.get_weights()))]
+
+    quantized_models = {}
+    for mode in modes:
+        quantized = TFLiteModel(
+            quantize(model, mode, representative_data),
+            num_threads=num_threads)
+        quantized_models[mode] = quantized
+
+        rows.append(dict(
+            mode=mode,
+            **evaluate(quantized, test_dataset, threshold, from_logits),
+            latency=measure_latency(quantized, X),
+            size=quantized.size))
+
+    results = pd.DataFrame(rows).set_index('mode')
+    results['accuracy_delta'] = results['accuracy'] - reference['accuracy']
+    results['f1_score_delta'] = results['f1_score'] - reference['f1_score']
+    results['speedup'] = results.loc['keras', 'latency'] / results['latency']
+    return results, quantized_models
@@ -17,6 +17,7 @@ def _ResNet(stack_fn,
             pooling=None,
             classes=1000,
             classifier_activation='softmax',
+            stem_channels=64,
             **kwargs):
     """Instantiates the ResNet, ResNetV2, and ResNeXt architecture.
 
@@ -57,6 +58,7 @@ def _ResNet(stack_fn,
         `classifier_activation=None` to return the logits of the "top" layer.
         When loading pretrained weights, `classifier_activation` can only
         be `None` or `"softmax"`.
+      stem_channels: number of channels of the first convolution layer.
       **kwargs: For backwards compatibility only.
     Returns:
       A `keras.Model` instance.
@@ -76,7 +78,7 @@ def _ResNet(stack_fn,
 
     x = layers.ZeroPadding2D(
         padding=((3, 3), (3, 3)), name='conv1_pad')(img_input)
-    x = layers.Conv2D(64, 7, strides=2, use_bias=use_bias,
+    x = layers.Conv2D(stem_channels, 7, strides=2, use_bias=use_bias,
                       name='conv1_conv')(x)
 
     if not preact:
@@ -329,6 +331,36 @@ def ConfigurableResNet18v2(include_top=True,
                    input_tensor, input_shape, pooling, classes, **kwargs)
 
 
+def ConfigurableResNet(include_top=True,
+             input_tensor=None,
+             input_shape=None,
+             pooling=None,
+             classes=1000,
+             kernel_size=3,
+             starting_channels=64,
+             blocks=(2, 2, 2, 2),
+             model_name='resnet',
+             **kwargs):
+    """
+    Instantiates a ResNet with configurable width and depth.
+    `blocks` is the number of residual blocks of each stack,
+    the number of channels starts at `starting_channels` (including the first convolution layer),
+    and is doubled after each stack.
+    """
+
+    def stack_fn(x):
+        for i, nb_blocks in enumerate(blocks):
+            x = _stack0v2(x, starting_channels * 2**i, nb_blocks,
+                          kernel_size=kernel_size,
+                          stride1=1 if i == 0 else 2,
+                          name=f'conv{i + 2}')
+        return x
+
+    return _ResNet(stack_fn, False, True, model_name, include_top,
+                   input_tensor, input_shape, pooling, classes,
+                   stem_channels=starting_channels, **kwargs)
+
+
 # def ResNet34(include_top=True,
 #              input_tensor=None,
 #              input_shape=None,
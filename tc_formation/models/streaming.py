@@ -0,0 +1,126 @@
+"""
+Streaming inference for time-distributed models over consecutive timesteps.
+
+Models such as `UnetTimeDistributed` apply the same per-frame network (wrapped in `TimeDistributed`)
+to each of the T frames of a (T, H, W, C) window, and then fuse the per-frame features.
+When consecutive timesteps are scored, two successive windows share T - 1 frames,
+so the per-frame features of each frame are computed only once here,
+and kept in a ring buffer of the last T frames;
+each new window then only costs one per-frame pass plus the (cheap) fusion part.
+
+Predictions are the same as predicting each window with the original model:
+    >>> streaming = StreamingTemporalModel(model)
+    >>> for frame in frames:
+    ...     pred = streaming.step(frame[None, ...])
+
+Models mixing timesteps inside their encoder (e.g. `Unet3D`, whose Conv3D see neighbouring frames)
+have no per-frame features to reuse, and are not supported.
+"""
+from __future__ import annotations
+
+from collections import deque
+import numpy as np
+import tensorflow as tf
+import tensorflow.keras as keras
+import tensorflow.keras.layers as layers
+
+
+def split_time_distributed(model: keras.Model) -> tuple[keras.Model, keras.Model]:
+    """
+    Split a model whose input goes directly to a `TimeDistributed` layer.
+
+    Returns
+    =======
+    The per-frame model, taking a single frame of shape (H, W, C),
+    and the fusion model, taking the stacked per-frame features of shape (T, H', W', F).
+    """
+    time_distributed = [layer for layer in model.layers
+                        if isinstance(layer, layers.TimeDistributed) and layer.input is model.input]
+    if len(time_distributed) != 1:
+        raise ValueError('Model input must go to exactly one TimeDistributed layer.')
+
+    time_distributed = time_distributed[0]
+    frame_model = time_distributed.layer
+    if not isinstance(frame_model, keras.Model):
+        frame_model = keras.Sequential([layers.Input(model.input_shape[2:]), frame_model])
+
+    # Raise ValueError if the input is also used without the TimeDistributed layer.
+    fusion_model = keras.Model(time_distributed.output, model.output, name=f'{model.name}_fusion')
+    return frame_model, fusion_model
+
+
+class StreamingTemporalModel:
+    def __init__(self, model: keras.Model) -> None:
+        """
+        Parameters
+        ==========
+        model: keras.Model
+            Trained time-distributed model, taking input of shape (T, H, W, C).
+        """
+        self._frame_model, self._fusion_model = split_time_distributed(model)
+        self.window_size = model.input_shape[1]
+        self._buffer = deque(maxlen=self.window_size)
+
+    def reset(self) -> None:
+        """
+        Clear the ring buffer, e.g. before a new (non consecutive) sequence.
+        """
+        self._buffer.clear()
+
+    @tf.function(reduce_retracing=True)
+    def _encode(self, frames):
+        return self._frame_model(frames, training=False)
+
+    @tf.function(reduce_retracing=True)
+    def _fuse(self, features):
+        return self._fusion_model(features, training=False)
+
+    def step(self, frame: np.ndarray) -> np.ndarray | None:
+        """
+        Push the next frame of shape (batch, H, W, C), i.e. one frame for each of `batch` parallel sequences.
+
+        Returns
+        =======
+        Prediction of the window ending at this frame,
+        or None while fewer than T frames have been pushed since the last `reset`.
+        """
+        self._buffer.append(self._encode(tf.convert_to_tensor(frame, dtype=tf.float32)))
+        if len(self._buffer) < self.window_size:
+            return None
+
+        return self._fuse(tf.stack(list(self._buffer), axis=1)).numpy()
+
+    def predict_sequence(self, frames: np.ndarray, batch_size: int = 32) -> np.ndarray:
+        """
+        Predict all windows of a sequence of consecutive frames,
+        frames are encoded `batch_size` at a time, so memory doesn't grow with the sequence length.
+
+        Parameters
+        ==========
+        frames: np.ndarray
+            Consecutive frames of shape (N, H, W, C).
+        batch_size: int
+            Number of frames encoded (and windows fused) at once.
+
+        Returns
+        =======
+        Predictions of shape (N - T + 1, ...), where prediction i is of the window of frames [i, i + T).
+        """
+        assert len(frames) >= self.window_size, f'Sequence must have at least {self.window_size} frames.'
+
+        predictions = []
+        features = None
+        for i in range(0, len(frames), batch_size):
+            batch = self._encode(tf.convert_to_tensor(frames[i:i + batch_size], dtype=tf.float32))
+
+            # Keep the features of the last T - 1 frames for windows overlapping the next batch.
+            if features is not None:
+                batch = tf.concat([features[len(features) - self.window_size + 1:], batch], axis=0)
+
+            features = batch
+            nb_windows = len(features) - self.window_size + 1
+            if nb_windows > 0:
+                windows = tf.stack([features[j:j + nb_windows] for j in range(self.window_size)], axis=1)
+                predictions.append(self._fuse(windows).numpy())
+
+        return np.concatenate(predictions)
@@ -0,0 +1,224 @@
+"""
+Tiled inference of Unet models (`unet.py`, `unet_3d.py`) over domains larger than the training domain,
+e.g. global grids or extended RCP domains.
+
+The domain is split into overlapping tiles of the model's input size,
+tiles are predicted in chunks whose activations fit within a memory budget,
+and the predictions of overlapping tiles are blended with a window function.
+Thus, the peak memory of the model doesn't depend on the domain size.
+
+The default overlap is twice the receptive field radius of the model (measured by `receptive_field_radius`),
+capped to half of the tile size.
+With the "crop" window, each grid point is taken from the tile(s) where it is the farthest from the tile borders,
+so when the overlap covers twice the receptive field radius,
+and the tile offsets are multiples of the model's total downsampling factor,
+the predictions are the same as untiled predictions
+(of the domain zero padded to a multiple of the downsampling factor, when it isn't one).
+"Hann" and "triangular" windows taper predictions near tile borders instead,
+which hides seams when the receptive field is larger than the tiles.
+"""
+from __future__ import annotations
+
+import numpy as np
+import tensorflow as tf
+import tensorflow.keras as keras
+import tensorflow.keras.layers as layers
+
+
+WINDOWS = ('hann', 'triangular', 'crop')
+
+_POOLING_LAYERS = (layers.MaxPool2D, layers.MaxPool3D, layers.AveragePooling2D, layers.AveragePooling3D)
+_TRANSPOSE_LAYERS = (layers.Conv2DTranspose, layers.Conv3DTranspose)
+
+
+def downsampling_factor(model: keras.Model) -> int:
+    """
+    Total spatial downsampling factor of the model, i.e. the product of strides of its pooling and conv layers.
+    """
+    factor = 1
+    for layer in model.layers:
+        if isinstance(layer, _TRANSPOSE_LAYERS):
+            continue
+        if isinstance(layer, _POOLING_LAYERS + (layers.Conv2D, layers.Conv3D)):
+            factor *= layer.strides[-1]
+
+    return factor
+
+
+def receptive_field_radius(model: keras.Model) -> int:
+    """
+    Measure the receptive field radius (in grid points) of a model with fixed input shape,
+    as the farthest input grid point on which the output at the center of the domain depends.
+    The radius is capped to the size of the domain.
+    """
+    input_shape = model.input_shape[1:]
+    height, width = input_shape[-3:-1]
+    X = tf.random.normal((1,) + tuple(input_shape))
+
+    with tf.GradientTape() as tape:
+        tape.watch(X)
+        pred = model(X, training=False)
+        center = tf.reduce_sum(pred[:, height // 2, width // 2])
+
+    grad = tape.gradient(center, X)
+    dependent = tf.reduce_any(tf.abs(grad) > 0, axis=-1)
+    dependent = tf.reshape(dependent, (-1, height, width))
+    rows, cols = np.nonzero(tf.reduce_any(dependent, axis=0).numpy())
+    return int(max(np.abs(rows - height // 2).max(), np.abs(cols - width // 2).max()))
+
+
+def _window(size: int, overlap: int, kind: str, taper_start: bool, taper_end: bool) -> np.ndarray:
+    i = np.arange(overlap) + 0.5
+    if kind == 'hann':
+        ramp = 0.5 - 0.5 * np.cos(np.pi * i / overlap)
+    elif kind == 'triangular':
+        ramp = i / overlap
+    else:
+        ramp = (i >= overlap // 2).astype(np.float64)
+
+    window = np.ones(size)
+    if taper_start:
+        window[:overlap] = ramp
+    if taper_end:
+        window[size - overlap:] = np.minimum(window[size - overlap:], ramp[::-1])
+
+    return window
+
+
+def _tile_starts(size: int, tile: int, stride: int, factor: int) -> list[int]:
+    if size <= tile:
+        return [0]
+
+    starts = list(range(0, size - tile + 1, stride))
+    if starts[-1] + tile < size:
+        # The last tile is aligned with the others, and zero padded past the end of the domain.
+        starts.append(-(-(size - tile) // factor) * factor)
+
+    return starts
+
+
+def _activation_bytes(model: keras.Model) -> int:
+    # Upper bound of the activations' memory of one sample,
+    # i.e. all layers' outputs are kept at the same time.
+    nb_values = 0
+    for layer in model.layers:
+        for output in tf.nest.flatten(layer.output):
+            nb_values += np.prod(output.shape[1:])
+
+    return int(nb_values) * 4
+
+
+class TiledInference:
+    def __init__(self,
+                 model: keras.Model,
+                 tile_size: tuple[int, int] | None = None,
+                 overlap: int | None = None,
+                 window: str = 'hann',
+                 memory_budget: int = 2**30) -> None:
+        """
+        Parameters
+        ==========
+        model: keras.Model
+            Trained Unet, taking input of shape (H, W, C) or (T, H, W, C), and output of shape (H, W, classes).
+        tile_size: tuple[int, int] | None
+            (height, width) of the tiles, default to the model's input size.
+            Required when the model's input size is not fixed.
+        overlap: int | None
+            Overlap (in grid points) between neighbouring tiles,
+            default to twice the receptive field radius of the model, capped to half of the tile size.
+        window: str
+            Window function to blend overlapping tiles, one of `WINDOWS`.
+        memory_budget: int
+            Memory budget (in bytes) of the model's activations, which sets the number of tiles predicted at once.
+        """
+        assert window in WINDOWS, f'Invalid window: {window}'
+
+        model_tile_size = tuple(model.input_shape[-3:-1])
+        if None in model_tile_size:
+            assert tile_size is not None, '`tile_size` is required when the model input size is not fixed.'
+            # Rebuild the model with fixed input size, to measure its receptive field and memory.
+            weights = model.get_weights()
+            input_shape = tuple(model.input_shape[1:-3]) + tuple(tile_size) + (model.input_shape[-1],)
+            model = keras.models.clone_model(model, input_tensors=layers.Input(input_shape))
+            model.set_weights(weights)
+        else:
+            assert tile_size is None or tuple(tile_size) == model_tile_size, \
+                f'Tile size must be the model input size {model_tile_size}.'
+
+        self._model = model
+        self.tile_size = tuple(model.input_shape[-3:-1])
+        self.factor = downsampling_factor(model)
+
+        if overlap is None:
+            overlap = min(2 * receptive_field_radius(model), min(self.tile_size) // 2)
+        assert overlap < min(self.tile_size), 'Overlap must be smaller than the tile size.'
+        self.overlap = overlap
+        self._window = window
+
+        # Tile offsets are multiples of the downsampling factor, so pooling is aligned between tiles.
+        self.strides = tuple(max((size - overlap) // self.factor * self.factor, 1) for size in self.tile_size)
+        self.batch_size = max(memory_budget // _activation_bytes(model), 1)
+
+    @tf.function(reduce_retracing=True)
+    def _predict_tiles(self, tiles):
+        return self._model(tiles, training=False)
+
+    def _tile_window(self, tile: tuple[int, int], domain_size: tuple[int, int]) -> np.ndarray:
+        (lat, lon), (height, width) = tile, domain_size
+        tile_height, tile_width = self.tile_size
+        lat_window = _window(tile_height, self.overlap, self._window, lat > 0, lat + tile_height < height)
+        lon_window = _window(tile_width, self.overlap, self._window, lon > 0, lon + tile_width < width)
+        return np.outer(lat_window, lon_window).astype(np.float32)
+
+    def predict(self, domain: np.ndarray) -> np.ndarray:
+        """
+        Predict the given domains tile by tile.
+
+        Parameters
+        ==========
+        domain: np.ndarray
+            Domains of shape (batch, ..., lat, lon, channels) or without the batch dimension,
+            where ... are the other input dimensions of the model (e.g. time for Unet3D).
+            It can be a memory-mapped array, only the tiles are loaded into memory.
+
+        Returns
+        =======
+        Predictions of shape (batch, lat, lon, classes).
+        """
+        if np.ndim(domain) == len(self._model.input_shape) - 1:
+            domain = domain[None, ...]
+
+        nb_samples = domain.shape[0]
+        height, width = domain.shape[-3:-1]
+        tile_height, tile_width = self.tile_size
+        tiles = [(lat, lon)
+                 for lat in _tile_starts(height, tile_height, self.strides[0], self.factor)
+                 for lon in _tile_starts(width, tile_width, self.strides[1], self.factor)]
+        jobs = [(i, tile) for i in range(nb_samples) for tile in tiles]
+
+        predictions = None
+        weights = np.zeros((height, width), dtype=np.float32)
+        for start in range(0, len(jobs), self.batch_size):
+            chunk = jobs[start:start + self.batch_size]
+            X = np.stack([self._extract_tile(domain[i], lat, lon) for i, (lat, lon) in chunk])
+            pred = self._predict_tiles(tf.convert_to_tensor(X, dtype=tf.float32)).numpy()
+
+            if predictions is None:
+                predictions = np.zeros((nb_samples, height, width, pred.shape[-1]), dtype=np.float32)
+
+            for p, (i, (lat, lon)) in zip(pred, chunk):
+                window = self._tile_window((lat, lon), (height, width))
+                h, w = min(tile_height, height - lat), min(tile_width, width - lon)
+                predictions[i, lat:lat + h, lon:lon + w] += p[:h, :w] * window[:h, :w, None]
+                if i == 0:
+                    weights[lat:lat + h, lon:lon + w] += window[:h, :w]
+
+        return predictions / weights[None, ..., None]
+
+    def _extract_tile(self, domain: np.ndarray, lat: int, lon: int) -> np.ndarray:
+        tile_height, tile_width = self.tile_size
+        tile = np.asarray(domain[..., lat:lat + tile_height, lon:lon + tile_width, :], dtype=np.float32)
+
+        # Zero pad tiles past the end of the domain.
+        padding = [(0, 0)] * (tile.ndim - 3) + [(0, tile_height - tile.shape[-3]), (0, tile_width - tile.shape[-2]), (0, 0)]
+        return np.pad(tile, padding)
@@ -1,15 +1,14 @@
+from __future__ import annotations
+
 from . import blocks
+from .. import export
 import numpy as np
+import os
 from sklearn import metrics
 import tensorflow as tf
 from tensorflow import keras
 
 
-def normalize_to_dist_pred(pred: np.ndarray, weight: np.ndarray) -> np.ndarray:
-    weight_len = np.linalg.norm(weight)
-    return np.abs(pred) / weight_len
-
-
 class TwinNN:
     def __init__(self, input_shape, fully_connected_hidden_layers, name=None):
         self._base_model = blocks.BaseBlock(input_shape, name=f'{name}_base')
@@ -34,37 +33,89 @@ class TwinNN:
                          neg=self._neg_model.outputs[0]),
             name=name,
         )
+        # Same model, with the embeddings of the base block as another output.
+        self._outputs_model = keras.Model(
+            inputs=self._base_model.inputs,
+            outputs=dict(pos=self._pos_model.outputs[0],
+                         neg=self._neg_model.outputs[0],
+                         embedding=self._base_model.outputs[0]),
+            name=f'{name}_outputs',
+        )
+        self._outputs_step = None
 
     def fit(self, *args, **kwargs):
         """Train the model by delegating the call to `keras.Model.fit`."""
         self._model.fit(*args, **kwargs)
 
-    def predict_raw(self, *args, **kwargs):
-        output = self._model.predict(*args, **kwargs)
-
-        pos_pred = normalize_to_dist_pred(
-            output['pos'],
-            self._pos_output_layer.get_weights()[0])
-        neg_pred = normalize_to_dist_pred(
-            output['neg'],
-            self._neg_output_layer.get_weights()[0])
-
-        return dict(pos=pos_pred, neg=neg_pred)
-
-    def predict(self, *args, **kwargs):
-        output = self.predict_raw(*args, **kwargs)
-        pos_pred = output['pos']
-        neg_pred = output['neg']
-
-        return np.where(pos_pred < neg_pred, 1, -1).flatten()
-
-    def evaluate(self, ds: tf.data.Dataset) -> dict:
-        pred = self.predict(ds)
-        pred = np.where(pred == -1, 0, 1)
-        print(pred, pred.shape)
-        true = np.concatenate(list(ds.map(lambda _, y: y))).flatten()
-        print(true.shape)
-        true = np.where(true == -1, 0, 1)
+    def predict_outputs(self, x, cache_path: str | None = None, batch_size: int = 32) -> dict:
+        """
+        Distances to both branches (`pos`, `neg`), predictions (`pred`), embeddings of the base block (`embedding`)
+        and labels (`true`, if `x` is a dataset of (X, y)), from one pass over the data.
+
+        Parameters
+        ==========
+        x:
+            Batched dataset of X or (X, y), or array of X.
+        cache_path: str | None
+            If given, outputs are loaded from this .npz file if it exists, otherwise saved to it.
+            The cache is not invalidated when the model or the data change.
+        batch_size: int
+            Batch size if `x` is an array.
+        """
+        if cache_path is not None and os.path.isfile(cache_path):
+            with np.load(cache_path) as cached:
+                return dict(cached)
+
+        if not isinstance(x, tf.data.Dataset):
+            x = tf.data.Dataset.from_tensor_slices(x).batch(batch_size)
+
+        if self._outputs_step is None:
+            @tf.function(reduce_retracing=True)
+            def outputs_step(X):
+                output = self._outputs_model(X, training=False)
+                return dict(embedding=output['embedding'], **self._distances_and_prediction(output))
+
+            self._outputs_step = outputs_step
+
+        outputs = {}
+        for batch in x:
+            X, y = batch if isinstance(batch, tuple) else (batch, None)
+            for key, value in self._outputs_step(X).items():
+                outputs.setdefault(key, []).append(value.numpy())
+            if y is not None:
+                outputs.setdefault('true', []).append(np.asarray(y).flatten())
+
+        outputs = {key: np.concatenate(values) for key, values in outputs.items()}
+        if cache_path is not None:
+            tmp_path = f'{cache_path}.tmp.npz'
+            np.savez(tmp_path, **outputs)
+            os.replace(tmp_path, cache_path)
+
+        return outputs
+
+    def predict_raw(self, x, cache_path: str | None = None, batch_size: int = 32, **kwargs):
+        """
+        Distances to both branches (`pos`, `neg`), see `predict_outputs`.
+        Other arguments of `keras.Model.predict` (e.g. `verbose`) are accepted and ignored.
+        """
+        output = self.predict_outputs(x, cache_path=cache_path, batch_size=batch_size)
+        return dict(pos=output['pos'], neg=output['neg'])
+
+    def predict(self, x, cache_path: str | None = None, batch_size: int = 32, **kwargs):
+        """
+        Predictions in {-1, 1}, see `predict_outputs`.
+        Other arguments of `keras.Model.predict` (e.g. `verbose`) are accepted and ignored.
+        """
+        return self.predict_outputs(x, cache_path=cache_path, batch_size=batch_size)['pred']
+
+    def evaluate(self, ds: tf.data.Dataset, cache_path: str | None = None) -> dict:
+        """
+        Precision, recall and F1 of a batched dataset of (X, y) with labels in {-1, 1},
+        from one pass over the data (see `predict_outputs`).
+        """
+        output = self.predict_outputs(ds, cache_path=cache_path)
+        pred = np.where(output['pred'] == -1, 0, 1)
+        true = np.where(output['true'] == -1, 0, 1)
 
         matched = true == pred
         diff = true != pred
@@ -81,6 +132,24 @@ class TwinNN:
             f1_score=metrics.f1_score(true, pred),
         )
 
+    def export(self, path: str, **kwargs):
+        """
+        Export both branches as a SavedModel with `export.export_saved_model`.
+        The exported model outputs the same as `predict_raw` (`pos`, `neg`),
+        and the prediction (`pred`) as `predict`.
+        """
+        export.export_saved_model(
+            self._model,
+            path,
+            postprocessing=self._distances_and_prediction,
+            **kwargs)
+
+    def _distances_and_prediction(self, output: dict) -> dict:
+        pos_pred = tf.abs(output['pos']) / tf.norm(self._pos_output_layer.kernel)
+        neg_pred = tf.abs(output['neg']) / tf.norm(self._neg_output_layer.kernel)
+        pred = tf.where(pos_pred < neg_pred, 1, -1)
+        return dict(pos=pos_pred, neg=neg_pred, pred=tf.reshape(pred, [-1]))
+
     def compile(self, *args, **kwargs):
         """Compile the model before training by delegating the call to `keras.Model.compile`"""
         self._model.compile(*args, **kwargs)
@@ -1,3 +1,4 @@
+import tc_formation.models.checkpointing as checkpointing
 import tensorflow.keras as keras
 import tensorflow.keras.layers as layers
 
@@ -9,8 +10,13 @@ def Unet(
         classifier_activation='softmax',
         decoder_shortcut_mode='add', # 2 possible modes: 'concat' and 'add'
         model_name=None,
-        include_top=True):
+        include_top=True,
+        checkpoint_blocks=None):
     bn_axis = 3 if keras.backend.image_data_format() == 'channels_last' else 1
+    checkpointing.check_checkpoint_blocks(
+            checkpoint_blocks,
+            [f'encoder_blk_{i}' for i in range(len(filters_block))]
+            + [f'decoder_blk_{i}' for i in range(len(filters_block) - 1)])
 
     if input_tensor is None:
         input_img = layers.Input(shape=input_shape)
@@ -24,23 +30,26 @@ def Unet(
     encoder_blocks = []
     x = input_img
     for i, filters in enumerate(filters_block):
-        x = encoder_block(
-                x,
-                filters,
+        x = checkpointing.apply_block(
+                encoder_block,
+                [x],
+                f'encoder_blk_{i}',
+                checkpoint_blocks,
+                filters=filters,
                 pooling=(i != 0), # Shouldn't do pooling in the first encoder layer.
-                has_shortcut=False, # Shortcut right now is broken!
-                name=f'encoder_blk_{i}')
+                has_shortcut=False) # Shortcut right now is broken!
         encoder_blocks.append(x)
 
     # Decoder part.
     for i, (encoder_output, filters) in enumerate(zip(encoder_blocks[:-1][::-1], filters_block[:-1][::-1])):
-        x = decoder_block(
-                x,
-                encoder_output,
-                filters,
+        x = checkpointing.apply_block(
+                decoder_block,
+                [x, encoder_output],
+                f'decoder_blk_{i}',
+                checkpoint_blocks,
+                filters=filters,
                 decoder_shortcut_mode=decoder_shortcut_mode,
-                has_shortcut=False, # Shortcut right now is broken!
-                name=f'decoder_blk_{i}')
+                has_shortcut=False) # Shortcut right now is broken!
 
     # The output part.
     if include_top:
@@ -8,7 +8,8 @@ def UnetTimeDistributed(
         output_classes=2,
         classifier_activation='softmax',
         decoder_shortcut_mode='add', # 2 possible modes: 'concat' and 'add'
-        model_name=None):
+        model_name=None,
+        checkpoint_blocks=None):
     bn_axis = 3 if keras.backend.image_data_format() == 'channels_last' else 1
 
     base_net = unet.Unet(
@@ -16,7 +17,8 @@ def UnetTimeDistributed(
             filters_block=filters_block,
             classifier_activation='softmax',
             decoder_shortcut_mode=decoder_shortcut_mode,
-            include_top=False)
+            include_top=False,
+            checkpoint_blocks=checkpoint_blocks)
 
     inputs = layers.Input(input_shape)
     x = layers.TimeDistributed(base_net)(inputs)
@@ -0,0 +1,207 @@
+"""
+Shared training harness of the experiment scripts.
+
+Plain `model.fit` on small models spends a large part of each step in Python
+(one call of the train function per batch), and the data loaders end in `prefetch(1)`.
+Here, training is configured with `TrainingConfig`:
+    * several train steps are run per call of the train function (`steps_per_execution`),
+    * train steps are compiled with XLA where the ops allow it,
+      by default only on GPU, as XLA convolutions are slower than oneDNN ones on CPU,
+    * bfloat16 mixed precision is used on CPUs (AVX512-BF16 or AMX) and GPUs supporting it,
+      model outputs are kept in float32 so that losses and metrics are computed in float32,
+    * the prefetch depth of the input pipeline is autotuned,
+    * steps per second are reported at each epoch (`steps_per_second` in the history).
+
+For instance:
+    >>> config = TrainingConfig()
+    >>> model = build_model(lambda: resnet.ResNet18(input_shape=data_shape, classes=1), config)
+    >>> compile_model(model, config, optimizer='adam', loss=keras.losses.BinaryCrossentropy())
+    >>> history = fit(model, training, config, epochs=10, validation_data=validation)
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+import time
+from typing import Callable
+
+import numpy as np
+import tensorflow as tf
+import tensorflow.keras as keras
+import tensorflow.keras.layers as layers
+
+
+@dataclass
+class TrainingConfig:
+    # Number of train steps run per call of the train function.
+    steps_per_execution: int = 32
+    # True, False, or 'auto' to compile with XLA on GPU if the model's ops allow it.
+    jit_compile: bool | str = 'auto'
+    # True, False, or 'auto' to train in bfloat16 if the hardware supports it.
+    mixed_precision: bool | str = 'auto'
+    # Prefetch depth of the input pipeline, autotuned by default.
+    prefetch: int = tf.data.AUTOTUNE
+
+
+def _cpu_flags() -> set[str]:
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('flags'):
+                    return set(line.split(':', 1)[1].split())
+    except OSError:
+        pass
+
+    return set()
+
+
+def bfloat16_supported() -> bool:
+    """
+    Whether bfloat16 is computed natively, i.e. on GPUs with compute capability >= 8.0,
+    or on CPUs with AVX512-BF16 or AMX instructions (used by oneDNN).
+    """
+    gpus = tf.config.list_physical_devices('GPU')
+    if gpus:
+        capability = tf.config.experimental.get_device_details(gpus[0]).get('compute_capability', (0, 0))
+        return capability >= (8, 0)
+
+    return bool(_cpu_flags() & {'avx512_bf16', 'amx_bf16'})
+
+
+def _use_mixed_precision(config: TrainingConfig) -> bool:
+    return bfloat16_supported() if config.mixed_precision == 'auto' else bool(config.mixed_precision)
+
+
+def build_model(model_fn: Callable[[], keras.Model], config: TrainingConfig) -> keras.Model:
+    """
+    Build the model returned by `model_fn` with the precision policy of the config.
+    The policy must be set before layers are created, it is restored afterwards.
+    """
+    if not _use_mixed_precision(config):
+        return model_fn()
+
+    previous_policy = keras.mixed_precision.global_policy()
+    keras.mixed_precision.set_global_policy('mixed_bfloat16')
+    try:
+        model = model_fn()
+    finally:
+        keras.mixed_precision.set_global_policy(previous_policy)
+
+    outputs = tf.nest.flatten(model.outputs)
+    if all(output.dtype == tf.float32 for output in outputs):
+        return model
+
+    # Losses and metrics are computed on float32 outputs.
+    outputs = [layers.Activation('linear', dtype='float32', name=f'{output.name.split("/")[0]}_float32')(output)
+               for output in outputs]
+    return keras.Model(model.inputs, outputs if len(outputs) > 1 else outputs[0], name=model.name)
+
+
+def xla_compatible(model: keras.Model, X) -> bool:
+    """
+    Whether the forward and backward passes of the model on the batch `X` can be compiled with XLA.
+    """
+    @tf.function(jit_compile=True)
+    def step(X):
+        with tf.GradientTape() as tape:
+            loss = tf.add_n([tf.reduce_sum(tf.cast(y, tf.float32)) for y in tf.nest.flatten(model(X, training=True))])
+        return tape.gradient(loss, model.trainable_variables)
+
+    try:
+        step(X)
+        return True
+    except (tf.errors.InvalidArgumentError, tf.errors.UnimplementedError, tf.errors.InternalError):
+        return False
+
+
+def compile_model(model: keras.Model, config: TrainingConfig, sample_batch=None, **compile_kwargs) -> None:
+    """
+    Compile the model with multi-step execution and XLA (if enabled).
+
+    Parameters
+    ==========
+    sample_batch:
+        Inputs of one batch, to check that the model can be compiled with XLA when `jit_compile` is 'auto'.
+        Without it, XLA is enabled on GPU.
+    compile_kwargs:
+        Other arguments of `model.compile`, e.g. optimizer, loss and metrics.
+    """
+    jit_compile = config.jit_compile
+    if jit_compile == 'auto':
+        jit_compile = bool(tf.config.list_physical_devices('GPU'))
+        if jit_compile and sample_batch is not None:
+            jit_compile = xla_compatible(model, sample_batch)
+
+    model.compile(
+        steps_per_execution=config.steps_per_execution,
+        jit_compile=jit_compile,
+        **compile_kwargs)
+
+
+def prepare_dataset(dataset: tf.data.Dataset, config: TrainingConfig) -> tf.data.Dataset:
+    """
+    Autotune the input pipeline and its prefetch depth.
+    """
+    options = tf.data.Options()
+    options.autotune.enabled = True
+    options.experimental_optimization.map_parallelization = True
+    return dataset.with_options(options).prefetch(config.prefetch)
+
+
+class StepsPerSecond(keras.callbacks.Callback):
+    """
+    Report the number of train steps per second of each epoch, as `steps_per_second` in the logs.
+    """
+    def __init__(self) -> None:
+        super().__init__()
+        self.steps_per_second = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._start = self._end = time.perf_counter()
+        self._nb_steps = 0
+
+    def on_train_batch_end(self, batch, logs=None):
+        # With multi-step execution, `batch` is the index of the last step of the execution.
+        self._nb_steps = batch + 1
+        # Validation runs after the last train step, and isn't counted.
+        self._end = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        steps_per_second = self._nb_steps / max(self._end - self._start, 1e-9)
+        self.steps_per_second.append(steps_per_second)
+        if logs is not None:
+            logs['steps_per_second'] = steps_per_second
+
+    def mean(self) -> float:
+        """
+        Mean steps per second, without the first epoch which includes tracing.
+        """
+        values = self.steps_per_second[1:] or self.steps_per_second
+        return float(np.mean(values))
+
+
+def fit(model: keras.Model,
+        training: tf.data.Dataset,
+        config: TrainingConfig,
+        validation_data: tf.data.Dataset | None = None,
+        callbacks: list[keras.callbacks.Callback] | None = None,
+        verbose: int = 2,
+        **fit_kwargs) -> keras.callbacks.History:
+    """
+    Fit a model compiled with `compile_model`, and report steps per second.
+    """
+    training = prepare_dataset(training, config)
+    if validation_data is not None:
+        validation_data = prepare_dataset(validation_data, config)
+
+    steps_per_second = StepsPerSecond()
+    history = model.fit(
+        training,
+        validation_data=validation_data,
+        callbacks=[steps_per_second] + list(callbacks or []),
+        verbose=verbose,
+        **fit_kwargs)
+
+    if verbose:
+        print(f'{steps_per_second.mean():.2f} train steps per second.')
+
+    return history
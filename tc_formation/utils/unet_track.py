@@ -2,11 +2,25 @@
 This module contains essential functionalities to
 pinpoint the center of Unet's prediction,
 and calculate the probability distribution of those centers.
+
+`UnetPredictionCenter` processes one prediction map at a time.
+`extract_centers` processes a whole tensor of prediction maps at once:
+the blobs of all maps are labelled in one call, and the centers, centroids, peaks and sizes of all blobs
+are computed from one sort of their pixels, into a table with one row per blob.
+`postprocess_predictions` streams batches of predictions to a .parquet table, matching blobs to the truth:
+    >>> centers = postprocess_predictions(
+    ...     (model.predict(X) for X, _ in testing),
+    ...     output_path='outputs/unet_centers.parquet',
+    ...     latitudes=ds['lat'].values, longitudes=ds['lon'].values,
+    ...     truths=truths, max_distance=500)
 """
 from __future__ import annotations
 from ..metrics import bb
 
+from typing import Iterable
 import numpy as np
+import os
+import pandas as pd
 
 
 class UnetPredictionCenter:
@@ -36,7 +50,191 @@ def tc_formation_spatial_distribution(
         centers: list[tuple[float, float]]):
     tc_counts = np.zeros(domain_size, dtype=np.int32)
 
-    for lat, lon in centers:
-        tc_counts[int(lat), int(lon)] += 1
+    centers = np.asarray(centers, dtype=np.float64).reshape((-1, 2)).astype(np.int64)
+    np.add.at(tc_counts, (centers[:, 0], centers[:, 1]), 1)
 
     return tc_counts
+
+
+def _prediction_masks(predictions: np.ndarray, threshold: float):
+    # Same masks as `bb.extract_bounding_boxes`, of shape (N, lat, lon).
+    predictions = np.asarray(predictions)
+    if predictions.shape[-1] == 2:
+        return predictions[..., 1], np.argmax(predictions, axis=-1) == 1
+
+    if predictions.ndim == 4:
+        predictions = predictions[..., 0]
+
+    return predictions, predictions > threshold
+
+
+def _to_degrees(pixels: np.ndarray, degrees: np.ndarray) -> np.ndarray:
+    # Pixel i spans [i, i + 1), and `degrees[i]` is its center.
+    return np.interp(pixels - .5, np.arange(len(degrees)), degrees)
+
+
+def extract_centers(predictions: np.ndarray,
+                    threshold: float = 0.5,
+                    latitudes: np.ndarray | None = None,
+                    longitudes: np.ndarray | None = None,
+                    min_size: int = 1,
+                    start_index: int = 0) -> pd.DataFrame:
+    """
+    Extract the blobs (8-connected components above `threshold`) of all prediction maps at once.
+
+    Parameters
+    ==========
+    predictions: np.ndarray
+        Prediction maps of shape (N, lat, lon) or (N, lat, lon, 1), or (N, lat, lon, 2) as `bb.extract_bounding_boxes`.
+    latitudes, longitudes: np.ndarray | None
+        Coordinates of the grid. If given, locations are in degrees, otherwise in pixel coordinates,
+        where pixel i spans [i, i + 1) as in `UnetPredictionCenter.get_centers`.
+    min_size: int
+        Blobs with fewer pixels are ignored.
+    start_index: int
+        Index of the first prediction map, for batches of a longer run.
+
+    Returns
+    =======
+    Table with one row per blob, ordered by prediction index:
+    the index of its prediction map, its center (center of its bounding box, as `UnetPredictionCenter`),
+    its probability-weighted centroid, its peak and the peak probability, its mean probability and its size.
+    Unlike `UnetPredictionCenter`, holes inside blobs are not counted as blobs.
+    """
+    from scipy import ndimage
+
+    probabilities, masks = _prediction_masks(predictions, threshold)
+    # Blobs are connected within each map, not across maps.
+    structure = np.zeros((3, 3, 3), dtype=bool)
+    structure[1] = True
+    labels, _ = ndimage.label(masks, structure=structure)
+
+    pixels = np.flatnonzero(masks)
+    blobs = labels.ravel()[pixels]
+    values = probabilities.ravel()[pixels].astype(np.float64)
+
+    # Pixels of each blob are contiguous, in raster order.
+    order = np.argsort(blobs, kind='stable')
+    pixels, blobs, values = pixels[order], blobs[order], values[order]
+    starts = np.flatnonzero(np.r_[True, np.diff(blobs) != 0]) if len(blobs) else np.zeros(0, dtype=np.int64)
+    sizes = np.diff(np.r_[starts, len(blobs)])
+
+    index, rows, cols = np.unravel_index(pixels, labels.shape)
+
+    def reduce(ufunc, values):
+        return ufunc.reduceat(values, starts) if len(starts) else values[:0]
+
+    y_min, y_max = reduce(np.minimum, rows), reduce(np.maximum, rows)
+    x_min, x_max = reduce(np.minimum, cols), reduce(np.maximum, cols)
+    total = reduce(np.add, values)
+
+    # First pixel of each blob with its largest probability.
+    peak_values = reduce(np.maximum, values)
+    peaks = np.flatnonzero(values == np.repeat(peak_values, sizes))
+    peaks = peaks[np.r_[True, np.diff(np.searchsorted(starts, peaks, side='right')) != 0]] if len(peaks) else peaks
+
+    table = pd.DataFrame({
+        'Index': index[starts] + start_index,
+        'Latitude': .5 * (y_min + y_max + 1),
+        'Longitude': .5 * (x_min + x_max + 1),
+        'Centroid Latitude': reduce(np.add, values * rows) / total + .5,
+        'Centroid Longitude': reduce(np.add, values * cols) / total + .5,
+        'Peak Latitude': rows[peaks] + .5,
+        'Peak Longitude': cols[peaks] + .5,
+        'Peak Probability': peak_values,
+        'Mean Probability': total / sizes,
+        'Size': sizes,
+    })
+
+    if latitudes is not None:
+        for column in ['Latitude', 'Centroid Latitude', 'Peak Latitude']:
+            table[column] = _to_degrees(table[column].to_numpy(), np.asarray(latitudes))
+    if longitudes is not None:
+        for column in ['Longitude', 'Centroid Longitude', 'Peak Longitude']:
+            table[column] = _to_degrees(table[column].to_numpy(), np.asarray(longitudes))
+
+    table = table[table['Size'] >= min_size]
+    return table.sort_values('Index', kind='stable', ignore_index=True)
+
+
+def _haversine(lat1, lon1, lat2, lon2):
+    # Great-circle distance in km.
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371. * np.arcsin(np.sqrt(a))
+
+
+def match_to_truth(centers: pd.DataFrame,
+                   truths: pd.DataFrame,
+                   max_distance: float | None = None,
+                   in_degrees: bool = True) -> pd.DataFrame:
+    """
+    Distance from each blob center to the nearest true genesis location of the same prediction map.
+
+    Parameters
+    ==========
+    centers: pd.DataFrame
+        Table of `extract_centers`.
+    truths: pd.DataFrame
+        True genesis locations, with columns 'Index' (of the prediction map), 'Latitude' and 'Longitude'.
+    max_distance: float | None
+        Blobs within this distance of a truth are matched.
+    in_degrees: bool
+        Whether locations are in degrees (distances in km), otherwise in pixels (distances in pixels).
+
+    Returns
+    =======
+    `centers` with columns 'Truth Distance' (NaN if the map has no truth) and 'Matched'.
+    """
+    centers = centers.drop(columns=['Truth Distance', 'Matched'], errors='ignore').reset_index(drop=True)
+    pairs = centers[['Index', 'Latitude', 'Longitude']].reset_index().merge(
+        truths[['Index', 'Latitude', 'Longitude']], on='Index', suffixes=('', ' Truth'))
+
+    if in_degrees:
+        distances = _haversine(pairs['Latitude'], pairs['Longitude'], pairs['Latitude Truth'], pairs['Longitude Truth'])
+    else:
+        distances = np.hypot(pairs['Latitude'] - pairs['Latitude Truth'], pairs['Longitude'] - pairs['Longitude Truth'])
+
+    centers['Truth Distance'] = pd.Series(np.asarray(distances), index=pairs['index']).groupby(level=0).min()
+    centers['Matched'] = (centers['Truth Distance'] <= max_distance) if max_distance is not None else False
+    return centers
+
+
+def postprocess_predictions(batches: Iterable[np.ndarray],
+                            output_path: str | None = None,
+                            truths: pd.DataFrame | None = None,
+                            max_distance: float | None = None,
+                            **kwargs) -> pd.DataFrame:
+    """
+    Extract the blobs of batches of prediction maps (see `extract_centers`),
+    match them to the truth (see `match_to_truth`) if given,
+    and write them to a .parquet table as they are processed, if `output_path` is given.
+    Prediction maps are indexed in the order of the batches.
+    Other arguments are passed to `extract_centers`.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    tables, writer, start_index = [], None, 0
+    in_degrees = kwargs.get('latitudes') is not None
+    try:
+        for predictions in batches:
+            table = extract_centers(predictions, start_index=start_index, **kwargs)
+            start_index += len(predictions)
+            if truths is not None:
+                table = match_to_truth(table, truths, max_distance, in_degrees)
+
+            if output_path is not None:
+                arrow_table = pa.Table.from_pandas(table, preserve_index=False)
+                writer = writer or pq.ParquetWriter(f'{output_path}.tmp', arrow_table.schema)
+                writer.write_table(arrow_table)
+
+            tables.append(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is not None:
+        os.replace(f'{output_path}.tmp', output_path)
+
+    return pd.concat(tables, ignore_index=True) if tables else extract_centers(np.zeros((0, 1, 1)))